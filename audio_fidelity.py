@@ -0,0 +1,339 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+
+import av
+import numpy as np
+from scipy import signal
+from scipy.io import wavfile
+
+from audio_output_track import audio_output_track
+from client_web_audio_playback import client_web_audio_playback
+from codec_profiles import codec_profiles
+from constants import constants as CONST
+from frame_build_pool import frame_build_pool
+from shared_bytearray import shared_bytearray
+
+FULL_SCALE = 32767
+# a step at a block boundary this much larger than the reference's step counts as a discontinuity (1% of full scale)
+DISCONTINUITY_THRESHOLD = 328
+MAX_ALIGNMENT_LAG = 4096
+BOUNDARY_WINDOW = 16  # samples either side of a block boundary counted as boundary error
+
+
+class audio_fidelity:
+    """Pushes reference signals through the output pipeline in-process (create_mono_audio_frame, resample, AudioFifo,
+    recv) and measures what comes out of recv() against an ideally resampled copy of the reference.
+
+    The track runs unpaced with the same producer thread the server uses, so a run takes as long as the pipeline's
+    processing rather than the audio's duration. Results report SNR, spectral error, discontinuities at the producer's
+    block boundaries and pts continuity so resampler or framing changes can be checked for audio regressions.
+    """
+
+    SIGNALS = ("sweep", "tone", "wav")
+    # the 48 kHz stereo, 20 ms framing the server builds its track with for Opus
+    OUTPUT_RATE, OUTPUT_CHANNELS, OUTPUT_FRAMES = codec_profiles.OUTPUT_OPUS
+
+    def __init__(self, config: dict, logger: logging.Logger):
+        """Constructor for audio_fidelity
+
+        Args:
+            config (dict): configuration passed to the audio_output_track (e.g., CONST.OFFLOAD_WORKERS)
+            logger (logging.Logger): logger to record status
+        """
+        self.config = config
+        self.logger = logger
+
+    @staticmethod
+    def make_reference(name: str, seconds: float = 3.0) -> np.ndarray:
+        """Returns a 24 kHz mono int16 reference signal
+
+        Args:
+            name (str): sweep (log chirp 50 Hz to 11 kHz), tone (1 kHz) or wav (./playback.wav)
+            seconds (float, optional): length of the synthetic signals. Defaults to 3.0.
+
+        Returns:
+            np.ndarray: the reference samples
+        """
+        if name == "wav":
+            sample_rate, input_data = wavfile.read("./playback.wav")
+            assert sample_rate == CONST.TTS_AUDIO_SAMPLE_RATE
+            if input_data.dtype == np.int16:
+                return input_data
+            return client_web_audio_playback.float2int(input_data.astype(np.float32))
+        t = np.arange(int(seconds * CONST.TTS_AUDIO_SAMPLE_RATE)) / CONST.TTS_AUDIO_SAMPLE_RATE
+        if name == "sweep":
+            wave = signal.chirp(t, f0=50.0, t1=seconds, f1=11000.0, method="logarithmic")
+        elif name == "tone":
+            wave = np.sin(2 * np.pi * 1000.0 * t)
+        else:
+            raise ValueError(f"Unknown signal {name}, expected one of {', '.join(audio_fidelity.SIGNALS)}")
+        return (0.5 * FULL_SCALE * wave).astype(np.int16)
+
+    async def run_pipeline(self, reference: np.ndarray, offload_mode: str) -> tuple[np.ndarray, list, int]:
+        """Runs the reference through an unpaced audio_output_track and collects what recv() returns
+
+        Args:
+            reference (np.ndarray): 24 kHz mono int16 samples
+            offload_mode (str): one of frame_build_pool.MODES
+
+        Returns:
+            tuple[np.ndarray, list, int]: the 48 kHz stereo int16 output (samples, 2), the (pts, samples) of each frame
+                and the output samples in each of the producer's blocks
+        """
+        conv_data = {
+            CONST.PLAYBACK_AUDIO_BUFFER: shared_bytearray(),
+            CONST.CLIENT_WEB_RTC_CONNECTED: asyncio.Event(),
+        }
+        conv_data[CONST.CLIENT_WEB_RTC_CONNECTED].set()
+        track = audio_output_track(
+            self.config,
+            conv_data,
+            asyncio.get_running_loop(),
+            self.logger,
+            frames_per_buffer=audio_fidelity.OUTPUT_FRAMES,
+            channels=audio_fidelity.OUTPUT_CHANNELS,
+            rate=audio_fidelity.OUTPUT_RATE,
+            offload_mode=offload_mode,
+            paced=False,
+        )
+        # the producer takes blocks of the size the server's tracks use, so the seams measured are the ones it sends
+        block_bytes = track.block_bytes
+        block_samples = block_bytes // 2 * audio_fidelity.OUTPUT_RATE // CONST.TTS_AUDIO_SAMPLE_RATE
+        data = reference.tobytes()
+        # the producer only takes whole blocks, any remainder stays in the buffer just as it does in the server
+        blocks = len(data) // block_bytes
+        for start in range(0, blocks * block_bytes, block_bytes):
+            conv_data[CONST.PLAYBACK_AUDIO_BUFFER].extend(data[start : start + block_bytes])
+        expected_samples = blocks * block_samples
+        if offload_mode == frame_build_pool.MODE_ENCODE:
+            # the partial Opus frame at the end is held by the encoder until more audio arrives
+            expected_samples -= expected_samples % audio_fidelity.OUTPUT_FRAMES
+
+        decoder = None
+        resampler = None
+        if offload_mode == frame_build_pool.MODE_ENCODE:
+            decoder = av.CodecContext.create("opus", "r")
+            resampler = av.AudioResampler(
+                format="s16", layout="stereo", rate=CONST.WEB_RTC_AUDIO_SAMPLE_RATE
+            )
+        chunks = []
+        frame_pts = []
+        try:
+            # let the producer finish so recv() never returns silence for an empty fifo
+            deadline = time.monotonic() + 60.0
+            while track.fifo_depth() < expected_samples and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            track.start_stream()
+            received = 0
+            while received < min(expected_samples, track.fifo_depth() + received):
+                frame = await track.recv()
+                frame_pts.append((frame.pts, audio_fidelity.OUTPUT_FRAMES if decoder else frame.samples))
+                if decoder is not None:
+                    for decoded in decoder.decode(frame):
+                        for converted in resampler.resample(decoded):
+                            chunks.append(converted.to_ndarray().reshape(-1, 2))
+                    received += audio_fidelity.OUTPUT_FRAMES
+                else:
+                    chunks.append(frame.to_ndarray().reshape(-1, 2))
+                    received += frame.samples
+        finally:
+            track.close()
+            track.output_processor_thread.join(timeout=5)
+        if not chunks:
+            return np.zeros((0, 2), dtype=np.int16), frame_pts, block_samples
+        return np.concatenate(chunks), frame_pts, block_samples
+
+    @staticmethod
+    def align(output: np.ndarray, reference: np.ndarray) -> int:
+        """Returns the lag of the output relative to the reference that maximizes their cross-correlation
+
+        Args:
+            output (np.ndarray): the output channel
+            reference (np.ndarray): the reference at the output's sample rate
+
+        Returns:
+            int: the lag in samples (positive when the output is delayed)
+        """
+        correlation = signal.correlate(
+            output.astype(np.float64), reference.astype(np.float64), mode="full", method="fft"
+        )
+        zero_lag = reference.size - 1
+        low = max(0, zero_lag - MAX_ALIGNMENT_LAG)
+        high = min(correlation.size, zero_lag + MAX_ALIGNMENT_LAG + 1)
+        window = correlation[low:high]
+        # periodic signals correlate equally well a whole number of periods apart, so take the peak nearest zero lag
+        lags = np.flatnonzero(window >= window.max() * 0.999) + low - zero_lag
+        return int(lags[np.argmin(np.abs(lags))])
+
+    @staticmethod
+    def spectral_error_db(output: np.ndarray, reference: np.ndarray) -> float:
+        """Returns the mean absolute difference in dB between the power spectra of output and reference, over the bins
+        within 60 dB of the reference's peak
+
+        Args:
+            output (np.ndarray): the aligned output
+            reference (np.ndarray): the aligned reference
+
+        Returns:
+            float: the mean spectral error in dB
+        """
+        _, reference_power = signal.welch(reference, fs=CONST.WEB_RTC_AUDIO_SAMPLE_RATE, nperseg=2048)
+        _, output_power = signal.welch(output, fs=CONST.WEB_RTC_AUDIO_SAMPLE_RATE, nperseg=2048)
+        floor = 1e-12
+        reference_db = 10 * np.log10(reference_power + floor)
+        output_db = 10 * np.log10(output_power + floor)
+        significant = reference_db > reference_db.max() - 60.0
+        return float(np.mean(np.abs(output_db[significant] - reference_db[significant])))
+
+    @staticmethod
+    def measure(reference: np.ndarray, output: np.ndarray, frame_pts: list, block_samples: int) -> dict:
+        """Compares the pipeline output with the reference
+
+        Args:
+            reference (np.ndarray): 24 kHz mono int16 reference
+            output (np.ndarray): 48 kHz stereo int16 output of recv(), shape (samples, 2)
+            frame_pts (list): (pts, samples) of each frame returned by recv()
+            block_samples (int): 48 kHz samples in each of the producer's blocks
+
+        Returns:
+            dict: the fidelity measurements
+        """
+        pts_gaps = 0
+        pts_overlaps = 0
+        for (pts, samples), (next_pts, _) in itertools.pairwise(frame_pts):
+            if next_pts > pts + samples:
+                pts_gaps += 1
+            elif next_pts < pts + samples:
+                pts_overlaps += 1
+        result = {
+            "frames": len(frame_pts),
+            "output_samples": int(output.shape[0]),
+            "pts_gaps": pts_gaps,
+            "pts_overlaps": pts_overlaps,
+            "channel_mismatch_samples": int(np.count_nonzero(output[:, 0] != output[:, 1])),
+            "clipped_samples": int(np.count_nonzero(np.abs(output.astype(np.int32)) >= FULL_SCALE)),
+        }
+        if output.shape[0] == 0:
+            return result
+        # band limited 2x interpolation of the whole signal is what the per-block resampler approximates
+        ideal = signal.resample_poly(reference.astype(np.float64), 2, 1)
+        left = output[:, 0].astype(np.float64)
+        lag = audio_fidelity.align(left, ideal)
+        start = max(0, -lag)
+        length = min(ideal.size - start, left.size - start - lag)
+        ideal_part = ideal[start : start + length]
+        output_part = left[start + lag : start + lag + length]
+        error = output_part - ideal_part
+        noise = float(np.sum(error**2))
+        snr_db = (
+            10 * np.log10(float(np.sum(ideal_part**2)) / noise) if noise > 0 else float("inf")
+        )
+        # where the producer's blocks start in the output
+        boundaries = [b - start for b in range(block_samples, ideal.size, block_samples) if start + 1 <= b < start + length]
+        near = np.zeros(length, dtype=bool)
+        discontinuities = 0
+        for boundary in boundaries:
+            near[max(0, boundary - BOUNDARY_WINDOW) : boundary + BOUNDARY_WINDOW] = True
+            step_error = (output_part[boundary] - output_part[boundary - 1]) - (
+                ideal_part[boundary] - ideal_part[boundary - 1]
+            )
+            if abs(step_error) > DISCONTINUITY_THRESHOLD:
+                discontinuities += 1
+        interior_error = float(np.mean(np.abs(error[~near]))) if np.any(~near) else 0.0
+        boundary_error = float(np.mean(np.abs(error[near]))) if np.any(near) else 0.0
+        result.update(
+            {
+                "lag_samples": lag,
+                "snr_db": round(float(snr_db), 2),
+                "spectral_error_db": round(audio_fidelity.spectral_error_db(output_part, ideal_part), 3),
+                "boundaries": len(boundaries),
+                "boundary_discontinuities": discontinuities,
+                "boundary_error_ratio": round(boundary_error / interior_error, 3) if interior_error else 0.0,
+                "max_abs_error": round(float(np.max(np.abs(error))), 1),
+            }
+        )
+        return result
+
+    async def run(self, names: list, offload_mode: str, write_dir: str | None = None) -> dict:
+        """Measures each named signal
+
+        Args:
+            names (list): signal names from audio_fidelity.SIGNALS
+            offload_mode (str): one of frame_build_pool.MODES
+            write_dir (str | None, optional): directory to write each reference and output wav to. Defaults to None.
+
+        Returns:
+            dict: signal name to its measurements
+        """
+        results = {}
+        for name in names:
+            reference = audio_fidelity.make_reference(name)
+            started = time.perf_counter()
+            output, frame_pts, block_samples = await self.run_pipeline(reference, offload_mode)
+            results[name] = audio_fidelity.measure(reference, output, frame_pts, block_samples)
+            results[name]["run_seconds"] = round(time.perf_counter() - started, 3)
+            if write_dir:
+                wavfile.write(
+                    os.path.join(write_dir, f"fidelity_{name}_reference_24.wav"),
+                    CONST.TTS_AUDIO_SAMPLE_RATE,
+                    reference,
+                )
+                wavfile.write(
+                    os.path.join(write_dir, f"fidelity_{name}_{offload_mode}_output_48.wav"),
+                    CONST.WEB_RTC_AUDIO_SAMPLE_RATE,
+                    output,
+                )
+            self.logger.info(f"Fidelity {name} ({offload_mode}): {results[name]}")
+        return results
+
+
+if __name__ == "__main__":
+    """Runs the fidelity harness, e.g.: python audio_fidelity.py --signals sweep tone --min-snr 40"""
+    parser = argparse.ArgumentParser(
+        prog="audio_fidelity", description="Measures the output pipeline against reference signals"
+    )
+    parser.add_argument(
+        "--signals", nargs="+", default=list(audio_fidelity.SIGNALS), choices=audio_fidelity.SIGNALS
+    )
+    parser.add_argument(
+        "--offload", default=frame_build_pool.MODE_NONE, choices=frame_build_pool.MODES,
+        help="where frames are built, as for webrtcsvr.py --offload",
+    )
+    parser.add_argument("--min-snr", type=float, default=None, help="exit with 1 if any signal's SNR (dB) is lower")
+    parser.add_argument(
+        "--max-discontinuities", type=int, default=None,
+        help="exit with 1 if any signal has more boundary discontinuities",
+    )
+    parser.add_argument("--write-dir", default=None, help="directory to write the reference and output wav files")
+    parser.add_argument("--output", default=None, help="file to write the JSON results to (default stdout)")
+    params = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    harness = audio_fidelity({CONST.OFFLOAD_WORKERS: 1}, logging.getLogger("audio_fidelity"))
+    try:
+        results = asyncio.run(harness.run(params.signals, params.offload, params.write_dir))
+    finally:
+        frame_build_pool.shutdown_pool()
+    text = json.dumps(results, indent=2)
+    if params.output:
+        with open(params.output, "w") as handle:
+            handle.write(text)
+    else:
+        print(text)
+    failed = [
+        name
+        for name, result in results.items()
+        if (params.min_snr is not None and result.get("snr_db", float("-inf")) < params.min_snr)
+        or (
+            params.max_discontinuities is not None
+            and result.get("boundary_discontinuities", 0) > params.max_discontinuities
+        )
+    ]
+    if failed:
+        print(f"Fidelity below threshold for: {', '.join(failed)}")
+        sys.exit(1)
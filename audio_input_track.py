@@ -1,5 +1,7 @@
 from aiortc import MediaStreamTrack
 
+from call_recorder import call_recorder
+
 
 class audio_input_track(MediaStreamTrack):
     """
@@ -8,11 +10,20 @@ class audio_input_track(MediaStreamTrack):
 
     kind = "audio"
 
-    def __init__(self, track):
+    def __init__(self, track, recorder: call_recorder | None = None):
+        """Constructor for audio_input_track
+
+        Args:
+            track (MediaStreamTrack): the remote track received from the web browser
+            recorder (call_recorder | None, optional): recorder handed each received frame. Defaults to None.
+        """
         super().__init__()
         self.track = track
+        self.recorder = recorder
 
     async def recv(self):
         """Receives audio from the web browser to be forwarded"""
         stereo_frame = await self.track.recv()
+        if self.recorder is not None:
+            self.recorder.add(call_recorder.LEG_INBOUND, stereo_frame)
         return stereo_frame
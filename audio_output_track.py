@@ -1,16 +1,23 @@
 import asyncio
+from collections import deque
+from concurrent.futures import Future
 import fractions
+import logging
+import math
 from logging import Logger
-from threading import Thread
+from threading import Event, Lock, Thread
 import time
-from aiortc import MediaStreamTrack, RTCPeerConnection
+from aiortc import MediaStreamTrack, RTCPeerConnection, RTCRtpSender
 import numpy as np
-from av import AudioFifo, AudioFrame
+from av import AudioFifo, AudioFrame, Packet
 from av.frame import Frame
+from call_recorder import call_recorder
+from capture_writer import capture_session
+from clock_drift import clock_drift
 from constants import constants as CONST
+from frame_build_pool import frame_build_pool, frame_build_session
 from scipy import signal
-
-DEBUG_FILES = False
+from time_stretch import time_stretch
 
 
 class audio_output_track(MediaStreamTrack):
@@ -31,17 +38,50 @@ class audio_output_track(MediaStreamTrack):
         rate: int = CONST.WEB_RTC_AUDIO_SAMPLE_RATE,
         output: bool = True,
         start: bool = False,
+        offload_mode: str = frame_build_pool.MODE_NONE,
+        paced: bool = True,
+        frame_builder: frame_build_session | None = None,
+        dtx: bool = False,
     ):
         super().__init__()
         self.config = config
         self.client_conv_data = client_conv_data
         self.ioloop = ioloop
         self.logger = logger
+        self.frame_logger = logging.getLogger(CONST.FRAME_LOGGER_NAME)
         self.frames_per_buffer = frames_per_buffer
         self.channels = channels
+        self.layout = "stereo" if channels == CONST.AUDIO_CHANNELS_STEREO else "mono"
+        # 48 kHz stereo for Opus, or the codec's own rate (e.g., 8 kHz mono for G.711) so the encoder need not resample
         self.rate = rate
+        # 24 kHz mono bytes the producer takes at a time, two frames of output
+        self.block_bytes = audio_output_track.block_bytes_for(self.frames_per_buffer, self.rate)
         self.output = output
         self.start = start
+        # none: build frames here, frames: resample in the frame_build_pool, encode: also Opus encode there
+        self.offload_mode = offload_mode
+        # prepared by the warm_pool, otherwise created when processing starts
+        self.frame_builder = frame_builder
+        # (opus packet bytes, producer pts) built by the frame_build_pool when offload_mode is encode
+        self.packet_queue = deque()
+        # pts of the next frame or packet returned by recv(), on the send timeline
+        self.send_pts = 0
+        self.underrun = False
+        # True stops sending silence after DTX_HANGOVER_FRAMES, but for a keepalive frame every DTX_KEEPALIVE_SECONDS
+        self.dtx = dtx
+        self.silent_frames = 0
+        # when the stretch dtx is suppressing began
+        self.dtx_start = None
+        # while more than latency_target_ms is buffered, the 24 kHz audio is played up to max_speed times faster
+        self.latency_target_ms = config.get(CONST.LATENCY_TARGET_MS, 0.0)
+        self.max_speed = config.get(CONST.MAX_SPEED, CONST.DEFAULT_MAX_SPEED)
+        self.stretcher = (
+            time_stretch(CONST.TTS_AUDIO_SAMPLE_RATE) if self.latency_target_ms > 0 and self.max_speed > 1.0 else None
+        )
+        # resamples the 24 kHz audio by a fraction of a percent so the buffered depth does not drift
+        self.drift = clock_drift(self.latency_target_ms) if config.get(CONST.DRIFT_CORRECTION, False) else None
+        # False returns frames as fast as recv() is called (used by audio_fidelity to run the pipeline offline)
+        self.paced = paced
 
         self.closed = False
         self.kind = "audio"
@@ -49,6 +89,31 @@ class audio_output_track(MediaStreamTrack):
         self.started_recording = False
         self.audio_fifo = AudioFifo()
         self.is_playing_back = False
+        self.frame_timing = client_conv_data.get(CONST.FRAME_TIMING, None)
+        self.metrics = client_conv_data.get(CONST.SESSION_METRICS, None)
+        # stage taps switched on at runtime, writing wav files from a background thread
+        self.capture = client_conv_data.get(CONST.CAPTURE_SESSION, None)
+        # compliance recording of what is sent, fed the frames returned by recv()
+        self.recorder = client_conv_data.get(CONST.CALL_RECORDER, None)
+        # sends what recv() returns over the data channel too, set by the server when the client asks for it
+        self.datachannel_audio = None
+        # pacing reference used to count late frames
+        self.send_clock_start = None
+        self.samples_sent = 0
+        # samples of audio (not silence) at self.rate written by the producer, returned by recv() and sent by the sender
+        self.queued_samples = 0
+        self.handed_samples = 0
+        self.played_samples = 0
+        # expect_playout() futures waiting for the producer to reach the end of the buffered audio, and those
+        # waiting for a played_samples target
+        self.playout_lock = Lock()
+        self.playout_requested = False
+        self.playout_padding = 0
+        self.playout_unmarked = []
+        self.playout_targets = []
+        self.sender_attached = False
+        # wakes the producer when audio is added or a playout is expected
+        self.wakeup = Event()
 
         # spin off a thread to process data and fill the audio_fifo
         self.output_processor_thread = Thread(
@@ -56,6 +121,19 @@ class audio_output_track(MediaStreamTrack):
         )
         self.output_processor_thread.start()
 
+    @staticmethod
+    def block_bytes_for(frames_per_buffer: int, rate: int) -> int:
+        """Returns the 24 kHz mono s16 bytes the producer takes at a time for an output format: two frames' worth
+
+        Args:
+            frames_per_buffer (int): samples per output frame
+            rate (int): the output sample rate
+
+        Returns:
+            int: the bytes in one block
+        """
+        return frames_per_buffer * 4 * CONST.TTS_AUDIO_SAMPLE_RATE // rate
+
     @staticmethod
     def create_mono_audio_frame(mono_bytes_24000, sample_width=2):
         # build a mono frame
@@ -94,9 +172,120 @@ class audio_output_track(MediaStreamTrack):
 
         return stereo_audio_frame
 
+    @staticmethod
+    def resample_to_rate(mono_audio_frame: np.ndarray, rate: int) -> np.ndarray:
+        """
+        Resamples a mono 24000 Hz audio frame to mono at another rate (e.g., 8000 Hz for G.711) with a polyphase
+        filter, which is much cheaper than the FFT resampling and stereo duplication of resample_to_stereo.
+
+        Args:
+            mono_audio_frame (np.ndarray): The input mono audio data,
+                                        expected to be a 1D NumPy array.
+            rate (int): The output sample rate.
+
+        Returns:
+            np.ndarray: The resampled mono audio data as a 1D int16 NumPy array.
+        """
+        divisor = math.gcd(rate, CONST.TTS_AUDIO_SAMPLE_RATE)
+        resampled = signal.resample_poly(
+            mono_audio_frame.astype(np.float32), rate // divisor, CONST.TTS_AUDIO_SAMPLE_RATE // divisor
+        )
+        return np.clip(resampled, -32768, 32767).astype(np.int16)
+
     def add_track(self, pc: RTCPeerConnection):
         if pc:
-            pc.addTrack(self)
+            self.attach_sender(pc.addTrack(self))
+
+    def attach_sender(self, sender: RTCRtpSender):
+        """Hooks the sender's frame loop so frame_timing and the playout futures learn when the frame last returned by
+        recv() has been sent.
+
+        The sender sends every RTP packet of an encoded frame before asking for the next one, so entering
+        _next_encoded_frame means the previous frame has been handed to the transport.
+
+        Args:
+            sender (RTCRtpSender): the sender returned by addTrack for this track
+        """
+        if sender is None:
+            return
+        next_encoded_frame = sender._next_encoded_frame
+        timing = self.frame_timing
+
+        async def _timed_next_encoded_frame(codec):
+            if timing is not None:
+                timing.on_rtp_sent()
+            self.on_frame_sent()
+            return await next_encoded_frame(codec)
+
+        sender._next_encoded_frame = _timed_next_encoded_frame
+        self.sender_attached = True
+
+    def expect_playout(self) -> Future:
+        """Returns a future resolved once the last of the audio now in the playback buffer has been sent. A partial
+        block left at the end is padded with silence so it is sent too. Works from any thread: block on result() or
+        await asyncio.wrap_future() of it. Cancelled if the track closes first.
+
+        Returns:
+            Future: resolved with the position reached, in samples of audio sent by this track (at its rate)
+        """
+        future = Future()
+        with self.playout_lock:
+            if self.closed:
+                future.cancel()
+                return future
+            self.playout_unmarked.append(future)
+            self.playout_requested = True
+        self.wakeup.set()
+        return future
+
+    def mark_playout_end(self):
+        """Producer thread: the playback buffer is empty, so the audio expected by expect_playout() ends at the
+        samples queued so far (less the silence padding the last block)"""
+        with self.playout_lock:
+            target = self.queued_samples - self.playout_padding
+            self.playout_padding = 0
+            self.playout_requested = False
+            self.playout_targets.extend((target, future) for future in self.playout_unmarked)
+            self.playout_unmarked = []
+        self.resolve_playouts()
+
+    def on_frame_sent(self):
+        """The frame last returned by recv() has been sent, so everything handed to the sender has been played"""
+        self.played_samples = self.handed_samples
+        if self.playout_targets:
+            self.resolve_playouts()
+
+    def resolve_playouts(self):
+        """Resolves the playout futures whose target the sent audio has reached"""
+        with self.playout_lock:
+            reached = [(target, future) for target, future in self.playout_targets if target <= self.played_samples]
+            self.playout_targets = [
+                (target, future) for target, future in self.playout_targets if target > self.played_samples
+            ]
+        for target, future in reached:
+            if not future.done():
+                future.set_result(target)
+
+    def cancel_playouts(self):
+        """Cancels the playout futures that are still waiting"""
+        with self.playout_lock:
+            futures = self.playout_unmarked + [future for _target, future in self.playout_targets]
+            self.playout_unmarked = []
+            self.playout_targets = []
+            self.playout_requested = False
+        for future in futures:
+            future.cancel()
+
+    def on_frame_handed(self, samples: int):
+        """Counts audio returned by recv(), which is played once the sender has sent it
+
+        Args:
+            samples (int): samples (at the track's rate) in the frame or packet
+        """
+        self.handed_samples += samples
+        if not self.sender_attached:
+            # nothing reports the send, so returning the frame is as close as it gets
+            self.on_frame_sent()
 
     def process_output_data_frames(self):
         # wait for the connection to be ready
@@ -109,66 +298,255 @@ class audio_output_track(MediaStreamTrack):
             )
         else:
             self.logger.info("ioloop is closed. Can't gather data")
+            self.close_frame_builder()
             return
 
         self.logger.info("Beginning to process data frames.")
+        if self.offload_mode == frame_build_pool.MODE_NONE:
+            self.close_frame_builder()
+        elif self.frame_builder is None:
+            self.frame_builder = frame_build_session(
+                frame_build_pool.get_pool(self.config.get(CONST.OFFLOAD_WORKERS, 0)),
+                self.block_bytes * CONST.MAX_CATCHUP_BLOCKS,
+            )
         # read from data buffer, create frames and push them to the fifo
         counter = 0
         self.pts = 0
         while not self.is_stopped():
             counter += 1
-            audio_bytes = self.playback_audio_track_callback(self.frames_per_buffer * 2)
+            # audio held back by a time stretch that is ending, already taken from the buffer
+            held_bytes = self.end_stretch()
+            if (
+                held_bytes is None
+                and self.playout_requested
+                and len(self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER]) == 0
+            ):
+                self.mark_playout_end()
+            if held_bytes is not None:
+                audio_bytes = held_bytes
+            else:
+                audio_bytes = self.playback_audio_track_callback(self.block_bytes, self.catchup_blocks())
             if audio_bytes is not None:
                 self.started_recording = True
-                self.logger.info(
-                    f"Got {len(audio_bytes)} to send to browser. {len(self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER])}"
+                created_ns = 0
+                extract_ns = time.perf_counter_ns()
+                if self.frame_timing is not None and held_bytes is None:
+                    created_ns = self.frame_timing.on_extract(len(audio_bytes))
+                self.frame_logger.debug(
+                    "Got %d to send to browser. %d",
+                    len(audio_bytes),
+                    len(self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER]),
                 )
-                if DEBUG_FILES:
-                    self.rawaudio_24.write(audio_bytes)
+                capture = self.capture
+                if capture is not None and capture.enabled and held_bytes is None:
+                    capture.tap(capture_session.RAWAUDIO_24, audio_bytes)
+                if self.drift is not None and held_bytes is None:
+                    audio_bytes = self.correct_drift(audio_bytes)
+                if self.stretcher is not None and held_bytes is None:
+                    audio_bytes = self.stretch(audio_bytes)
+                if not audio_bytes:
+                    # held back by the stretch until the audio that follows it arrives
+                    continue
+
+                if self.offload_mode == frame_build_pool.MODE_ENCODE:
+                    self.queue_encoded_packets(audio_bytes, created_ns, extract_ns)
+                    continue
 
                 mono_frame = audio_output_track.create_mono_audio_frame(audio_bytes)
                 mono_audio = mono_frame.to_ndarray()[0]
 
-                if DEBUG_FILES:
-                    mono_bytes = mono_audio.tobytes()
-                    self.monoframe_24.write(mono_bytes)
-
-                # resample to stereo frame
-                stereo_audio = audio_output_track.resample_to_stereo(mono_audio)
+                if capture is not None and capture.enabled:
+                    capture.tap(capture_session.MONOFRAME_24, mono_audio)
+
+                # resample to a stereo frame, or straight to the negotiated codec's rate
+                resample_start_ns = time.perf_counter_ns()
+                if self.frame_builder is not None:
+                    stereo_audio = self.frame_builder.build(audio_bytes, False)
+                elif self.rate == CONST.WEB_RTC_AUDIO_SAMPLE_RATE:
+                    stereo_audio = audio_output_track.resample_to_stereo(mono_audio)
+                else:
+                    stereo_audio = audio_output_track.resample_to_rate(mono_audio, self.rate)
+                if self.metrics is not None:
+                    self.metrics.resample_ns.add(
+                        time.perf_counter_ns() - resample_start_ns
+                    )
                 stereo_frame = AudioFrame(
                     format="s16",
-                    layout="stereo",
-                    samples=int(stereo_audio.size / 2),
+                    layout=self.layout,
+                    samples=int(stereo_audio.size / self.channels),
                 )
                 stereo_frame.planes[0].update(stereo_audio[0:].tobytes())
                 stereo_frames = [stereo_frame]
                 if stereo_frames:
                     for frame in stereo_frames:
-                        frame.sample_rate = CONST.WEB_RTC_AUDIO_SAMPLE_RATE
+                        frame.sample_rate = self.rate
                         frame.pts = self.pts
                         self.pts += frame.samples
                         frame.time_base = fractions.Fraction(1, frame.sample_rate)
-                        self.logger.info(
-                            f"Writing to fifo pts={frame.pts} time={frame.time} duration={frame.duration} time_base={frame.time_base} size={frame.samples} remaining={len(self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER])}"
+                        self.frame_logger.debug(
+                            "Writing to fifo pts=%s time=%s duration=%s time_base=%s size=%d remaining=%d",
+                            frame.pts,
+                            frame.time,
+                            frame.duration,
+                            frame.time_base,
+                            frame.samples,
+                            len(self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER]),
                         )
-                        if DEBUG_FILES:
-                            stereo_audio = frame.to_ndarray()[0]
-                            stereo_bytes = stereo_audio.tobytes()
-                            self.stereoframe_48.write(stereo_bytes)
+                        if capture is not None and capture.enabled and self.rate == CONST.WEB_RTC_AUDIO_SAMPLE_RATE:
+                            # stereo_audio is not reused, so the writer can take it without a copy
+                            capture.tap(capture_session.STEREOFRAME_48, stereo_audio)
                         self.audio_fifo.write(frame)
+                        self.queued_samples += frame.samples
+                        if self.frame_timing is not None:
+                            self.frame_timing.on_fifo_write(
+                                frame.pts, frame.samples, created_ns, extract_ns
+                            )
             else:
-                time.sleep(0.5)
+                # a stretch holding audio back ends as soon as the backlog has drained
+                self.wakeup.wait(
+                    CONST.TIME_STRETCH_POLL_SECONDS
+                    if self.stretcher is not None and self.stretcher.is_active()
+                    else 0.5
+                )
+                self.wakeup.clear()
                 if (counter % 100) == 0:
                     self.logger.info("Waiting for data to process")
                     counter = 0
 
+        self.close_frame_builder()
         self.logger.info("Ending processing data thread.")
 
+    def catchup_blocks(self) -> int:
+        """Returns how many blocks the producer may take from the playback buffer in one pass. Once the AudioFifo holds
+        a block, a backlog is built together (one extract, resample and fifo write for up to MAX_CATCHUP_BLOCKS) so
+        the per-block overhead is paid once; until then blocks go one at a time so the first frame is not held back.
+
+        Returns:
+            int: the most blocks to take
+        """
+        if self.fifo_depth() < self.frames_per_buffer * 2:
+            return 1
+        max_blocks = CONST.MAX_CATCHUP_BLOCKS
+        if self.frame_builder is not None:
+            # the session's segments hold max_block_bytes (a warm_pool session is sized for the largest block of any
+            # codec's format), and a batch can grow by the audio a stretch held back (under a block) or by the drift
+            # correction (under MAX_CORRECTION of it), so keep a block spare for those
+            headroom = 1 if self.stretcher is not None or self.drift is not None else 0
+            max_blocks = min(max_blocks, self.frame_builder.max_block_bytes // self.block_bytes - headroom)
+        return max(1, max_blocks)
+
+    def correct_drift(self, audio_bytes: bytes) -> bytes:
+        """Updates the drift estimate with the buffered depth and resamples the audio by the correction
+
+        Args:
+            audio_bytes (bytes): 24 kHz mono s16 audio taken from the playback buffer
+
+        Returns:
+            bytes: the corrected audio
+        """
+        self.drift.observe(time.perf_counter(), self.buffered_ms())
+        ratio = self.drift.ratio
+        samples = self.drift.correct(np.frombuffer(audio_bytes, dtype=np.int16))
+        if self.playout_padding:
+            # the silence padding the last block shrank with it
+            self.playout_padding = int(self.playout_padding / ratio)
+        return samples.tobytes()
+
+    def stretch(self, audio_bytes: bytes) -> bytes:
+        """Time-scale modification: while more than latency_target_ms is buffered, plays the audio faster (up to
+        max_speed, pitch preserved) so the backlog drains
+
+        Args:
+            audio_bytes (bytes): 24 kHz mono s16 audio taken from the playback buffer
+
+        Returns:
+            bytes: the audio to build frames from, empty while the stretch holds all of it back
+        """
+        speed = 1.0
+        excess_ms = self.buffered_ms() - self.latency_target_ms
+        # the padded last block of a response is not stretched, so its padding is still what ends it
+        if excess_ms > 0 and self.playout_padding == 0:
+            speed = 1.0 + (self.max_speed - 1.0) * min(1.0, excess_ms / CONST.TIME_STRETCH_RAMP_MS)
+        removed = self.stretcher.removed_samples
+        samples = self.stretcher.process(np.frombuffer(audio_bytes, dtype=np.int16), speed)
+        if self.metrics is not None and self.stretcher.removed_samples > removed:
+            self.metrics.stretch_saved_ns.add(
+                (self.stretcher.removed_samples - removed) * 1_000_000_000 // CONST.TTS_AUDIO_SAMPLE_RATE
+            )
+        return samples.tobytes()
+
+    def end_stretch(self) -> bytes | None:
+        """Ends a stretch in progress once the playback buffer has no whole block left for it and either the response
+        is ending or the backlog has drained, returning the audio it held back
+
+        Returns:
+            bytes | None: 24 kHz mono s16 audio, or None if there is no stretch to end
+        """
+        if self.stretcher is None or not self.stretcher.is_active():
+            return None
+        if len(self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER]) >= self.block_bytes:
+            return None
+        if not self.playout_requested and self.buffered_ms() > self.latency_target_ms:
+            return None
+        held = self.stretcher.flush()
+        return held.tobytes() if held.size else None
+
+    def close_frame_builder(self):
+        """Releases the frame_build_pool session, if there is one"""
+        if self.frame_builder is not None:
+            self.frame_builder.close()
+            self.frame_builder = None
+
+    def queue_encoded_packets(self, audio_bytes: bytes, created_ns: int, extract_ns: int):
+        """Has the frame_build_pool resample and Opus encode the audio, queuing the packets for recv()
+
+        Args:
+            audio_bytes (bytes): 24 kHz mono s16 audio
+            created_ns (int): the creation stamp returned by frame_timing.on_extract
+            extract_ns (int): the perf_counter_ns when the bytes were extracted
+        """
+        build_start_ns = time.perf_counter_ns()
+        packets = self.frame_builder.build(audio_bytes, True)
+        if self.metrics is not None:
+            self.metrics.resample_ns.add(time.perf_counter_ns() - build_start_ns)
+        for payload in packets:
+            self.packet_queue.append((payload, self.pts))
+            self.queued_samples += CONST.OPUS_FRAMES_PER_BUFFER
+            if self.frame_timing is not None:
+                self.frame_timing.on_fifo_write(
+                    self.pts, CONST.OPUS_FRAMES_PER_BUFFER, created_ns, extract_ns
+                )
+            self.pts += CONST.OPUS_FRAMES_PER_BUFFER
+
     def close(self):
         self.start = False
         self.closed = True
+        self.wakeup.set()
+        self.cancel_playouts()
+        if self.frame_timing is not None:
+            self.logger.info(f"Frame timing: {self.frame_timing.summary()}")
         self.stop()
 
+    def release(self, timeout: float = 2.0) -> tuple[bool, int]:
+        """Closes the track, waits for its producer thread to exit and drops the audio it still holds. Blocks, so the
+        event loop should call it through an executor.
+
+        Args:
+            timeout (float, optional): seconds to wait for the producer thread. Defaults to 2.0.
+
+        Returns:
+            tuple[bool, int]: whether the producer thread exited, and the samples dropped from the AudioFifo
+        """
+        self.close()
+        self.output_processor_thread.join(timeout)
+        stopped = not self.output_processor_thread.is_alive()
+        dropped = self.fifo_depth()
+        if stopped:
+            # nothing writes to them any more
+            self.audio_fifo = AudioFifo()
+            self.packet_queue.clear()
+        return stopped, dropped
+
     def is_active(self) -> bool:
         return self.start
 
@@ -176,117 +554,260 @@ class audio_output_track(MediaStreamTrack):
         return self.closed
 
     def playback_audio_track_callback(
-        self, frame_count: int = CONST.FRAMES_PER_BUFFER
+        self, frame_count: int = CONST.FRAMES_PER_BUFFER, max_blocks: int = 1
     ) -> bytes | None:
         # read any accumulated audio and return it
         buf_len = len(self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER])
 
         if buf_len >= frame_count:
+            # catch up on a backlog: up to max_blocks whole blocks in one extract
+            blocks = max(1, min(max_blocks, buf_len // frame_count))
             data = self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER].extract(
-                frame_count
+                frame_count * blocks
             )
-            self.logger.info(
-                f"Playback callback returning {len(data)} bytes, {len(self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER])} remaining"
+            if not data:
+                # the buffer was cleared (e.g., by the session reaper) since its length was read
+                return None
+            if blocks > 1 and self.metrics is not None:
+                self.metrics.catchup_blocks.add(blocks)
+            self.frame_logger.debug(
+                "Playback callback returning %d bytes, %d remaining",
+                len(data),
+                len(self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER]),
             )
             return bytes(data)
 
+        elif self.playout_requested and buf_len > 0:
+            # the end of the audio: pad the last partial block with silence so all of it is sent
+            data = self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER].extract(buf_len)
+            # in output samples: 24 kHz mono bytes and 48 kHz samples are the same count
+            self.playout_padding = (frame_count - buf_len) * self.rate // (2 * CONST.TTS_AUDIO_SAMPLE_RATE)
+            return bytes(data) + bytes(frame_count - buf_len)
+
         else:
             return None
 
+    def buffered_ms(self) -> float:
+        """Returns the milliseconds of audio waiting in the playback buffer and the AudioFifo
+
+        Returns:
+            float: the milliseconds of audio not yet returned by recv()
+        """
+        buf_len = len(self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER])
+        buffer_ms = buf_len / 2 / CONST.TTS_AUDIO_SAMPLE_RATE * 1000.0
+        return buffer_ms + self.fifo_depth() / self.rate * 1000.0
+
+    def fifo_depth(self) -> int:
+        """Returns the number of samples waiting in the AudioFifo (or as encoded packets)
+
+        Returns:
+            int: the number of samples waiting in the AudioFifo
+        """
+        return self.audio_fifo.samples + len(self.packet_queue) * CONST.OPUS_FRAMES_PER_BUFFER
+
+    def record_frame_sent(self, samples: int, sample_rate: int, silence: bool):
+        """Counts the frame being returned by recv(), noting if it is later than the pace set by the frames before it
+
+        Args:
+            samples (int): the number of samples in the frame being returned to the sender
+            sample_rate (int): the sample rate of the frame
+            silence (bool): True if this is a silence frame
+        """
+        if self.metrics is None:
+            return
+        now = time.perf_counter()
+        if self.send_clock_start is None:
+            self.send_clock_start = now
+            self.samples_sent = 0
+        due = self.send_clock_start + self.samples_sent / sample_rate
+        if now - due > samples / sample_rate:
+            self.metrics.late_frames.add()
+            # re-anchor so one stall is not counted against every following frame
+            self.send_clock_start = now - self.samples_sent / sample_rate
+        self.samples_sent += samples
+        if silence:
+            self.metrics.silence_frames_sent.add()
+        else:
+            self.metrics.frames_sent.add()
+
     def get_silence_frame(self) -> AudioFrame:
-        silent_audio_data = np.zeros((1, self.frames_per_buffer), dtype=np.int16)
+        # packed, so frames_per_buffer samples of each channel
+        silent_audio_data = np.zeros((1, self.frames_per_buffer * self.channels), dtype=np.int16)
 
         frame = AudioFrame.from_ndarray(
             silent_audio_data,
             format="s16",
-            layout="stereo",
+            layout=self.layout,
         )
         # Set the sample rate of the frame
-        frame.sample_rate = (
-            # CONST.TTS_AUDIO_SAMPLE_RATE
-            CONST.WEB_RTC_AUDIO_SAMPLE_RATE
-        )
-        frame.pts = self.pts
-        self.pts += frame.samples  # self.frames_per_buffer
+        frame.sample_rate = self.rate
         return frame
 
-    async def recv(self) -> AudioFrame | Frame:
-        """Like a callback from the server to receive audio for playback, this method returns a frame of audio retrieved from the queue or silence."""
-        if self.is_stopped():
-            try:
-                return self.get_silence_frame()
-            except Exception:
-                # we are shutting down
-                self.close()
+    def next_send_pts(self, samples: int) -> int:
+        """Returns the pts of the frame or packet about to be returned by recv(). After a stretch suppressed by dtx, the
+        timeline first moves on by the time that passed, so the RTP timestamps match the wall clock.
+
+        Args:
+            samples (int): samples (at the track's rate) in the frame or packet
+
+        Returns:
+            int: its pts
+        """
+        if self.dtx_start is not None:
+            skipped = round((time.perf_counter() - self.dtx_start) * self.rate / samples) * samples
+            self.send_pts += skipped
+            # so the pacing check does not count the frame after the gap as late
+            self.samples_sent += skipped
+            if self.metrics is not None:
+                self.metrics.dtx_suppressed_frames.add(skipped // samples)
+            if self.recorder is not None:
+                # the recording's outbound leg keeps the wall clock timeline too
+                self.recorder.add_gap(call_recorder.LEG_OUTBOUND, skipped / self.rate)
+            self.dtx_start = None
+        pts = self.send_pts
+        self.send_pts += samples
+        return pts
+
+    def has_audio(self) -> bool:
+        """Returns True if recv() has audio to return rather than silence
+
+        Returns:
+            bool: True if the stream is playing and a frame or packet is waiting
+        """
+        if not self.is_active() or self.is_stopped():
+            return False
+        return self.audio_fifo.samples >= self.frames_per_buffer or len(self.packet_queue) > 0
 
+    async def wait_while_silent(self):
+        """dtx: once DTX_HANGOVER_FRAMES of silence have been sent, waits until there is audio or a keepalive is due"""
+        if self.silent_frames < CONST.DTX_HANGOVER_FRAMES:
+            return
+        if self.dtx_start is None:
+            self.dtx_start = time.perf_counter()
+        keepalive_at = self.dtx_start + CONST.DTX_KEEPALIVE_SECONDS
+        while not self.has_audio() and time.perf_counter() < keepalive_at:
+            await asyncio.sleep(CONST.DTX_POLL_SECONDS)
+
+    async def recv(self) -> AudioFrame | Frame | Packet:
+        """Like a callback from the server to receive audio for playback, this method returns a frame of audio retrieved
+        from the queue or silence. With dtx, silence after the hangover is suppressed: recv() waits for audio, returning
+        only a keepalive silence frame every DTX_KEEPALIVE_SECONDS."""
+        if self.dtx:
+            await self.wait_while_silent()
         # wait until we have started
         while not self.is_active():
+            if self.is_stopped():
+                # nothing more will be played
+                return await self.recv_silence()
             await asyncio.sleep(0.1)
-        # read a frame from the fifo and return it to be sent to the browser, blocking until there is data
-        frame = None
-        while (
-            self.is_active()
-        ):  # TODO: add a test on the connection to ensure we are still communicating
-            frame = self.audio_fifo.read(samples=self.frames_per_buffer)
-            if frame is not None:
-                if not self.is_playing_back:
-                    print("Beginning to play back audio.")
-                    self.is_playing_back = True
-
-                frame.sample_rate = CONST.WEB_RTC_AUDIO_SAMPLE_RATE
-                if DEBUG_FILES:
-                    audio_array = frame.to_ndarray()[0]
-                    audio_bytes = audio_array.tobytes()
-                    self.sendframe_48.write(audio_bytes)
-
-                ftime = frame.time if frame.time is not None and frame.time > 0 else 0
-                self.logger.info(
-                    f"Sending frame pts={frame.pts} duration={frame.duration} time={ftime} size={frame.samples} rate={frame.rate} sample_rate={frame.sample_rate}"
-                )
+        if self.offload_mode == frame_build_pool.MODE_ENCODE:
+            return await self.recv_packet()
+        if self.dtx_start is not None:
+            # the sender's Opus encoder stamps its first packet after a gap as following the frame before the gap, and
+            # that packet carries the start of the new frame, so lead with silence rather than move the audio's onset
+            if self.has_audio():
+                # only this one: the next call finds the hangover reset and returns the audio
+                self.silent_frames = 0
+            return await self.recv_silence()
+        # read a frame from the fifo and return it to be sent to the browser, or silence if there is none yet
+        frame = self.audio_fifo.read(samples=self.frames_per_buffer)
+        if frame is None:
+            return await self.recv_silence()
+        if not self.is_playing_back:
+            print("Beginning to play back audio.")
+            self.is_playing_back = True
+        self.underrun = False
+        self.silent_frames = 0
+
+        frame.sample_rate = self.rate
+        capture = self.capture
+        if capture is not None and capture.enabled and self.rate == CONST.WEB_RTC_AUDIO_SAMPLE_RATE:
+            capture.tap(capture_session.SENDFRAME_48, frame.to_ndarray())
+
+        if self.frame_timing is not None:
+            # matched against the producer's pts
+            self.frame_timing.on_recv(frame.pts)
+        frame.pts = self.next_send_pts(frame.samples)
+        frame.time_base = fractions.Fraction(1, self.rate)
+        self.frame_logger.debug(
+            "Sending frame pts=%s duration=%s time=%s size=%d rate=%d sample_rate=%d",
+            frame.pts,
+            frame.duration,
+            frame.time,
+            frame.samples,
+            frame.rate,
+            frame.sample_rate,
+        )
+        # for more dynamic based on data sent:
+        if self.paced:
+            await asyncio.sleep(frame.samples / self.rate)
+        self.record_frame_sent(frame.samples, frame.sample_rate, False)
+        self.on_frame_handed(frame.samples)
+        if self.recorder is not None:
+            self.recorder.add(call_recorder.LEG_OUTBOUND, frame)
+        if self.datachannel_audio is not None:
+            self.datachannel_audio.send_frame(frame)
+        return frame
 
-                break
-        if frame is not None:
-            # await asyncio.sleep(0.02)
-            # for more dynamic based on data sent:
-            await asyncio.sleep(frame.samples / CONST.WEB_RTC_AUDIO_SAMPLE_RATE)
-            return frame
+    async def recv_silence(self) -> AudioFrame | Packet:
+        """Returns a silence frame (an Opus silence packet when offloading the encode), paced like audio, counting an
+        underrun if it interrupts playback"""
+        if self.is_playing_back and not self.underrun and not self.is_stopped() and self.metrics is not None:
+            self.underrun = True
+            self.metrics.underruns.add()
+        self.silent_frames += 1
+        if self.offload_mode == frame_build_pool.MODE_ENCODE:
+            samples = CONST.OPUS_FRAMES_PER_BUFFER
+            silence = Packet(CONST.OPUS_SILENCE_PACKET)
+            recorded = CONST.OPUS_SILENCE_PACKET
         else:
-            await asyncio.sleep(0.02)
-            frame = self.get_silence_frame()
-            ftime = frame.time if frame.time is not None and frame.time > 0 else 0
-            self.logger.info(
-                f"Sending silence frame pts={frame.pts} duration={frame.duration} time={ftime} size={frame.samples} rate={frame.rate} sample_rate={frame.sample_rate}"
-            )
-            return frame
+            silence = self.get_silence_frame()
+            samples = silence.samples
+            recorded = silence
+        silence.pts = self.next_send_pts(samples)
+        silence.time_base = fractions.Fraction(1, self.rate)
+        self.frame_logger.debug("Sending silence pts=%s size=%d", silence.pts, samples)
+        if self.paced:
+            await asyncio.sleep(samples / self.rate)
+        self.record_frame_sent(samples, self.rate, True)
+        if self.recorder is not None:
+            self.recorder.add(call_recorder.LEG_OUTBOUND, recorded)
+        return silence
+
+    async def recv_packet(self) -> Packet:
+        """Returns the next Opus packet encoded by the frame_build_pool, or an Opus silence packet if none is ready.
+        The sender packs these without encoding, so pts is kept continuous here rather than by the encoder."""
+        if not self.packet_queue:
+            return await self.recv_silence()
+        payload, producer_pts = self.packet_queue.popleft()
+        self.underrun = False
+        self.silent_frames = 0
+        if not self.is_playing_back:
+            print("Beginning to play back audio.")
+            self.is_playing_back = True
+        if self.frame_timing is not None:
+            self.frame_timing.on_recv(producer_pts)
+        packet = Packet(payload)
+        packet.pts = self.next_send_pts(CONST.OPUS_FRAMES_PER_BUFFER)
+        packet.time_base = fractions.Fraction(1, CONST.WEB_RTC_AUDIO_SAMPLE_RATE)
+        if self.paced:
+            await asyncio.sleep(CONST.OPUS_FRAMES_PER_BUFFER / CONST.WEB_RTC_AUDIO_SAMPLE_RATE)
+        self.record_frame_sent(CONST.OPUS_FRAMES_PER_BUFFER, CONST.WEB_RTC_AUDIO_SAMPLE_RATE, False)
+        self.on_frame_handed(CONST.OPUS_FRAMES_PER_BUFFER)
+        if self.recorder is not None:
+            self.recorder.add(call_recorder.LEG_OUTBOUND, payload)
+        if self.datachannel_audio is not None:
+            self.datachannel_audio.send_packet(payload, packet.pts)
+        return packet
 
     def start_stream(self):
-        now = time.time()
         self.started_recording = False
-        if DEBUG_FILES:
-            self.rawaudio_24 = open(f"./tmp_01_rawaudio_24_{now}", "wb")
-            self.monoframe_24 = open(f"./tmp_02_monoframe_24_{now}", "wb")
-            self.stereoframe_48 = open(f"./tmp_03_stereoframe_48_{now}", "wb")
-            self.sendframe_48 = open(f"./tmp_04_sendframe_48_{now}", "wb")
+        self.send_clock_start = None
         self.start = True
         self.logger.info("Done starting stream")
 
     def stop_stream(self):
         self.start = False
-        if DEBUG_FILES:
-            if self.rawaudio_24:
-                self.rawaudio_24.flush()
-                self.rawaudio_24.close()
-
-            if self.sendframe_48:
-                self.sendframe_48.flush()
-                self.sendframe_48.close()
-
-            if self.monoframe_24:
-                self.monoframe_24.flush()
-                self.monoframe_24.close()
-
-            if self.stereoframe_48:
-                self.stereoframe_48.flush()
-                self.stereoframe_48.close()
-
+        if self.frame_timing is not None:
+            self.logger.info(f"Frame timing: {self.frame_timing.summary()}")
         self.logger.info("Done stopping stream")
@@ -0,0 +1,623 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import wave
+
+import aiohttp
+import av
+import numpy as np
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from aiortc.mediastreams import AudioStreamTrack, MediaStreamError
+
+from constants import constants as CONST
+from datachannel_audio import datachannel_audio
+
+SILENCE_THRESHOLD = 100  # peak int16 value below which a received frame counts as silence
+
+
+def read_process_usage(pid: int) -> tuple[float, int]:
+    """Returns the cpu seconds and resident memory of a process and all of its descendants (Linux /proc only)
+
+    Args:
+        pid (int): the process id of the root process
+
+    Returns:
+        tuple[float, int]: (user+system cpu seconds, resident bytes), or (0.0, 0) if /proc is unavailable
+    """
+    if not os.path.isdir("/proc"):
+        return 0.0, 0
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as handle:
+                fields = handle.read().rsplit(")", 1)[1].split()
+            children.setdefault(int(fields[1]), []).append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    ticks = os.sysconf("SC_CLK_TCK")
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    cpu_seconds = 0.0
+    rss_bytes = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/stat", "r") as handle:
+                fields = handle.read().rsplit(")", 1)[1].split()
+            # utime and stime are fields 14 and 15 of stat, 11 and 12 after the command name
+            cpu_seconds += (int(fields[11]) + int(fields[12])) / ticks
+            rss_bytes += int(fields[21]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+    return cpu_seconds, rss_bytes
+
+
+class benchmark_client:
+    """A headless aiortc client that negotiates through /offer and measures the audio it receives"""
+
+    def __init__(
+        self,
+        index: int,
+        base_url: str,
+        record_dir: str | None = None,
+        audio_format: str = datachannel_audio.FORMAT_OFF,
+        channel_parameters: dict | None = None,
+    ):
+        """Constructor for benchmark_client
+
+        Args:
+            index (int): the client's index (used for file names)
+            base_url (str): the server url (e.g., http://localhost:8910)
+            record_dir (str | None, optional): directory to write the received audio to as a wav file. Defaults to None.
+            audio_format (str, optional): audio to ask for over the data channel (datachannel_audio.FORMATS).
+                Defaults to off.
+            channel_parameters (dict | None, optional): RTCDataChannel options (e.g., ordered, maxRetransmits).
+                Defaults to None.
+        """
+        self.index = index
+        self.base_url = base_url
+        self.record_dir = record_dir
+        self.audio_format = audio_format
+        self.channel_parameters = channel_parameters or {}
+        # binary audio received over the data channel
+        self.channel_messages = 0
+        self.channel_lost = 0
+        self.channel_reordered = 0
+        self.channel_next_seq = 0
+        self.channel_first_audio_time = 0.0
+        self.channel_latency_ms = []
+        self.opus_decoder = None
+        self.pc = None
+        self.wav = None
+        self.reader_task = None
+        self.offer_start = 0.0
+        self.answer_time = 0.0
+        self.first_audio_time = 0.0
+        self.frames = 0
+        self.audio_frames = 0
+        self.received_seconds = 0.0
+        self.codec = None
+        self.gaps = 0
+        self.jitter = 0.0
+        self.last_arrival = None
+        self.last_pts = None
+        self.last_samples = 0
+        self.error = None
+
+    async def connect(self, session: aiohttp.ClientSession):
+        """Creates the peer connection, posts the offer and applies the answer
+
+        Args:
+            session (aiohttp.ClientSession): the http session used to post the offer
+        """
+        self.pc = RTCPeerConnection()
+        channel = self.pc.createDataChannel("chat", **self.channel_parameters)
+        if self.audio_format != datachannel_audio.FORMAT_OFF:
+
+            @channel.on("open")
+            def on_open():
+                channel.send(datachannel_audio.COMMAND_PREFIX + self.audio_format)
+
+            @channel.on("message")
+            def on_message(message):
+                if isinstance(message, bytes):
+                    self.read_channel_audio(message)
+                elif message.endswith("unavailable"):
+                    self.error = "server refused data channel audio (start it with --datachannel-audio)"
+        # the server adds its playback track when it sees ours
+        self.pc.addTrack(AudioStreamTrack())
+
+        @self.pc.on("track")
+        def on_track(track):
+            if track.kind == "audio":
+                self.reader_task = asyncio.ensure_future(self.read_audio(track))
+
+        self.offer_start = time.perf_counter()
+        await self.pc.setLocalDescription(await self.pc.createOffer())
+        async with session.post(
+            f"{self.base_url}/offer",
+            json={"sdp": self.pc.localDescription.sdp, "type": self.pc.localDescription.type},
+        ) as response:
+            if response.status != 200:
+                self.error = f"offer returned {response.status}"
+                return
+            answer = await response.json()
+        self.answer_time = time.perf_counter() - self.offer_start
+        await self.pc.setRemoteDescription(RTCSessionDescription(sdp=answer["sdp"], type=answer["type"]))
+        for transceiver in self.pc.getTransceivers():
+            if transceiver.kind == "audio" and transceiver._codecs:
+                self.codec = transceiver._codecs[0].mimeType
+
+    async def read_audio(self, track):
+        """Receives frames until the track ends, recording arrival jitter, pts gaps and the first audible frame
+
+        Args:
+            track (MediaStreamTrack): the remote audio track
+        """
+        try:
+            while True:
+                frame = await track.recv()
+                arrival = time.perf_counter()
+                samples = frame.to_ndarray()
+                self.frames += 1
+                if np.abs(samples).max(initial=0) > SILENCE_THRESHOLD:
+                    self.audio_frames += 1
+                    if not self.first_audio_time:
+                        self.first_audio_time = arrival - self.offer_start
+                if self.last_arrival is not None and frame.pts is not None:
+                    pts_delta = frame.pts - self.last_pts
+                    if pts_delta > self.last_samples:
+                        self.gaps += 1
+                    # RFC 3550 interarrival jitter in seconds
+                    transit = (arrival - self.last_arrival) - pts_delta / frame.sample_rate
+                    self.jitter += (abs(transit) - self.jitter) / 16.0
+                self.last_arrival = arrival
+                self.last_pts = frame.pts
+                self.last_samples = frame.samples
+                # G.711 is decoded at 8 kHz, Opus at 48 kHz
+                self.received_seconds += frame.samples / frame.sample_rate
+                if self.record_dir:
+                    self.record(frame, samples)
+        except MediaStreamError:
+            pass
+
+    def read_channel_audio(self, message: bytes):
+        """Measures a binary audio message: one-way latency (client and server share a clock), loss, reordering and
+        the first audible message
+
+        Args:
+            message (bytes): the message sent by the server's datachannel_audio
+        """
+        arrival = time.perf_counter()
+        received_us = time.time_ns() // 1000
+        audio_format, seq, _, sent_us, payload = datachannel_audio.parse(message)
+        self.channel_messages += 1
+        self.channel_latency_ms.append((received_us - sent_us) / 1000.0)
+        if seq >= self.channel_next_seq:
+            self.channel_lost += seq - self.channel_next_seq
+            self.channel_next_seq = seq + 1
+        else:
+            # counted as lost when the gap was seen
+            self.channel_lost -= 1
+            self.channel_reordered += 1
+        if self.channel_first_audio_time:
+            return
+        if audio_format == datachannel_audio.FORMAT_OPUS:
+            if self.opus_decoder is None:
+                self.opus_decoder = av.CodecContext.create("opus", "r")
+            peaks = [
+                np.abs(frame.to_ndarray()).max(initial=0) * 32768.0
+                for frame in self.opus_decoder.decode(av.Packet(payload))
+            ]
+            peak = max(peaks, default=0)
+        else:
+            peak = np.abs(np.frombuffer(payload, dtype=np.int16).astype(np.int32)).max(initial=0)
+        if peak > SILENCE_THRESHOLD:
+            self.channel_first_audio_time = arrival - self.offer_start
+
+    def record(self, frame, samples: np.ndarray):
+        """Appends a received frame to this client's wav file
+
+        Args:
+            frame (AudioFrame): the received frame
+            samples (np.ndarray): the frame's samples as returned by to_ndarray
+        """
+        if self.wav is None:
+            # kept open across frames, closed by close()
+            self.wav = wave.open(  # noqa: SIM115
+                os.path.join(self.record_dir, f"bench_client_{self.index}.wav"), "wb"
+            )
+            self.wav.setnchannels(len(frame.layout.channels))
+            self.wav.setsampwidth(2)
+            self.wav.setframerate(frame.sample_rate)
+        self.wav.writeframes(samples.astype(np.int16).tobytes())
+
+    async def close(self) -> dict:
+        """Collects the client's receiver statistics, closes the connection and returns its results
+
+        Returns:
+            dict: the client's measurements
+        """
+        packets_lost = 0
+        rtp_jitter = 0.0
+        if self.pc is not None:
+            try:
+                stats = await self.pc.getStats()
+                for stat in stats.values():
+                    if stat.type == "inbound-rtp" and stat.kind == "audio":
+                        packets_lost += stat.packetsLost or 0
+                        rtp_jitter = max(rtp_jitter, stat.jitter or 0)
+            except Exception:  # noqa: BLE001, S110
+                # the statistics are best effort, the rest of the client's results still count
+                pass
+            await self.pc.close()
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+        if self.wav is not None:
+            self.wav.close()
+        channel = {}
+        if self.audio_format != datachannel_audio.FORMAT_OFF:
+            latency = np.array(self.channel_latency_ms or [0.0])
+            channel = {
+                "format": self.audio_format,
+                "messages": self.channel_messages,
+                "lost": self.channel_lost,
+                "reordered": self.channel_reordered,
+                "time_to_first_audio_ms": round(self.channel_first_audio_time * 1000, 3),
+                "one_way_ms_p50": round(float(np.percentile(latency, 50)), 3),
+                "one_way_ms_p95": round(float(np.percentile(latency, 95)), 3),
+                # both paths carry the same audio from the same recv() call, so this is the media path's extra delay
+                "media_minus_channel_first_audio_ms": (
+                    round((self.first_audio_time - self.channel_first_audio_time) * 1000, 3)
+                    if self.first_audio_time and self.channel_first_audio_time
+                    else None
+                ),
+            }
+        return {
+            "client": self.index,
+            "error": self.error,
+            "answer_ms": round(self.answer_time * 1000, 3),
+            "time_to_first_audio_ms": round(self.first_audio_time * 1000, 3),
+            "frames": self.frames,
+            "audio_frames": self.audio_frames,
+            "codec": self.codec,
+            "received_seconds": round(self.received_seconds, 3),
+            "interarrival_jitter_ms": round(self.jitter * 1000, 3),
+            "pts_gaps": self.gaps,
+            "packets_lost": packets_lost,
+            "rtp_jitter": rtp_jitter,
+            "datachannel_audio": channel,
+        }
+
+
+class benchmark:
+    """Runs a webrtcsvr and N headless clients on this machine and reports per session measurements as JSON"""
+
+    def __init__(self, params: argparse.Namespace):
+        """Constructor for benchmark
+
+        Args:
+            params (argparse.Namespace): the parsed command line arguments
+        """
+        self.params = params
+        self.base_url = f"http://{params.host}:{params.port}"
+        self.server = None
+        # passed to the server as --codec-profile by run_profiles
+        self.codec_profile = None
+        # passed to the server as --event-loop by run_loops
+        self.event_loop = None
+
+    def start_server(self):
+        """Starts webrtcsvr.py as a subprocess with the benchmark's host, port and any extra server arguments"""
+        command = [
+            sys.executable,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "webrtcsvr.py"),
+            "--host",
+            self.params.host,
+            "--port",
+            str(self.params.port),
+        ] + self.params.server_args.split()
+        if self.params.datachannel_audio != datachannel_audio.FORMAT_OFF:
+            command.append("--datachannel-audio")
+        if self.codec_profile is not None:
+            command.extend(["--codec-profile", self.codec_profile])
+        if self.event_loop is not None:
+            command.extend(["--event-loop", self.event_loop])
+        self.server = subprocess.Popen(
+            command,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    async def wait_for_server(self, session: aiohttp.ClientSession, timeout: float = 60.0):
+        """Polls /metrics until the server answers
+
+        Args:
+            session (aiohttp.ClientSession): the http session
+            timeout (float, optional): seconds to wait. Defaults to 60.0.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{self.base_url}/metrics") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.25)
+        raise TimeoutError(f"server at {self.base_url} did not start")
+
+    def stop_server(self):
+        """Stops the server subprocess, killing it if it does not exit"""
+        if self.server is None:
+            return
+        self.server.terminate()
+        try:
+            self.server.wait(timeout=self.params.drain_timeout + 10)
+        except subprocess.TimeoutExpired:
+            self.server.kill()
+            self.server.wait()
+
+    async def measure_idle(self, session: aiohttp.ClientSession, server_pid: int, clients: list) -> dict:
+        """Waits for every session's response to finish playing, then measures the server's cpu and the frames the
+        clients receive while the sessions sit idle
+
+        Args:
+            session (aiohttp.ClientSession): the http session
+            server_pid (int): the server process to measure (0 if unknown)
+            clients (list): the connected benchmark_clients
+
+        Returns:
+            dict: the idle seconds, cpu percent (total and per session) and frames received per second per session
+        """
+        deadline = time.monotonic() + 120.0
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{self.base_url}/sessions") as response:
+                    sessions = (await response.json())["sessions"]
+                if sessions and all(st["played_ms"] > 0 and st["buffered_ms"] == 0 for st in sessions):
+                    break
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+        frames_start = sum(client.frames for client in clients)
+        cpu_start, _ = read_process_usage(server_pid) if server_pid else (0.0, 0)
+        idle_start = time.perf_counter()
+        await asyncio.sleep(self.params.idle)
+        cpu_end, _ = read_process_usage(server_pid) if server_pid else (0.0, 0)
+        elapsed = time.perf_counter() - idle_start
+        sessions = max(1, len(clients))
+        cpu_percent = (cpu_end - cpu_start) / elapsed * 100.0
+        return {
+            "seconds": round(elapsed, 3),
+            "cpu_percent": round(cpu_percent, 2),
+            "cpu_percent_per_session": round(cpu_percent / sessions, 2),
+            "frames_per_second_per_session": round(
+                (sum(client.frames for client in clients) - frames_start) / elapsed / sessions, 2
+            ),
+        }
+
+    async def run(self) -> dict:
+        """Runs the benchmark
+
+        Returns:
+            dict: the benchmark results
+        """
+        if not self.params.no_server:
+            self.start_server()
+        try:
+            async with aiohttp.ClientSession() as session:
+                await self.wait_for_server(session)
+                server_pid = self.server.pid if self.server is not None else self.params.server_pid
+                cpu_start, rss_start = read_process_usage(server_pid) if server_pid else (0.0, 0)
+                run_start = time.perf_counter()
+                clients = [
+                    benchmark_client(
+                        index,
+                        self.base_url,
+                        self.params.record_dir,
+                        self.params.datachannel_audio,
+                        json.loads(self.params.datachannel_parameters),
+                    )
+                    for index in range(self.params.clients)
+                ]
+                for client in clients:
+                    try:
+                        await client.connect(session)
+                    except (aiohttp.ClientError, TimeoutError, ValueError) as e:
+                        # refused or malformed offers and answers fail this client, not the run
+                        client.error = str(e)
+                    await asyncio.sleep(self.params.stagger / 1000.0)
+                await asyncio.sleep(self.params.duration)
+                cpu_end, rss_end = read_process_usage(server_pid) if server_pid else (0.0, 0)
+                elapsed = time.perf_counter() - run_start
+                server_metrics = ""
+                loop_status = {}
+                try:
+                    async with session.get(f"{self.base_url}/metrics") as response:
+                        server_metrics = await response.text()
+                    async with session.get(f"{self.base_url}/sessions") as response:
+                        loop_status = (await response.json()).get("event_loop", {})
+                except aiohttp.ClientError:
+                    pass
+                idle = {}
+                if self.params.idle > 0:
+                    idle = await self.measure_idle(session, server_pid, clients)
+                results = [await client.close() for client in clients]
+        finally:
+            if not self.params.no_server:
+                self.stop_server()
+        connected = [r for r in results if not r["error"]] or results
+        cpu_percent = (cpu_end - cpu_start) / elapsed * 100.0 if elapsed > 0 else 0.0
+        return {
+            "clients": self.params.clients,
+            "duration_seconds": round(elapsed, 3),
+            "server_args": self.params.server_args,
+            "codec_profile": self.codec_profile,
+            "event_loop": self.event_loop,
+            "server": {
+                "cpu_percent": round(cpu_percent, 2),
+                "cpu_percent_per_session": round(cpu_percent / max(1, self.params.clients), 2),
+                "rss_mb": round(rss_end / 1e6, 2),
+                "rss_mb_per_session": round(
+                    (rss_end - rss_start) / 1e6 / max(1, self.params.clients), 2
+                ),
+                "idle": idle,
+                "event_loop": loop_status,
+            },
+            "summary": {
+                "time_to_first_audio_ms_max": max(r["time_to_first_audio_ms"] for r in connected),
+                "interarrival_jitter_ms_max": max(r["interarrival_jitter_ms"] for r in connected),
+                "pts_gaps_total": sum(r["pts_gaps"] for r in connected),
+                "packets_lost_total": sum(r["packets_lost"] for r in connected),
+                "clients_without_audio": len([r for r in results if r["audio_frames"] == 0]),
+                "datachannel_one_way_ms_p95_max": max(
+                    (r["datachannel_audio"].get("one_way_ms_p95", 0.0) for r in connected), default=0.0
+                ),
+                "datachannel_lost_total": sum(r["datachannel_audio"].get("lost", 0) for r in connected),
+                "idle_cpu_percent_per_session": idle.get("cpu_percent_per_session", 0.0),
+                "loop_lag_ms_p99": loop_status.get("lag", {}).get("p99_ms", 0.0),
+            },
+            "client_results": results,
+            "server_metrics": server_metrics,
+        }
+
+    async def run_profiles(self) -> dict:
+        """Runs the benchmark once per codec profile in --codec-profiles, each against its own server, and compares
+        the server's cpu per session
+
+        Returns:
+            dict: the measurements of each profile, and the full results of each run
+        """
+        runs = {}
+        for profile in self.params.codec_profiles.split(","):
+            self.codec_profile = profile.strip()
+            runs[self.codec_profile] = await self.run()
+        return {
+            "profiles": {
+                profile: {
+                    "codecs": sorted({r["codec"] for r in result["client_results"] if r["codec"]}),
+                    "cpu_percent_per_session": result["server"]["cpu_percent_per_session"],
+                    "idle_cpu_percent_per_session": result["summary"]["idle_cpu_percent_per_session"],
+                    "rss_mb_per_session": result["server"]["rss_mb_per_session"],
+                    "time_to_first_audio_ms_max": result["summary"]["time_to_first_audio_ms_max"],
+                }
+                for profile, result in runs.items()
+            },
+            "runs": runs,
+        }
+
+    async def run_loops(self) -> dict:
+        """Runs the benchmark once per event loop in --event-loops, each against its own server, and compares the
+        loops' lag and the server's cpu per session
+
+        Returns:
+            dict: the measurements of each loop, and the full results of each run
+        """
+        runs = {}
+        for loop_name in self.params.event_loops.split(","):
+            self.event_loop = loop_name.strip()
+            runs[self.event_loop] = await self.run()
+        return {
+            "event_loops": {
+                loop_name: {
+                    "loop_lag": result["server"]["event_loop"].get("lag", {}),
+                    "loop_stalls": result["server"]["event_loop"].get("stalls", 0),
+                    "cpu_percent_per_session": result["server"]["cpu_percent_per_session"],
+                    "interarrival_jitter_ms_max": result["summary"]["interarrival_jitter_ms_max"],
+                    "time_to_first_audio_ms_max": result["summary"]["time_to_first_audio_ms_max"],
+                }
+                for loop_name, result in runs.items()
+            },
+            "runs": runs,
+        }
+
+
+if __name__ == "__main__":
+    """Runs the loopback benchmark, e.g.: python benchmark.py --clients 4 --duration 20 --output bench.json"""
+    parser = argparse.ArgumentParser(
+        prog="benchmark", description="Headless loopback load generator for webrtcsvr"
+    )
+    parser.add_argument("--clients", type=int, default=1, help="number of headless clients")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds to receive audio")
+    parser.add_argument("--stagger", type=float, default=100.0, help="milliseconds between client connections")
+    parser.add_argument("--host", default=CONST.DEFAULT_HOST, help="server host")
+    parser.add_argument("--port", type=int, default=CONST.DEFAULT_PORT, help="server port")
+    parser.add_argument(
+        "--server-args",
+        nargs=argparse.REMAINDER,
+        default=[],
+        help="extra arguments for webrtcsvr.py, everything after it so it must come last (e.g., --server-args "
+        "--workers 4 --dtx)",
+    )
+    parser.add_argument(
+        "--no-server", action="store_true", help="use an already running server instead of starting one"
+    )
+    parser.add_argument(
+        "--server-pid", type=int, default=0, help="pid of the already running server to measure with --no-server"
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=CONST.DEFAULT_DRAIN_TIMEOUT_SECONDS,
+        help="seconds to wait for the server to exit",
+    )
+    parser.add_argument(
+        "--datachannel-audio",
+        choices=datachannel_audio.FORMATS,
+        default=datachannel_audio.FORMAT_OFF,
+        help="also receive the audio over the data channel to compare its latency with the media track",
+    )
+    parser.add_argument(
+        "--datachannel-parameters",
+        default='{"ordered": false, "maxRetransmits": 0}',
+        help="RTCDataChannel options as JSON (default unordered without retransmissions)",
+    )
+    parser.add_argument(
+        "--idle",
+        type=float,
+        default=0.0,
+        help="after --duration, wait for the responses to finish and measure this many seconds of idle sessions",
+    )
+    parser.add_argument(
+        "--codec-profiles",
+        default="",
+        help='run once per server codec profile and compare cpu per session (e.g., "browser,low-cpu")',
+    )
+    parser.add_argument(
+        "--event-loops",
+        default="",
+        help='run once per server event loop and compare their lag and cpu per session (e.g., "asyncio,uvloop")',
+    )
+    parser.add_argument("--record-dir", default=None, help="directory to write each client's received audio")
+    parser.add_argument("--output", default=None, help="file to write the JSON results to (default stdout)")
+    params = parser.parse_args()
+    # a quoted "--workers 4" and separate --workers 4 both end up as one string split when the server starts
+    params.server_args = " ".join(params.server_args)
+    if params.codec_profiles and params.no_server:
+        parser.error("--codec-profiles starts a server per profile, so it cannot be used with --no-server")
+    if params.event_loops and params.no_server:
+        parser.error("--event-loops starts a server per event loop, so it cannot be used with --no-server")
+    if params.codec_profiles and params.event_loops:
+        parser.error("--codec-profiles and --event-loops cannot be combined")
+    if params.codec_profiles:
+        results = asyncio.run(benchmark(params).run_profiles())
+    elif params.event_loops:
+        results = asyncio.run(benchmark(params).run_loops())
+    else:
+        results = asyncio.run(benchmark(params).run())
+    text = json.dumps(results, indent=2)
+    if params.output:
+        with open(params.output, "w") as handle:
+            handle.write(text)
+        print(f"Results written to {params.output}")
+    else:
+        print(text)
@@ -0,0 +1,263 @@
+import fractions
+import os
+import queue
+import time
+from logging import Logger
+from threading import Thread
+from typing import ClassVar
+
+import av
+import numpy as np
+
+from constants import constants as CONST
+
+
+class call_recorder:
+    """Records both legs of a call to a compressed file (FLAC, or Opus in Ogg) from a background thread.
+
+    The tracks only hand over what they already have: the output track its AudioFrame or Opus packet bytes, the input
+    track the decoded AudioFrame. Decoding, resampling, mixing and encoding happen on the recorder's thread. Memory is
+    bounded by the handoff queue (full means the audio is dropped and counted) and by MAX_SKEW_SECONDS, past which the
+    leg that has fallen behind (e.g., the caller has stopped sending) is filled with silence so the other leg is written.
+    """
+
+    LEG_INBOUND = 0  # audio received from the web client
+    LEG_OUTBOUND = 1  # audio sent to the web client
+    FORMAT_NONE = "none"
+    FORMAT_FLAC = "flac"
+    FORMAT_OGG = "ogg"
+    FORMATS = (FORMAT_NONE, FORMAT_FLAC, FORMAT_OGG)
+    LAYOUT_SPLIT = "split"  # inbound on the left channel, outbound on the right
+    LAYOUT_MIXED = "mixed"  # both legs summed to mono
+    LAYOUTS = (LAYOUT_SPLIT, LAYOUT_MIXED)
+    # container format, codec and file extension of each recording format
+    CODECS: ClassVar[dict[str, tuple]] = {FORMAT_FLAC: ("flac", "flac", "flac"), FORMAT_OGG: ("ogg", "libopus", "ogg")}
+    QUEUE_SIZE = 1000  # ~20 seconds of 20 ms frames per leg
+    MAX_SKEW_SECONDS = 2.0
+
+    def __init__(
+        self,
+        directory: str,
+        session_name: str,
+        record_format: str,
+        layout: str,
+        logger: Logger,
+        sample_rate: int = CONST.WEB_RTC_AUDIO_SAMPLE_RATE,
+    ):
+        """Constructor for call_recorder, starting its writer thread
+
+        Args:
+            directory (str): directory for the recording
+            session_name (str): used in the recording's file name
+            record_format (str): FORMAT_FLAC or FORMAT_OGG
+            layout (str): LAYOUT_SPLIT or LAYOUT_MIXED
+            logger (Logger): logger to record status
+            sample_rate (int, optional): the recording's sample rate. Defaults to CONST.WEB_RTC_AUDIO_SAMPLE_RATE.
+        """
+        container_format, self.codec, extension = call_recorder.CODECS[record_format]
+        self.container_format = container_format
+        self.layout = layout
+        self.logger = logger
+        self.sample_rate = sample_rate
+        os.makedirs(directory, exist_ok=True)
+        self.filename = os.path.join(directory, f"call_{session_name}_{time.time():.6f}.{extension}")
+        self.queue = queue.Queue(maxsize=call_recorder.QUEUE_SIZE)
+        self.start_time = time.monotonic()
+        self.dropped = 0
+        self.closed = False
+        self.samples_written = 0
+        # the rest is only touched by the writer thread
+        self.legs = [[], []]  # pending int16 mono arrays of each leg
+        self.leg_samples = [0, 0]
+        self.leg_started = [False, False]
+        self.resamplers = [None, None]  # (input setup, AudioResampler) of each leg
+        self.opus_decoder = None
+        self.thread = Thread(target=self.run, name="call_recorder", daemon=True)
+        self.thread.start()
+
+    def add(self, leg: int, audio: av.AudioFrame | bytes | float):
+        """Hands a frame (or Opus packet bytes) of a leg to the recorder. Called from the audio path, so it only queues.
+
+        Args:
+            leg (int): LEG_INBOUND or LEG_OUTBOUND
+            audio (av.AudioFrame | bytes | float): a frame that will not be modified afterwards, an Opus packet, or the
+                seconds of a gap (see add_gap)
+        """
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait((leg, audio, time.monotonic()))
+        except queue.Full:
+            self.dropped += 1
+
+    def add_gap(self, leg: int, seconds: float):
+        """Hands the recorder a stretch of a leg that was not sent (e.g., silence suppressed by dtx), recorded as
+        silence so the leg's timeline keeps up with the other
+
+        Args:
+            leg (int): LEG_INBOUND or LEG_OUTBOUND
+            seconds (float): the length of the gap
+        """
+        if seconds > 0:
+            self.add(leg, seconds)
+
+    def close(self):
+        """Finishes the recording once the queued audio has been written"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put((None, None, 0.0))
+
+    def join(self, timeout: float = 5.0):
+        """Waits for the writer thread to finish the file
+
+        Args:
+            timeout (float, optional): seconds to wait. Defaults to 5.0.
+        """
+        self.thread.join(timeout)
+
+    def to_samples(self, leg: int, audio: av.AudioFrame | bytes | float) -> list:
+        """Decodes (Opus bytes) and resamples a leg's audio to mono int16 at the recording's rate
+
+        Args:
+            leg (int): the leg the audio belongs to
+            audio (av.AudioFrame | bytes | float): the audio handed to add(), or the seconds of a gap
+
+        Returns:
+            list: int16 arrays
+        """
+        if isinstance(audio, float):
+            return [np.zeros(round(audio * self.sample_rate), dtype=np.int16)]
+        if isinstance(audio, (bytes, bytearray)):
+            if self.opus_decoder is None:
+                self.opus_decoder = av.CodecContext.create("opus", "r")
+            frames = self.opus_decoder.decode(av.Packet(audio))
+        else:
+            frames = [audio]
+        samples = []
+        for frame in frames:
+            setup = (frame.format.name, frame.layout.name, frame.sample_rate)
+            if self.resamplers[leg] is None or self.resamplers[leg][0] != setup:
+                # e.g., the output switching between sent frames and decoded Opus packets
+                self.resamplers[leg] = (
+                    setup,
+                    av.AudioResampler(format="s16", layout="mono", rate=self.sample_rate),
+                )
+            # the frame may still be read by the sender, so it is only read here, never modified
+            for resampled in self.resamplers[leg][1].resample(frame):
+                samples.append(resampled.to_ndarray().reshape(-1))
+        return samples
+
+    def append(self, leg: int, samples: np.ndarray, arrival: float):
+        """Adds samples to a leg, placing the leg's first audio at its arrival time relative to the recording's start
+
+        Args:
+            leg (int): the leg
+            samples (np.ndarray): int16 mono samples
+            arrival (float): time.monotonic() when the audio was handed over
+        """
+        if not self.leg_started[leg]:
+            self.leg_started[leg] = True
+            lead = int((arrival - self.start_time) * self.sample_rate) - self.leg_samples[leg]
+            if lead > 0:
+                self.legs[leg].append(np.zeros(lead, dtype=np.int16))
+                self.leg_samples[leg] += lead
+        self.legs[leg].append(samples)
+        self.leg_samples[leg] += samples.size
+
+    def take(self, leg: int, count: int) -> np.ndarray:
+        """Removes the first count samples of a leg, padding with silence if it has fewer
+
+        Args:
+            leg (int): the leg
+            count (int): the number of samples
+
+        Returns:
+            np.ndarray: int16 mono samples
+        """
+        pending = np.concatenate(self.legs[leg]) if self.legs[leg] else np.zeros(0, dtype=np.int16)
+        if pending.size < count:
+            pending = np.concatenate([pending, np.zeros(count - pending.size, dtype=np.int16)])
+        self.legs[leg] = [pending[count:]] if pending.size > count else []
+        self.leg_samples[leg] = max(0, self.leg_samples[leg] - count)
+        return pending[:count]
+
+    def write(self, container, stream, final: bool = False):
+        """Encodes the samples both legs have (or, past the skew limit or when final, everything pending)
+
+        Args:
+            container (av.container.OutputContainer): the output file
+            stream (av.audio.stream.AudioStream): the output stream
+            final (bool, optional): True to write everything pending. Defaults to False.
+        """
+        count = min(self.leg_samples)
+        most = max(self.leg_samples)
+        if final or most - count > call_recorder.MAX_SKEW_SECONDS * self.sample_rate:
+            count = most
+        if count <= 0:
+            return
+        inbound = self.take(call_recorder.LEG_INBOUND, count)
+        outbound = self.take(call_recorder.LEG_OUTBOUND, count)
+        if self.layout == call_recorder.LAYOUT_MIXED:
+            mixed = np.clip(inbound.astype(np.int32) + outbound, -32768, 32767).astype(np.int16)
+            frame = av.AudioFrame.from_ndarray(mixed.reshape(1, -1), format="s16", layout="mono")
+        else:
+            stereo = np.column_stack([inbound, outbound]).reshape(1, -1)
+            frame = av.AudioFrame.from_ndarray(stereo, format="s16", layout="stereo")
+        frame.sample_rate = self.sample_rate
+        frame.pts = self.samples_written
+        frame.time_base = fractions.Fraction(1, self.sample_rate)
+        self.samples_written += count
+        for packet in stream.encode(frame):
+            container.mux(packet)
+
+    def run(self):
+        """Writer thread: converts the handed over audio and encodes it to the recording"""
+        container = None
+        try:
+            container = av.open(self.filename, "w", format=self.container_format)
+            stream = container.add_stream(
+                self.codec,
+                rate=self.sample_rate,
+                layout="mono" if self.layout == call_recorder.LAYOUT_MIXED else "stereo",
+            )
+            finished = False
+            while not finished:
+                items = [self.queue.get()]
+                while True:
+                    try:
+                        items.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                for leg, audio, arrival in items:
+                    if leg is None:
+                        finished = True
+                        continue
+                    for samples in self.to_samples(leg, audio):
+                        self.append(leg, samples, arrival)
+                self.write(container, stream, final=finished)
+            for packet in stream.encode(None):
+                container.mux(packet)
+            self.logger.info(
+                f"Recorded {self.samples_written / self.sample_rate:.2f} seconds to {self.filename}"
+                f" ({self.dropped} frames dropped)."
+            )
+        except Exception:
+            self.closed = True
+            self.logger.exception(f"Call recording {self.filename} failed")
+        finally:
+            if container is not None:
+                container.close()
+
+    def status(self) -> dict:
+        """Returns the recording's file and progress
+
+        Returns:
+            dict: file name, seconds written and frames dropped
+        """
+        return {
+            "file": self.filename,
+            "seconds": round(self.samples_written / self.sample_rate, 3),
+            "dropped": self.dropped,
+            "closed": self.closed,
+        }
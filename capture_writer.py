@@ -0,0 +1,324 @@
+import os
+import queue
+import struct
+import time
+from logging import Logger
+from threading import Lock, Thread
+
+from constants import constants as CONST
+
+SAMPLE_WIDTH = 2  # int16
+
+
+def wav_header(sample_rate: int, channels: int, data_bytes: int) -> bytes:
+    """Returns a 44 byte PCM wav header
+
+    Args:
+        sample_rate (int): frames per second
+        channels (int): the number of interleaved channels
+        data_bytes (int): the length of the data chunk
+
+    Returns:
+        bytes: the RIFF/WAVE header preceding the samples
+    """
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + data_bytes,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,  # PCM
+        channels,
+        sample_rate,
+        sample_rate * channels * SAMPLE_WIDTH,
+        channels * SAMPLE_WIDTH,
+        SAMPLE_WIDTH * 8,
+        b"data",
+        data_bytes,
+    )
+
+
+class capture_tap:
+    """One stage's capture file. write() only hands the buffer to the capture_writer, the file is owned by its thread."""
+
+    def __init__(self, writer: "capture_writer", filename: str, sample_rate: int, channels: int):
+        """Constructor for capture_tap
+
+        Args:
+            writer (capture_writer): the background writer
+            filename (str): the wav file to be written
+            sample_rate (int): the sample rate of the captured audio
+            channels (int): the number of interleaved channels
+        """
+        self.writer = writer
+        self.filename = filename
+        self.sample_rate = sample_rate
+        self.channels = channels
+        # only touched by the writer thread
+        self.file = None
+        self.data_bytes = 0
+
+    def write(self, data):
+        """Queues audio for the writer thread. The buffer must not be modified afterwards (bytes, or a memoryview of an
+        array that is not reused).
+
+        Args:
+            data (bytes | memoryview | np.ndarray): int16 samples
+        """
+        self.writer.submit(self, memoryview(data).cast("B"))
+
+
+class capture_session:
+    """The stage taps of one conversation, replacing the DEBUG_FILES captures. Captures are switched on and off at
+    runtime and each start writes a new set of wav files named for the session and time."""
+
+    RAWAUDIO_24 = "01_rawaudio_24"
+    MONOFRAME_24 = "02_monoframe_24"
+    STEREOFRAME_48 = "03_stereoframe_48"
+    SENDFRAME_48 = "04_sendframe_48"
+    STAGES = (
+        (RAWAUDIO_24, CONST.TTS_AUDIO_SAMPLE_RATE, 1),
+        (MONOFRAME_24, CONST.TTS_AUDIO_SAMPLE_RATE, 1),
+        (STEREOFRAME_48, CONST.WEB_RTC_AUDIO_SAMPLE_RATE, CONST.AUDIO_CHANNELS_STEREO),
+        (SENDFRAME_48, CONST.WEB_RTC_AUDIO_SAMPLE_RATE, CONST.AUDIO_CHANNELS_STEREO),
+    )
+
+    def __init__(self, writer: "capture_writer", session_name: str):
+        """Constructor for capture_session
+
+        Args:
+            writer (capture_writer): the background writer
+            session_name (str): used in the capture file names
+        """
+        self.writer = writer
+        self.session_name = session_name
+        self.enabled = False
+        self.taps = {}
+        self.files = []
+
+    def start(self):
+        """Starts capturing every stage to a new set of wav files"""
+        if self.enabled:
+            return
+        now = time.time()
+        self.taps = {
+            stage: capture_tap(
+                self.writer,
+                os.path.join(self.writer.directory, f"capture_{self.session_name}_{now:.6f}_{stage}.wav"),
+                sample_rate,
+                channels,
+            )
+            for stage, sample_rate, channels in capture_session.STAGES
+        }
+        self.files = [tap.filename for tap in self.taps.values()]
+        self.enabled = True
+
+    def stop(self):
+        """Stops capturing, the writer finishes each file once the audio queued before this call is written"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        for tap in self.taps.values():
+            self.writer.submit(tap, None)
+
+    def tap(self, stage: str, data):
+        """Queues audio for a stage if capturing is on
+
+        Args:
+            stage (str): one of the STAGES names
+            data (bytes | memoryview | np.ndarray): int16 samples that will not be modified afterwards
+        """
+        if self.enabled:
+            tap = self.taps.get(stage, None)
+            if tap is not None:
+                tap.write(data)
+
+    def status(self) -> dict:
+        """Returns whether this session is capturing and its most recent files
+
+        Returns:
+            dict: enabled flag and file names
+        """
+        return {"enabled": self.enabled, "files": self.files}
+
+
+class capture_writer:
+    """Background thread writing every session's capture taps.
+
+    Taps put (tap, memoryview) on a bounded queue and return; the thread drains the queue in batches, joins each tap's
+    buffers into a single write, and keeps the wav header's lengths current so a capture is playable even if the server
+    dies. When the queue is full or the disk budget is used up, audio is dropped and counted rather than delaying the
+    audio path.
+    """
+
+    BATCH_ITEMS = 256
+    QUEUE_SIZE = 4096
+
+    writer = None
+    writer_lock = Lock()
+
+    def __init__(self, directory: str, max_bytes: int, logger: Logger):
+        """Constructor for capture_writer. Use capture_writer.get_writer to share one writer per process.
+
+        Args:
+            directory (str): directory for the capture files
+            max_bytes (int): total bytes of audio this process may write before captures are dropped
+            logger (Logger): logger to record status
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.logger = logger
+        self.queue = queue.Queue(maxsize=capture_writer.QUEUE_SIZE)
+        self.bytes_written = 0
+        self.dropped_bytes = 0
+        self.budget_exceeded = False
+        self.stopped = False
+        # taps with an open file, only touched by the writer thread
+        self.taps_open = set()
+        os.makedirs(directory, exist_ok=True)
+        self.thread = Thread(target=self.run, name="capture_writer", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def get_writer(config: dict, logger: Logger) -> "capture_writer":
+        """Returns the process-wide capture_writer, creating it on first use
+
+        Args:
+            config (dict): the server configuration (CONST.CAPTURE_DIR, CONST.CAPTURE_MAX_MB)
+            logger (Logger): logger to record status
+
+        Returns:
+            capture_writer: the shared writer
+        """
+        with capture_writer.writer_lock:
+            if capture_writer.writer is None:
+                capture_writer.writer = capture_writer(
+                    config.get(CONST.CAPTURE_DIR, CONST.DEFAULT_CAPTURE_DIR),
+                    int(config.get(CONST.CAPTURE_MAX_MB, CONST.DEFAULT_CAPTURE_MAX_MB) * 1024 * 1024),
+                    logger,
+                )
+            return capture_writer.writer
+
+    @staticmethod
+    def shutdown_writer():
+        """Finishes the queued writes and closes the files of the process-wide writer if one was created"""
+        with capture_writer.writer_lock:
+            if capture_writer.writer is not None:
+                capture_writer.writer.stop()
+                capture_writer.writer = None
+
+    def submit(self, tap: capture_tap, data: memoryview | None):
+        """Queues data for a tap (None finishes the tap's file), dropping it if the queue is full
+
+        Args:
+            tap (capture_tap): the tap the data belongs to
+            data (memoryview | None): the audio, or None to close the file
+        """
+        try:
+            self.queue.put_nowait((tap, data))
+        except queue.Full:
+            if data is not None:
+                self.dropped_bytes += data.nbytes
+            else:
+                # a close must not be lost, the writer thread will get to it shortly
+                self.queue.put((tap, data))
+
+    def run(self):
+        """Writer thread: batches queued buffers per tap and writes them"""
+        while True:
+            try:
+                items = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                if self.stopped:
+                    break
+                continue
+            while len(items) < capture_writer.BATCH_ITEMS:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            pending = {}
+            for tap, data in items:
+                if tap is None:
+                    continue
+                if data is None:
+                    self.flush(tap, pending.pop(tap, []))
+                    self.close(tap)
+                else:
+                    pending.setdefault(tap, []).append(data)
+            for tap, buffers in pending.items():
+                self.flush(tap, buffers)
+            if any(tap is None for tap, _ in items):
+                break
+        for tap in list(self.taps_open):
+            self.close(tap)
+
+    def flush(self, tap: capture_tap, buffers: list):
+        """Writes a tap's buffers with a single write and updates its header (writer thread only)
+
+        Args:
+            tap (capture_tap): the tap being written
+            buffers (list): memoryviews in arrival order
+        """
+        if not buffers:
+            return
+        nbytes = sum(buffer.nbytes for buffer in buffers)
+        if self.bytes_written + nbytes > self.max_bytes:
+            self.dropped_bytes += nbytes
+            if not self.budget_exceeded:
+                self.budget_exceeded = True
+                self.logger.warning(
+                    f"Capture disk budget of {self.max_bytes} bytes used, dropping further capture audio."
+                )
+            return
+        try:
+            if tap.file is None:
+                # held open across batches, closed by close()
+                tap.file = open(tap.filename, "wb")  # noqa: SIM115
+                tap.file.write(wav_header(tap.sample_rate, tap.channels, 0))
+                self.taps_open.add(tap)
+            tap.file.write(b"".join(buffers))
+            tap.data_bytes += nbytes
+            self.bytes_written += nbytes
+            # keep the header current so the file plays even if it is never closed
+            tap.file.seek(0)
+            tap.file.write(wav_header(tap.sample_rate, tap.channels, tap.data_bytes))
+            tap.file.seek(0, os.SEEK_END)
+        except OSError as e:
+            self.dropped_bytes += nbytes
+            self.logger.warning(f"Error writing capture {tap.filename}: {e}")
+
+    def close(self, tap: capture_tap):
+        """Closes a tap's file (writer thread only)
+
+        Args:
+            tap (capture_tap): the tap to be closed
+        """
+        if tap.file is not None:
+            try:
+                tap.file.close()
+            except OSError as e:
+                self.logger.warning(f"Error closing capture {tap.filename}: {e}")
+            tap.file = None
+            self.taps_open.discard(tap)
+            self.logger.info(f"Capture {tap.filename} written with {tap.data_bytes} bytes of audio.")
+
+    def stop(self):
+        """Asks the writer thread to finish what is queued, close its files and exit, waiting briefly for it"""
+        self.stopped = True
+        self.queue.put((None, None))
+        self.thread.join(timeout=5)
+
+    def status(self) -> dict:
+        """Returns the writer's totals
+
+        Returns:
+            dict: bytes written, bytes dropped and the disk budget
+        """
+        return {
+            "directory": self.directory,
+            "bytes_written": self.bytes_written,
+            "dropped_bytes": self.dropped_bytes,
+            "max_bytes": self.max_bytes,
+        }
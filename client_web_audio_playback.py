@@ -1,9 +1,11 @@
 # generic imports
 from asyncio import AbstractEventLoop
+from concurrent.futures import CancelledError
 from queue import Empty, Queue
+import logging
 from logging import Logger
 import time
-from threading import Thread, Event
+from threading import Event, Lock, Thread
 from constants import constants as CONST
 from scipy.io import wavfile
 from audio_output_track import audio_output_track
@@ -15,6 +17,10 @@ from numpy import ndarray as NDArray
 class client_web_audio_playback:
     """Playback of audio received from the server."""
 
+    # playback.wav converted to int16 chunks, shared by every conversation
+    playback_chunks = None
+    playback_chunks_lock = Lock()
+
     @staticmethod
     def float2int(sound: NDArray) -> NDArray:
         """Convert the sound
@@ -55,55 +61,58 @@ class client_web_audio_playback:
         self.config = config
         self.ioloop = ioloop
         self.logger = logger
+        self.frame_logger = logging.getLogger(CONST.FRAME_LOGGER_NAME)
         self.playback_audio_track = None
+        # 48 kHz samples of the last response sent to the browser when it finished playing
+        self.played_samples = 0
 
         # Audio queue for thread-safe communication
         self.audio_playback_queue = Queue()
-
-        # Simulate audio being queued for playback
-        sample_rate, input_data = wavfile.read("./playback.wav")
-        assert sample_rate == CONST.TTS_AUDIO_SAMPLE_RATE
-        while len(input_data) >= CONST.FRAMES_PER_BUFFER:
-            audio_float32 = input_data[: CONST.FRAMES_PER_BUFFER]
-            input_data = input_data[CONST.FRAMES_PER_BUFFER :]
-            audio_stream = bytearray(
-                client_web_audio_playback.float2int(
-                    np.frombuffer(audio_float32, dtype=np.float32)
-                ).tobytes()
-            )
-            # create a message to add to the array
-            msg = queue_msg.make_user_msg(
-                {
-                    CONST.TYPE: CONST.TYPE_AUDIO_CHUNK,
-                    CONST.AUDIO_BYTEARRAY: audio_stream,
-                }
-            )
-            self.audio_playback_queue.put(msg)
-        if len(input_data) > 0:
-            audio_float32 = input_data[0:]
-            input_data = None
-            audio_stream = bytearray(
-                client_web_audio_playback.float2int(
-                    np.frombuffer(audio_float32, dtype=np.float32)
-                ).tobytes()
-            )
-            # create a message to add to the array
-            msg = queue_msg.make_user_msg(
-                {
-                    CONST.TYPE: CONST.TYPE_AUDIO_CHUNK,
-                    CONST.AUDIO_BYTEARRAY: audio_stream,
-                }
+        # True when producer processes send the audio through the msg_bus, which may carry many responses
+        self.bus_fed = bool(config.get(CONST.MSG_BUS, ""))
+
+        if not self.bus_fed:
+            # Simulate audio being queued for playback
+            for audio_stream in client_web_audio_playback.load_playback_chunks():
+                # create a message to add to the array
+                msg = queue_msg.make_user_msg(
+                    {
+                        CONST.TYPE: CONST.TYPE_AUDIO_CHUNK,
+                        CONST.AUDIO_BYTEARRAY: audio_stream,
+                    }
+                )
+                self.audio_playback_queue.put(msg)
+            self.logger.info(
+                f"Wav data events posted to queue. Sending {CONST.MSG_ACTION_DATA_FINISHED}"
             )
+            msg = queue_msg.make_user_msg(CONST.MSG_ACTION_DATA_FINISHED)
             self.audio_playback_queue.put(msg)
-        self.logger.info(
-            f"Wav data events posted to queue. Sending {CONST.MSG_ACTION_DATA_FINISHED}"
-        )
-        msg = queue_msg.make_user_msg(CONST.MSG_ACTION_DATA_FINISHED)
-        self.audio_playback_queue.put(msg)
 
         # Event to signal the playback thread to stop
         self.stop_event = Event()
 
+    @staticmethod
+    def load_playback_chunks() -> list:
+        """Returns playback.wav as int16 chunks of FRAMES_PER_BUFFER samples, reading and converting it only once per
+        process since every conversation plays the same file
+
+        Returns:
+            list: bytes of each chunk (the last may be shorter)
+        """
+        with client_web_audio_playback.playback_chunks_lock:
+            if client_web_audio_playback.playback_chunks is None:
+                sample_rate, input_data = wavfile.read("./playback.wav")
+                assert sample_rate == CONST.TTS_AUDIO_SAMPLE_RATE
+                audio = client_web_audio_playback.float2int(
+                    np.frombuffer(input_data, dtype=np.float32)
+                ).tobytes()
+                chunk_bytes = CONST.FRAMES_PER_BUFFER * 2
+                client_web_audio_playback.playback_chunks = [
+                    audio[start : start + chunk_bytes]
+                    for start in range(0, len(audio), chunk_bytes)
+                ]
+            return client_web_audio_playback.playback_chunks
+
     def is_playing_back_audio(self) -> bool:
         """Return true if we have begun playing back audio
 
@@ -173,14 +182,28 @@ class client_web_audio_playback:
                                         f"Playback stream reactivated: {self.playback_audio_track.is_active()}"
                                     )
 
-                        raw_audio_bytearray = event.get(
-                            CONST.AUDIO_BYTEARRAY, bytearray()
-                        )
-                        self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER].extend(
-                            raw_audio_bytearray
-                        )
-                        self.logger.info(
-                            f"Accumulating audio chunk len={len(raw_audio_bytearray)} to total {len(self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER])}, {self.audio_playback_queue.unfinished_tasks - 1} remaining chunks."
+                        raw_audio_bytearray = event.get(CONST.AUDIO_BYTEARRAY, None)
+                        if raw_audio_bytearray is not None:
+                            self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER].extend(
+                                raw_audio_bytearray
+                            )
+                            chunk_bytes = len(raw_audio_bytearray)
+                        else:
+                            # a msg_bus producer already wrote the audio into the buffer's shared_ring
+                            chunk_bytes = event.get(CONST.AUDIO_RING_BYTES, 0)
+                        timing = self.client_conv_data.get(CONST.FRAME_TIMING, None)
+                        if timing is not None:
+                            timing.on_extend(
+                                chunk_bytes,
+                                action_or_audio_chunk_msg.get_created_ns(),
+                            )
+                        if self.playback_audio_track is not None:
+                            self.playback_audio_track.wakeup.set()
+                        self.frame_logger.debug(
+                            "Accumulating audio chunk len=%d to total %d, %d remaining chunks.",
+                            chunk_bytes,
+                            len(self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER]),
+                            self.audio_playback_queue.unfinished_tasks - 1,
                         )
                         # Mark the queue task as done
                         self.audio_playback_queue.task_done()
@@ -197,9 +220,8 @@ class client_web_audio_playback:
                                 # while loop broken with the stop_event being set
                                 pass
                             self.logger.info("Exit requested via shutdown message")
-                            time.sleep(20)  # allow time for playback to be heard
                             print(
-                                "Finished playing back. Press Ctrl+C a few times to exit."
+                                f"Finished playing back {self.conv_id}. Press Ctrl+C to exit."
                             )
 
                             break
@@ -207,21 +229,12 @@ class client_web_audio_playback:
                             self.logger.info("Received data finished signal.")
                             self.logger.info("Waiting for output to finish playing")
 
-                            # use a busy wait for playback to complete
-                            counter = 0
-                            while (
-                                counter < 100
-                                and len(
-                                    self.client_conv_data.get(
-                                        CONST.PLAYBACK_AUDIO_BUFFER, bytearray()
-                                    )
-                                )
-                                > 0
-                            ):
-                                counter += 1
-                                time.sleep(0.5)
+                            finished_ns = time.perf_counter_ns()
+                            self.played_samples = self.wait_for_playout()
                             self.logger.info(
-                                f"Output finished with {len(self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER])} bytes left over."
+                                f"Output finished at sample {self.played_samples}, "
+                                f"{(time.perf_counter_ns() - finished_ns) / 1e6:.1f} ms after the data finished, "
+                                f"with {len(self.client_conv_data[CONST.PLAYBACK_AUDIO_BUFFER])} bytes left over."
                             )
                             self.audio_playback_complete_event.set()
                             self.audio_playback_started_event.clear()
@@ -233,11 +246,12 @@ class client_web_audio_playback:
                                 # while loop broken with the stop_event being set
                                 pass
 
-                            self.audio_playback_queue.put(
-                                queue_msg.make_user_msg(
-                                    CONST.MSG_ACTION_SIGNAL_SHUTDOWN_THREAD
+                            if not self.bus_fed:
+                                self.audio_playback_queue.put(
+                                    queue_msg.make_user_msg(
+                                        CONST.MSG_ACTION_SIGNAL_SHUTDOWN_THREAD
+                                    )
                                 )
-                            )
                             continue
                     # Mark the queue task as done
                     self.audio_playback_queue.task_done()
@@ -281,6 +295,21 @@ class client_web_audio_playback:
                 # while loop broken with the stop_event being set
                 pass
 
+    def wait_for_playout(self) -> int:
+        """Blocks until the audio queued to the output track has been sent to the browser, or the track is closed
+
+        Returns:
+            int: the 48 kHz sample position the track reached
+        """
+        track = self.playback_audio_track
+        if track is None:
+            return 0
+        try:
+            return track.expect_playout().result()
+        except CancelledError:
+            # closed before all of it was sent
+            return track.played_samples
+
     def start_web_playback_thread(
         self, output_index: int, playback_audio_track: audio_output_track
     ) -> Thread:
@@ -0,0 +1,109 @@
+from collections import deque
+
+import numpy as np
+
+
+class clock_drift:
+    """Keeps a session's buffered depth steady against drift between the clock audio arrives by (the TTS engine's) and
+    the 48 kHz clock recv() sends by.
+
+    observe() is given the depth as audio is taken from the playback buffer. Over a sliding window, the slope of the
+    depth is the difference between the two rates, less the correction applied while it was observed. correct()
+    resamples the 24 kHz audio by that estimate (clamped to MAX_CORRECTION) plus a slow pull toward the target depth,
+    with linear interpolation whose phase is carried from block to block. Depth changing faster than MAX_DRIFT is a
+    burst or the end of a response rather than drift, so it is not used.
+    """
+
+    WINDOW_SECONDS = 30.0
+    SAMPLE_SECONDS = 0.5
+    GAP_SECONDS = 2.0  # a longer pause (between responses) starts a new window
+    MIN_SPAN_SECONDS = 5.0
+    MAX_DRIFT = 0.02
+    MAX_CORRECTION = 0.005
+    CONVERGE_SECONDS = 60.0  # time constant of the pull toward the target depth
+
+    def __init__(self, target_ms: float):
+        """Constructor for clock_drift
+
+        Args:
+            target_ms (float): the depth to hold, or 0 to only cancel the drift
+        """
+        self.target_ms = target_ms
+        # (time, depth ms, ratio applied) of the current window
+        self.observations = deque()
+        # input samples consumed per output sample: above 1 plays the audio slightly faster
+        self.ratio = 1.0
+        # the estimated arrival rate over the send rate, less 1
+        self.drift = 0.0
+        # position of the next output sample, counted from the last input sample of the previous block
+        self.position = 0.0
+        self.last = None
+
+    def observe(self, now: float, depth_ms: float):
+        """Records the buffered depth and updates the correction
+
+        Args:
+            now (float): time.perf_counter() seconds
+            depth_ms (float): the milliseconds of audio buffered for the session
+        """
+        observations = self.observations
+        if observations and now - observations[-1][0] < clock_drift.SAMPLE_SECONDS:
+            return
+        if observations and now - observations[-1][0] > clock_drift.GAP_SECONDS:
+            observations.clear()
+        observations.append((now, depth_ms, self.ratio))
+        while now - observations[0][0] > clock_drift.WINDOW_SECONDS:
+            observations.popleft()
+        if len(observations) < 3 or now - observations[0][0] < clock_drift.MIN_SPAN_SECONDS:
+            return
+        window = np.array(observations)
+        # seconds of depth gained per second
+        slope = np.polyfit(window[:, 0] - window[0, 0], window[:, 1], 1)[0] / 1000.0
+        # the depth fell by the correction applied while it was observed
+        drift = slope + float(np.mean(window[:, 2])) - 1.0
+        if abs(drift) > clock_drift.MAX_DRIFT:
+            observations.clear()
+            return
+        self.drift = float(drift)
+        pull = 0.0
+        if self.target_ms > 0:
+            pull = (depth_ms - self.target_ms) / 1000.0 / clock_drift.CONVERGE_SECONDS
+        self.ratio = 1.0 + float(
+            np.clip(drift + pull, -clock_drift.MAX_CORRECTION, clock_drift.MAX_CORRECTION)
+        )
+
+    def correct(self, samples: np.ndarray) -> np.ndarray:
+        """Resamples mono audio by the current ratio. Until a correction is first applied the audio passes through;
+        after that the last input sample is held for the next block.
+
+        Args:
+            samples (np.ndarray): mono int16 samples
+
+        Returns:
+            np.ndarray: mono int16 samples, about samples.size / ratio of them
+        """
+        if self.last is None and self.ratio == 1.0:
+            return samples
+        signal = samples.astype(np.float32)
+        if self.last is not None:
+            signal = np.concatenate([[self.last], signal])
+        end = signal.size - 1
+        count = int(np.ceil((end - self.position) / self.ratio)) if end > self.position else 0
+        positions = self.position + np.arange(count) * self.ratio
+        index = positions.astype(np.int64)
+        fraction = (positions - index).astype(np.float32)
+        output = signal[index] * (1.0 - fraction) + signal[index + 1] * fraction
+        self.position += count * self.ratio - end
+        self.last = signal[-1]
+        return np.clip(np.rint(output), -32768, 32767).astype(np.int16)
+
+    def status(self) -> dict:
+        """Returns the drift estimate and the correction applied
+
+        Returns:
+            dict: both in parts per million
+        """
+        return {
+            "drift_ppm": round(self.drift * 1e6, 1),
+            "correction_ppm": round((self.ratio - 1.0) * 1e6, 1),
+        }
@@ -0,0 +1,81 @@
+from typing import ClassVar
+
+from aiortc import RTCRtpSender, RTCRtpTransceiver
+
+from constants import constants as CONST
+
+
+class codec_profiles:
+    """Server side codec preferences for the audio sent to the browser, and the output format each codec is fed.
+
+    A profile lists mime types in order of preference. It is applied to the audio transceiver with setCodecPreferences
+    once the offer has been matched, so the answer offers the browser the profile's codecs first. The output track then
+    builds frames at the negotiated codec's own rate: 48 kHz stereo for Opus, 8 kHz mono for G.711 (PCMU/PCMA), so
+    the sender's encoder has nothing left to resample. aiortc has no G722 encoder, so LOW_CPU is G.711 only.
+    """
+
+    PROFILE_BROWSER = "browser"  # the first codec of the browser's offer
+    PROFILE_OPUS = "opus"
+    PROFILE_LOW_CPU = "low-cpu"
+    PREFERENCES: ClassVar[dict[str, tuple]] = {
+        PROFILE_BROWSER: (),
+        PROFILE_OPUS: ("audio/opus",),
+        PROFILE_LOW_CPU: ("audio/PCMU", "audio/PCMA"),
+    }
+    PROFILES = tuple(PREFERENCES)
+
+    # (sample rate, channels, samples per 20 ms frame) built by the output track for each codec
+    OUTPUT_OPUS = (CONST.WEB_RTC_AUDIO_SAMPLE_RATE, CONST.AUDIO_CHANNELS_STEREO, CONST.OPUS_FRAMES_PER_BUFFER)
+    OUTPUT_G711 = (CONST.G711_AUDIO_SAMPLE_RATE, 1, CONST.G711_FRAMES_PER_BUFFER)
+    OUTPUT_FORMATS: ClassVar[dict[str, tuple]] = {
+        "audio/opus": OUTPUT_OPUS,
+        "audio/pcmu": OUTPUT_G711,
+        "audio/pcma": OUTPUT_G711,
+    }
+
+    @staticmethod
+    def output_format(mime_type: str | None) -> tuple[int, int, int]:
+        """Returns the format the output track should build for a codec
+
+        Args:
+            mime_type (str | None): the negotiated codec (e.g., audio/PCMU), None if not yet negotiated
+
+        Returns:
+            tuple[int, int, int]: (sample rate, channels, samples per frame), 48 kHz stereo for unknown codecs
+        """
+        return codec_profiles.OUTPUT_FORMATS.get((mime_type or "").lower(), codec_profiles.OUTPUT_OPUS)
+
+    @staticmethod
+    def apply(transceiver: RTCRtpTransceiver | None, profile: str) -> str | None:
+        """Applies a profile's preferences to a transceiver whose codecs setRemoteDescription has already matched
+        against the offer, before createAnswer writes them into the answer
+
+        Args:
+            transceiver (RTCRtpTransceiver | None): the audio transceiver
+            profile (str): one of PROFILES
+
+        Returns:
+            str | None: the mime type of the codec that will be used to send, None if none was negotiated
+        """
+        if transceiver is None:
+            return None
+        preferences = [mime.lower() for mime in codec_profiles.PREFERENCES.get(profile, ())]
+        if preferences:
+            capabilities = RTCRtpSender.getCapabilities("audio")
+            preferred = sorted(
+                (codec for codec in capabilities.codecs if codec.mimeType.lower() in preferences),
+                key=lambda codec: preferences.index(codec.mimeType.lower()),
+            )
+            if preferred:
+                transceiver.setCodecPreferences(preferred)
+            # aiortc filters by the preferences while matching the offer, which has already happened, so reorder the
+            # matched codecs the same way (keeping them all if the browser offered none of the preferred ones)
+            matched = sorted(
+                (codec for codec in transceiver._codecs if codec.mimeType.lower() in preferences),
+                key=lambda codec: preferences.index(codec.mimeType.lower()),
+            )
+            if matched:
+                transceiver._codecs = matched
+        if transceiver._codecs:
+            return transceiver._codecs[0].mimeType
+        return None
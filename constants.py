@@ -3,27 +3,91 @@ class constants:
     ACTION_DATA_FINISHED = "data_finished"
     ACTION_SIGNAL_EXIT = "signal_exit"
     ACTION_SIGNAL_SHUTDOWN_THREAD = "shutdown_thread"
+    ADMIN_TOKEN = "admin_token"
+    ADMIN_TOKEN_ENV = "WEBRTCSVR_ADMIN_TOKEN"
     AUDIO_BYTEARRAY = "audio_bytearray"
     AUDIO_CHANNELS_STEREO = 2
+    AUDIO_RING_BYTES = "audio_ring_bytes"
     AUDIO_MESSAGE_QUEUE = "audio_message_queue"
+    CALL_RECORDER = "call_recorder"
+    CAPTURE = "capture"
+    CAPTURE_DIR = "capture_dir"
+    CAPTURE_MAX_MB = "capture_max_mb"
+    CAPTURE_SESSION = "capture_session"
+    CODEC = "codec"
+    CODEC_PROFILE = "codec_profile"
+    DEFAULT_CAPTURE_DIR = "./logs"
+    DATACHANNEL_AUDIO = "datachannel_audio"
+    DEFAULT_CAPTURE_MAX_MB = 1024
+    DEFAULT_DRAIN_TIMEOUT_SECONDS = 30.0
+    DEFAULT_FAILED_TIMEOUT_SECONDS = 5.0
+    DEFAULT_HOST = "localhost"
+    DEFAULT_IDLE_TIMEOUT_SECONDS = 60.0
+    DEFAULT_MAX_SPEED = 1.1
+    DEFAULT_MAX_NEGOTIATIONS = 8
+    DEFAULT_MSG_BUS_RING_KB = 1024  # about 21 s of 24 kHz mono audio
+    DEFAULT_NEGOTIATION_QUEUE_TIMEOUT_SECONDS = 2.0
+    DEFAULT_PORT = 8910
+    DEFAULT_RECORD_DIR = "./recordings"
+    DEFAULT_RETRY_AFTER_SECONDS = 2
+    DRAIN_TIMEOUT = "drain_timeout"
+    DRIFT_CORRECTION = "drift_correction"
+    DTX = "dtx"
+    DTX_HANGOVER_FRAMES = 5  # silence frames sent after audio before dtx suppresses the rest
+    DTX_KEEPALIVE_SECONDS = 0.4  # one silence frame is still sent this often while suppressed
+    DTX_POLL_SECONDS = 0.02
     EVENT = "event"
+    EVENT_LOOP = "event_loop"
+    FAILED_TIMEOUT = "failed_timeout"
     FRAMES_PER_BUFFER = 1024
+    G711_AUDIO_SAMPLE_RATE = 8000
+    G711_FRAMES_PER_BUFFER = 160  # 20 ms at 8 kHz
+    HOST = "host"
+    IDLE_TIMEOUT = "idle_timeout"
+    LATENCY_TARGET_MS = "latency_target_ms"
+    LOG_QUEUE_SIZE = 10000
+    FRAME_LOG_SAMPLE_EVERY = 50  # 1 logs every per-frame message, 0 logs none
+    FRAME_LOGGER_NAME = "webrtcsvr.frames"
+    FRAME_TIMING = "frame_timing"
+    MAX_CATCHUP_BLOCKS = 8  # blocks the producer builds in one pass when the playback buffer has a backlog
+    MAX_NEGOTIATIONS = "max_negotiations"
+    MAX_SESSIONS = "max_sessions"
+    MAX_SPEED = "max_speed"
     MSG_ACTION_DATA_FINISHED = {"type": "action", "action": ACTION_DATA_FINISHED}
     MSG_ACTION_SIGNAL_SHUTDOWN_THREAD = {
         "type": "action",
         "action": ACTION_SIGNAL_SHUTDOWN_THREAD,
     }
     MSG_ACTION_SIGNAL_EXIT = {"type": "action", "action": ACTION_SIGNAL_EXIT}
+    MSG_BUS = "msg_bus"
+    MSG_BUS_RING_KB = "msg_bus_ring_kb"
+    NEGOTIATION_QUEUE_TIMEOUT = "negotiation_queue_timeout"
+    OFFLOAD = "offload"
+    OFFLOAD_WARM_UP_TIMEOUT_SECONDS = 30.0  # spawning and importing av takes seconds per worker
+    OFFLOAD_WORKERS = "offload_workers"
     OPUS_FRAMES_PER_BUFFER = 960
+    OPUS_SILENCE_PACKET = b"\xf8\xff\xfe"  # 20 ms CELT frame that decodes to silence
     OUTPUT_AUDIO_BUFFER = "output_audio_buffer"
+    PEER_CONNECTION = "peer_connection"
+    PORT = "port"
     PLAYBACK_AUDIO_BUFFER = "playback_audio_buffer"
     PRIORITY_CLASS = "priority_class"
+    RECORD = "record"
+    RECORD_DIR = "record_dir"
+    RECORD_LAYOUT = "record_layout"
+    RETRY_AFTER = "retry_after"
     SEQ = "seq"
+    SESSION_METRICS = "session_metrics"
+    TIME_STRETCH_POLL_SECONDS = 0.02
+    TIME_STRETCH_RAMP_MS = 500.0  # backlog beyond the latency target at which max_speed is reached
     TTS_MAX_BUFFER_SIZE = 2000
     TYPE = "type"
     TYPE_AUDIO_CHUNK = "audio.chunk"
+    WEB_RTC_INPUT_AUDIO_TRACK = "input_audio_track"
     WEB_RTC_PLAYBACK_AUDIO_TRACK = "playback_audio_track"
+    WARM_POOL = "warm_pool"
     CLIENT_WEB_RTC_CONNECTED = "client_web_rtc_connected"
     TEXT_SHUTTING_DOWN = "shutting down"
     TTS_AUDIO_SAMPLE_RATE = 24000
     WEB_RTC_AUDIO_SAMPLE_RATE = 48000
+    WORKERS = "workers"
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+import uuid
+from logging import Logger
+
+from client_web_audio_playback import client_web_audio_playback
+from constants import constants as CONST
+from session_reaper import session_activity
+from shared_ring import shared_ring
+
+
+class conversation:
+    """One client's conversation, created by /offer and closed when its session ends while the web server keeps
+    running: the conversation's data (conv_data[conv_id]), its playback thread (fed the simulated TTS playback.wav, or
+    by producer processes through the msg_bus) and its peer connection session."""
+
+    def __init__(
+        self,
+        client_conv_data: dict,
+        conv_id: str,
+        config: dict,
+        ioloop: asyncio.AbstractEventLoop,
+        logger: Logger,
+    ):
+        """Constructor for conversation
+
+        Args:
+            client_conv_data (dict): the conversation's data, created by webrtcsvr.initialize_conv_data
+            conv_id (str): the conversation identifier
+            config (dict): the server configuration
+            ioloop (asyncio.AbstractEventLoop): the server's event loop
+            logger (Logger): logger to record status
+        """
+        self.conv_id = conv_id
+        self.client_conv_data = client_conv_data
+        self.logger = logger
+        # Event to signal that playback of the current response has started
+        self.audio_playback_started_event = threading.Event()
+        # Event to signal that playback of the current response is complete
+        self.audio_playback_complete_event = threading.Event()
+        self.playback = client_web_audio_playback(
+            conv_id,
+            client_conv_data,
+            self.audio_playback_started_event,
+            self.audio_playback_complete_event,
+            config,
+            ioloop,
+            logger,
+        )
+        self.activity = None
+        self.closed = False
+
+    @staticmethod
+    def new_conv_id() -> str:
+        """Returns a new conversation identifier
+
+        Returns:
+            str: the identifier
+        """
+        return "conv_" + uuid.uuid4().hex
+
+    def start(self, activity: session_activity, output_index: int):
+        """Starts the conversation's playback thread once its peer connection exists
+
+        Args:
+            activity (session_activity): the peer connection's session
+            output_index (int): index of the output device to playback audio
+        """
+        self.activity = activity
+        self.playback.start_web_playback_thread(
+            output_index, self.client_conv_data.get(CONST.WEB_RTC_PLAYBACK_AUDIO_TRACK, None)
+        )
+
+    def close(self):
+        """Stops the playback thread, the output track and the captures (the peer connection is closed by the caller)"""
+        if self.closed:
+            return
+        self.closed = True
+        self.playback.stop_web_playback_thread()
+        track = self.client_conv_data.get(CONST.WEB_RTC_PLAYBACK_AUDIO_TRACK, None)
+        if track is not None and not track.is_stopped():
+            track.close()
+        capture = self.client_conv_data.get(CONST.CAPTURE_SESSION, None)
+        if capture is not None:
+            capture.stop()
+        buffer = self.client_conv_data.get(CONST.PLAYBACK_AUDIO_BUFFER, None)
+        if isinstance(buffer, shared_ring):
+            # unlinks the segment; an attached producer keeps its own mapping until it detaches
+            buffer.close()
+        self.logger.info(f"Conversation {self.conv_id} closed.")
@@ -1,87 +1,171 @@
+import argparse
+import glob
+import mmap
+import os
+import re
+import sys
+import time
 import traceback
-import numpy as np
-import torch
-import torchaudio
-from numpy import ndarray as NDArray
+import wave
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+from constants import constants as CONST
 
-@staticmethod
-def int2float(sound: NDArray | list[int]) -> NDArray:
-    """Convert the sound
+# capture file stem to (sample rate, channels) -- the 48 kHz captures hold interleaved stereo
+CAPTURE_FORMATS = {
+    "tmp_01_rawaudio_24_": (CONST.TTS_AUDIO_SAMPLE_RATE, 1),
+    "tmp_02_monoframe_24_": (CONST.TTS_AUDIO_SAMPLE_RATE, 1),
+    "tmp_03_stereoframe_48_": (CONST.WEB_RTC_AUDIO_SAMPLE_RATE, CONST.AUDIO_CHANNELS_STEREO),
+    "tmp_04_sendframe_48_": (CONST.WEB_RTC_AUDIO_SAMPLE_RATE, CONST.AUDIO_CHANNELS_STEREO),
+}
+CAPTURE_PATTERN = re.compile(
+    "^(" + "|".join(re.escape(stem) for stem in CAPTURE_FORMATS) + r")(\d+(?:\.\d+)?)$"
+)
+SAMPLE_WIDTH = 2  # int16
+CHUNK_BYTES = 4 * 1024 * 1024
+
+
+def find_captures(paths: list, timestamp: str | None = None) -> list:
+    """Finds the raw capture files named by the paths
 
     Args:
-        sound (NDArray): array of int16 sound values
+        paths (list): directories (searched for captures), capture files or glob patterns
+        timestamp (str | None, optional): only return captures with this timestamp. Defaults to None.
 
     Returns:
-        NDArray: sound as float32 sound values between [-1.0,1.0]
+        list: (path, stem, timestamp) of each capture, sorted by timestamp then stem
     """
-    if type(sound) is not NDArray:
-        sound = np.array(sound)
-    return sound.astype(np.float32) / 32768.0
+    candidates = set()
+    for path in paths:
+        if os.path.isdir(path):
+            candidates.update(os.path.join(path, name) for name in os.listdir(path))
+        else:
+            candidates.update(glob.glob(path) or [path])
+    captures = []
+    for candidate in candidates:
+        match = CAPTURE_PATTERN.match(os.path.basename(candidate))
+        if match is None or not os.path.isfile(candidate):
+            continue
+        if timestamp is not None and match.group(2) != timestamp:
+            continue
+        captures.append((candidate, match.group(1), match.group(2)))
+    return sorted(captures, key=lambda capture: (float(capture[2]), capture[1], capture[0]))
 
 
-def audio_to_tensor(audio_frame: bytes) -> torch.Tensor:
-    """Converts the audio bytes to a torch Tensor
+def convert_file(input_filename: str, output_filename: str, sample_rate: int, channels: int) -> int:
+    """Streams a raw int16 capture into a 16-bit PCM wav file without reading it all into memory
 
     Args:
-        audio_frame (bytes): input audio int16 frame
+        input_filename (str): the raw capture
+        output_filename (str): the wav file to be written
+        sample_rate (int): the capture's sample rate
+        channels (int): the capture's channel count (interleaved)
 
     Returns:
-        torch.Tensor: the tensor of 32-bit float values
+        int: the number of frames written (a trailing partial frame is dropped)
     """
-    buffer = int2float(np.frombuffer(audio_frame, dtype=np.int16))
-    return torch.from_numpy(buffer)
+    frame_bytes = SAMPLE_WIDTH * channels
+    size = os.path.getsize(input_filename)
+    usable = size - size % frame_bytes
+    with wave.open(output_filename, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(sample_rate)
+        # declaring the length up front means the header is not rewritten on close
+        wav.setnframes(usable // frame_bytes)
+        if usable == 0:
+            return 0
+        with (
+            open(input_filename, "rb") as file,
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data,
+        ):
+            view = memoryview(data)
+            try:
+                for start in range(0, usable, CHUNK_BYTES):
+                    wav.writeframesraw(view[start : min(start + CHUNK_BYTES, usable)])
+            finally:
+                view.release()
+    return usable // frame_bytes
 
 
-try:
-    print("Enter the timestamp or q to quit: ")
-    timestamp = input()
-    if "q" == timestamp.lower():
-        exit()
+def convert_capture(
+    capture: tuple, output_dir: str | None, sample_rate: int | None, force: bool
+) -> tuple[str, str, int]:
+    """Converts one capture file, skipping it if its wav file is already newer
 
-    print(
-        "Enter sample rate (e.g., 24000, nothing uses defaults for file types), or q to quit"
+    Args:
+        capture (tuple): (path, stem, timestamp) from find_captures
+        output_dir (str | None): directory for the wav file (None writes it beside the capture)
+        sample_rate (int | None): overrides the stem's sample rate when supplied
+        force (bool): True to convert even when the wav file is up to date
+
+    Returns:
+        tuple[str, str, int]: (wav file name, status, frames written)
+    """
+    input_filename, stem, _ = capture
+    default_rate, channels = CAPTURE_FORMATS[stem]
+    output_filename = os.path.basename(input_filename) + ".wav"
+    output_filename = os.path.join(output_dir or os.path.dirname(input_filename), output_filename)
+    if (
+        not force
+        and os.path.exists(output_filename)
+        and os.path.getmtime(output_filename) >= os.path.getmtime(input_filename)
+    ):
+        return output_filename, "skipped", 0
+    frames = convert_file(input_filename, output_filename, sample_rate or default_rate, channels)
+    return output_filename, "saved", frames
+
+
+if __name__ == "__main__":
+    """Converts every capture set found, e.g.: python convert_bytes_to_wav.py . --workers 8"""
+    parser = argparse.ArgumentParser(
+        prog="convert_bytes_to_wav",
+        description="Converts the tmp_0N_* raw audio captures to wav files",
+    )
+    parser.add_argument(
+        "paths", nargs="*", default=["."], help="directories, capture files or glob patterns (default .)"
+    )
+    parser.add_argument("--timestamp", default=None, help="only convert the capture set with this timestamp")
+    parser.add_argument(
+        "--sample-rate", type=int, default=None, help="override the sample rate implied by each file's name"
+    )
+    parser.add_argument("--output-dir", default=None, help="directory for the wav files (default beside each capture)")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="number of processes converting files"
     )
-    sample_rate_str = input()
-    if "q" == sample_rate_str.lower():
-        exit()
-    if not sample_rate_str:
-        sample_rate_str = "Auto"
-
-    input_filestems = [
-        "tmp_01_rawaudio_24_",
-        "tmp_02_monoframe_24_",
-        "tmp_03_stereoframe_48_",
-        "tmp_04_sendframe_48_",
-    ]
-    input_samplerates = [
-        24000,
-        24000,
-        48000,
-        48000,
-    ]
-    index = -1
-    for filestem in input_filestems:
-        index += 1
-        input_filename = filestem + timestamp
-        try:
-            with open(input_filename, "rb") as file:
-                voice_data = file.read()
-                voice_tensor = audio_to_tensor(bytes(voice_data))
-                if voice_tensor.shape[0] > 1:
-                    voice_tensor = voice_tensor.reshape(1, len(voice_tensor))
-
-                ## saving as a wav file ##
-                voice_tensor = voice_tensor.cpu()
-                stt_logfilename = input_filename + ".wav"
-                if sample_rate_str == "Auto":
-                    sample_rate = input_samplerates[index]
+    parser.add_argument("--force", action="store_true", help="convert even if the wav file is up to date")
+    params = parser.parse_args()
+
+    captures = find_captures(params.paths, params.timestamp)
+    if not captures:
+        print("No capture files found.")
+        sys.exit(1)
+    if params.output_dir:
+        os.makedirs(params.output_dir, exist_ok=True)
+    started = time.perf_counter()
+    counts = {"saved": 0, "skipped": 0, "failed": 0}
+    with ProcessPoolExecutor(max_workers=max(1, min(params.workers, len(captures)))) as executor:
+        futures = {
+            executor.submit(
+                convert_capture, capture, params.output_dir, params.sample_rate, params.force
+            ): capture
+            for capture in captures
+        }
+        for future in as_completed(futures):
+            try:
+                output_filename, status, frames = future.result()
+                counts[status] += 1
+                if status == "saved":
+                    print(f"Saved wav file as {output_filename} ({frames} frames)")
                 else:
-                    sample_rate = int(sample_rate_str)
-
-                torchaudio.save(stt_logfilename, voice_tensor, sample_rate=sample_rate)
-                print(f"Saved wav file as {stt_logfilename}")
-        except Exception as e:
-            print(f"Skipping {input_filename} due to error {e}")
-except Exception:
-    traceback.print_exc()
+                    print(f"Skipped {output_filename} (up to date)")
+            except (OSError, ValueError, wave.Error):
+                # unreadable or truncated captures are reported and the rest still converted
+                counts["failed"] += 1
+                print(f"Skipping {futures[future][0]} due to error:")
+                traceback.print_exc()
+    print(
+        f"Processed {len(captures)} files in {time.perf_counter() - started:.2f} seconds: {counts['saved']} saved, "
+        f"{counts['skipped']} up to date, {counts['failed']} failed."
+    )
+    sys.exit(1 if counts["failed"] else 0)
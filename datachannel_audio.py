@@ -0,0 +1,159 @@
+import fractions
+import struct
+import time
+from logging import Logger
+from typing import ClassVar
+
+import av
+import numpy as np
+
+from constants import constants as CONST
+
+
+class datachannel_audio:
+    """Sends a session's outbound audio as sequence-numbered binary messages on its RTCDataChannel.
+
+    Each message is HEADER (format, sequence number, pts in samples at the format's rate, send time in microseconds
+    since the epoch) followed by the payload: 24 kHz mono s16 samples (FORMAT_PCM, 20 ms is 960 bytes so a message fits
+    in one SCTP chunk) or one 20 ms Opus packet at 48 kHz (FORMAT_OPUS). Messages are sent when recv() hands the same
+    audio to the media sender, so a client can compare the two paths directly. Silence is not sent and, since a channel
+    opened unordered without retransmits should not queue either, messages are dropped (and counted) while more than
+    MAX_BUFFERED_BYTES are waiting to be sent.
+    """
+
+    FORMAT_OFF = "off"
+    FORMAT_PCM = "pcm"
+    FORMAT_OPUS = "opus"
+    FORMATS = (FORMAT_OFF, FORMAT_PCM, FORMAT_OPUS)
+    FORMAT_IDS: ClassVar[dict[str, int]] = {FORMAT_PCM: 1, FORMAT_OPUS: 2}
+    HEADER = struct.Struct("!BIIQ")
+    MAX_BUFFERED_BYTES = 64 * 1024
+    # text commands on the data channel: "audio pcm", "audio opus" or "audio off"
+    COMMAND_PREFIX = "audio "
+
+    def __init__(self, channel, audio_format: str, logger: Logger):
+        """Constructor for datachannel_audio
+
+        Args:
+            channel (RTCDataChannel): the session's data channel
+            audio_format (str): FORMAT_PCM or FORMAT_OPUS
+            logger (Logger): logger to record status
+        """
+        self.channel = channel
+        self.audio_format = audio_format
+        self.format_id = datachannel_audio.FORMAT_IDS[audio_format]
+        self.logger = logger
+        self.seq = 0
+        self.sent = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+        self.encoder = None
+        self.decoder = None
+        self.resampler = None
+        self.frame_resampler = None
+
+    @staticmethod
+    def parse(message: bytes) -> tuple[str, int, int, int, bytes]:
+        """Splits a binary message into its header fields and payload
+
+        Args:
+            message (bytes): a message sent by datachannel_audio
+
+        Returns:
+            tuple[str, int, int, int, bytes]: (format, sequence number, pts, send time in microseconds, payload)
+        """
+        format_id, seq, pts, sent_us = datachannel_audio.HEADER.unpack_from(message)
+        audio_format = {value: key for key, value in datachannel_audio.FORMAT_IDS.items()}.get(
+            format_id, datachannel_audio.FORMAT_OFF
+        )
+        return audio_format, seq, pts, sent_us, message[datachannel_audio.HEADER.size :]
+
+    def send(self, pts: int, payload: bytes):
+        """Sends one message, or drops it if the channel is closed or backed up
+
+        Args:
+            pts (int): the payload's position in samples at the format's rate
+            payload (bytes): the audio
+        """
+        if self.channel.readyState != "open" or self.channel.bufferedAmount > datachannel_audio.MAX_BUFFERED_BYTES:
+            self.dropped += 1
+            return
+        header = datachannel_audio.HEADER.pack(
+            self.format_id, self.seq & 0xFFFFFFFF, pts & 0xFFFFFFFF, time.time_ns() // 1000
+        )
+        self.seq += 1
+        message = header + payload
+        self.channel.send(message)
+        self.sent += 1
+        self.bytes_sent += len(message)
+
+    def send_frame(self, frame: av.AudioFrame):
+        """Sends the audio of a frame returned by recv(), 48 kHz stereo unless the session negotiated a narrowband codec
+
+        Args:
+            frame (av.AudioFrame): the frame, which is only read
+        """
+        if frame.sample_rate != CONST.WEB_RTC_AUDIO_SAMPLE_RATE or frame.layout.name != "stereo":
+            # e.g., 8 kHz mono for G.711: bring it to the 48 kHz stereo the formats below are taken from
+            if self.frame_resampler is None:
+                self.frame_resampler = av.AudioResampler(
+                    format="s16", layout="stereo", rate=CONST.WEB_RTC_AUDIO_SAMPLE_RATE
+                )
+            pts = (frame.pts or 0) * CONST.WEB_RTC_AUDIO_SAMPLE_RATE // frame.sample_rate
+            for resampled in self.frame_resampler.resample(frame):
+                resampled.pts = pts
+                pts += resampled.samples
+                self.send_frame(resampled)
+            return
+        if self.audio_format == datachannel_audio.FORMAT_PCM:
+            # the left channel at half the rate, the pipeline upsampled it from 24 kHz mono
+            samples = frame.to_ndarray().reshape(-1)[:: 2 * CONST.AUDIO_CHANNELS_STEREO]
+            self.send((frame.pts or 0) // 2, np.ascontiguousarray(samples, dtype=np.int16).tobytes())
+            return
+        if self.encoder is None:
+            self.encoder = av.CodecContext.create("libopus", "w")
+            self.encoder.sample_rate = CONST.WEB_RTC_AUDIO_SAMPLE_RATE
+            self.encoder.layout = "stereo"
+            self.encoder.format = "s16"
+            self.encoder.time_base = fractions.Fraction(1, CONST.WEB_RTC_AUDIO_SAMPLE_RATE)
+        # encoded from a copy so the sender's frame is not modified
+        copy = av.AudioFrame.from_ndarray(frame.to_ndarray(), format="s16", layout="stereo")
+        copy.sample_rate = CONST.WEB_RTC_AUDIO_SAMPLE_RATE
+        copy.pts = frame.pts
+        copy.time_base = self.encoder.time_base
+        for packet in self.encoder.encode(copy):
+            # one packet per 20 ms frame, stamped with the frame's pts rather than the encoder's (negative) preroll
+            self.send(frame.pts or 0, bytes(packet))
+
+    def send_packet(self, payload: bytes, pts: int):
+        """Sends the audio of an Opus packet returned by recv_packet() (offload encode mode)
+
+        Args:
+            payload (bytes): the 48 kHz Opus packet
+            pts (int): the packet's pts in 48 kHz samples
+        """
+        if self.audio_format == datachannel_audio.FORMAT_OPUS:
+            self.send(pts, payload)
+            return
+        if self.decoder is None:
+            self.decoder = av.CodecContext.create("opus", "r")
+            self.resampler = av.AudioResampler(
+                format="s16", layout="stereo", rate=CONST.WEB_RTC_AUDIO_SAMPLE_RATE
+            )
+        for decoded in self.decoder.decode(av.Packet(payload)):
+            for frame in self.resampler.resample(decoded):
+                frame.pts = pts
+                self.send_frame(frame)
+
+    def status(self) -> dict:
+        """Returns the sender's counters
+
+        Returns:
+            dict: format, messages sent and dropped, bytes sent
+        """
+        return {
+            "format": self.audio_format,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "bytes_sent": self.bytes_sent,
+        }
@@ -0,0 +1,297 @@
+import fractions
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from threading import Lock, Thread
+
+import numpy as np
+
+from constants import constants as CONST
+
+# state held inside each worker process, keyed by shared memory name or session id
+worker_segments = {}
+worker_encoders = {}
+worker_pending = {}
+
+
+def watch_parent(parent_pid: int):
+    """Worker initializer: exits the worker if the server dies without shutting the pool down, so the resource
+    tracker can reclaim the shared memory segments
+
+    Args:
+        parent_pid (int): the pid of the process that created the pool
+    """
+
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1.0)
+        os._exit(0)
+
+    Thread(target=watch, daemon=True).start()
+
+
+def attach_segment(name: str) -> shared_memory.SharedMemory:
+    """Returns this worker's attachment to the named shared memory segment, attaching on first use
+
+    Args:
+        name (str): the name of the shared memory segment
+
+    Returns:
+        shared_memory.SharedMemory: the attached segment
+    """
+    segment = worker_segments.get(name, None)
+    if segment is None:
+        segment = shared_memory.SharedMemory(name=name)
+        worker_segments[name] = segment
+    return segment
+
+
+def create_opus_encoder():
+    """Creates an Opus encoder configured like aiortc's OpusEncoder so pre-encoded packets match what it would send
+
+    Returns:
+        av.AudioCodecContext: the encoder
+    """
+    from av import CodecContext
+
+    codec = CodecContext.create("libopus", "w")
+    codec.bit_rate = 96000
+    codec.format = "s16"
+    codec.layout = "stereo"
+    codec.options = {"application": "voip"}
+    codec.sample_rate = CONST.WEB_RTC_AUDIO_SAMPLE_RATE
+    codec.time_base = fractions.Fraction(1, CONST.WEB_RTC_AUDIO_SAMPLE_RATE)
+    return codec
+
+
+def build_block(
+    session_id: str, in_name: str, nbytes: int, out_name: str, encode: bool
+) -> int | list:
+    """Worker side of frame_build_pool: resamples a block of 24 kHz mono audio to 48 kHz interleaved stereo and
+    optionally Opus encodes it.
+
+    Args:
+        session_id (str): the session the block belongs to (selects the encoder state)
+        in_name (str): the shared memory segment holding the mono s16 bytes
+        nbytes (int): the number of bytes of mono audio in the input segment
+        out_name (str): the shared memory segment receiving the stereo s16 samples
+        encode (bool): True to Opus encode the stereo audio and return packets instead of samples
+
+    Returns:
+        int | list: the number of stereo samples written to the output segment, or a list of Opus packet bytes
+    """
+    from audio_output_track import audio_output_track
+
+    in_segment = attach_segment(in_name)
+    mono_audio = np.frombuffer(in_segment.buf, dtype=np.int16, count=nbytes // 2)
+    stereo_audio = audio_output_track.resample_to_stereo(mono_audio)
+    if not encode:
+        out_segment = attach_segment(out_name)
+        np.frombuffer(out_segment.buf, dtype=np.int16, count=stereo_audio.size)[:] = (
+            stereo_audio
+        )
+        return stereo_audio.size // CONST.AUDIO_CHANNELS_STEREO
+
+    from av import AudioFrame
+
+    encoder = worker_encoders.get(session_id, None)
+    if encoder is None:
+        encoder = create_opus_encoder()
+        worker_encoders[session_id] = encoder
+    # carry partial frames over so every encoded frame is exactly one Opus frame
+    pending = worker_pending.get(session_id, None)
+    if pending is not None and pending.size:
+        stereo_audio = np.concatenate([pending, stereo_audio])
+    frame_values = CONST.OPUS_FRAMES_PER_BUFFER * CONST.AUDIO_CHANNELS_STEREO
+    whole = (stereo_audio.size // frame_values) * frame_values
+    worker_pending[session_id] = stereo_audio[whole:].copy()
+    packets = []
+    for start in range(0, whole, frame_values):
+        frame = AudioFrame.from_ndarray(
+            stereo_audio[start : start + frame_values].reshape(1, -1),
+            format="s16",
+            layout="stereo",
+        )
+        frame.sample_rate = CONST.WEB_RTC_AUDIO_SAMPLE_RATE
+        packets.extend(bytes(packet) for packet in encoder.encode(frame))
+    return packets
+
+
+def warm_up() -> bool:
+    """Worker side of frame_build_pool: imports the audio and codec modules ahead of the first session
+
+    Returns:
+        bool: True once imported
+    """
+    import av  # noqa: F401
+
+    import audio_output_track  # noqa: F401
+
+    return True
+
+
+def release_session(session_id: str) -> bool:
+    """Worker side of frame_build_pool: drops the encoder state and segment attachments of a closed session
+
+    Args:
+        session_id (str): the session being released
+
+    Returns:
+        bool: True once released
+    """
+    worker_encoders.pop(session_id, None)
+    worker_pending.pop(session_id, None)
+    for name in [name for name in worker_segments if name.startswith(session_id)]:
+        worker_segments.pop(name).close()
+    return True
+
+
+class frame_build_pool:
+    """Process pool that builds (and optionally Opus encodes) output audio outside this process's GIL.
+
+    The pool is made of single-process executors so each session is pinned to one worker process, which is what lets
+    the worker keep that session's Opus encoder state between blocks. Audio moves through two shared memory segments
+    per session: the producer writes mono bytes into the input segment and reads stereo samples back from the output
+    segment, so only the small request, and for encode mode the finished packets, are pickled.
+    """
+
+    MODE_NONE = "none"
+    MODE_FRAMES = "frames"
+    MODE_ENCODE = "encode"
+    MODES = (MODE_NONE, MODE_FRAMES, MODE_ENCODE)
+
+    pool = None
+    pool_lock = Lock()
+
+    def __init__(self, workers: int):
+        """Constructor for frame_build_pool. Use frame_build_pool.get_pool to share one pool per process.
+
+        Args:
+            workers (int): the number of worker processes
+        """
+        # start the resource tracker first so the workers share it rather than each starting their own
+        resource_tracker.ensure_running()
+        mp_context = multiprocessing.get_context("spawn")
+        self.executors = [
+            ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=mp_context,
+                initializer=watch_parent,
+                initargs=(os.getpid(),),
+            )
+            for _ in range(max(1, workers))
+        ]
+        self.next_executor = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def get_pool(workers: int = 0) -> "frame_build_pool":
+        """Returns the process-wide frame_build_pool, creating it on first use
+
+        Args:
+            workers (int, optional): the number of worker processes (0 uses half the cores). Defaults to 0.
+
+        Returns:
+            frame_build_pool: the shared pool
+        """
+        with frame_build_pool.pool_lock:
+            if frame_build_pool.pool is None:
+                if workers <= 0:
+                    workers = max(1, (os.cpu_count() or 2) // 2)
+                frame_build_pool.pool = frame_build_pool(workers)
+            return frame_build_pool.pool
+
+    @staticmethod
+    def shutdown_pool():
+        """Shuts down the process-wide pool if one was created"""
+        with frame_build_pool.pool_lock:
+            if frame_build_pool.pool is not None:
+                for executor in frame_build_pool.pool.executors:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                frame_build_pool.pool = None
+
+    def warm_up(self) -> list[Future]:
+        """Starts every worker process and has it import what it needs
+
+        Returns:
+            list[Future]: one per worker, done once that worker is ready for sessions
+        """
+        return [executor.submit(warm_up) for executor in self.executors]
+
+    def assign_executor(self) -> ProcessPoolExecutor:
+        """Returns the executor (worker process) the next session is pinned to
+
+        Returns:
+            ProcessPoolExecutor: a single-process executor
+        """
+        with self.lock:
+            executor = self.executors[self.next_executor % len(self.executors)]
+            self.next_executor += 1
+        return executor
+
+
+class frame_build_session:
+    """One session's pinned worker and shared memory segments in the frame_build_pool"""
+
+    def __init__(self, pool: frame_build_pool, max_block_bytes: int):
+        """Constructor for frame_build_session
+
+        Args:
+            pool (frame_build_pool): the pool to run on
+            max_block_bytes (int): the largest block of mono bytes that will be submitted at once
+        """
+        # short enough for platforms limiting shared memory names to 31 characters
+        self.session_id = "wrs_" + uuid.uuid4().hex[:16]
+        self.executor = pool.assign_executor()
+        self.max_block_bytes = max_block_bytes
+        self.in_segment = shared_memory.SharedMemory(
+            name=f"{self.session_id}_in", create=True, size=max_block_bytes
+        )
+        # 2x the samples, 2 channels
+        self.out_segment = shared_memory.SharedMemory(
+            name=f"{self.session_id}_out", create=True, size=max_block_bytes * 4
+        )
+
+    def build(self, mono_bytes: bytes, encode: bool) -> np.ndarray | list:
+        """Resamples (and optionally encodes) a block of mono audio in the session's worker, blocking until done
+
+        Args:
+            mono_bytes (bytes): 24 kHz mono s16 audio, at most max_block_bytes long
+            encode (bool): True to return Opus packets rather than stereo samples
+
+        Returns:
+            np.ndarray | list: interleaved 48 kHz stereo int16 samples, or a list of Opus packet bytes
+        """
+        nbytes = len(mono_bytes)
+        self.in_segment.buf[:nbytes] = mono_bytes
+        result = self.executor.submit(
+            build_block,
+            self.session_id,
+            self.in_segment.name,
+            nbytes,
+            self.out_segment.name,
+            encode,
+        ).result()
+        if encode:
+            return result
+        # copied out so no view of the segment outlives the session (close() cannot unmap while one exists)
+        return np.frombuffer(
+            self.out_segment.buf,
+            dtype=np.int16,
+            count=result * CONST.AUDIO_CHANNELS_STEREO,
+        ).copy()
+
+    def close(self):
+        """Releases the worker's state for this session and unlinks the shared memory segments"""
+        try:
+            self.executor.submit(release_session, self.session_id).result(timeout=5)
+        except (BufferError, RuntimeError, TimeoutError):
+            # the pool may already be shut down (BrokenProcessPool is a RuntimeError) or be too busy to answer, and a
+            # worker's segment may still be exported
+            pass
+        for segment in (self.in_segment, self.out_segment):
+            segment.close()
+            segment.unlink()
@@ -0,0 +1,240 @@
+import time
+from collections import deque
+from threading import Lock
+
+
+class latency_histogram:
+    """Fixed-size log-linear histogram of latencies recorded in nanoseconds.
+
+    Buckets are powers of two of microseconds, each split into SUB_BUCKETS linear steps, so memory stays constant no
+    matter how many samples are recorded and percentiles are accurate to within 1/SUB_BUCKETS of the bucket's range.
+    Each histogram is expected to be written by a single thread, so record() takes no lock.
+    """
+
+    SUB_BUCKETS = 4
+    OCTAVES = 28  # 2**28 us is roughly 4.5 minutes, anything longer lands in the last bucket
+
+    def __init__(self):
+        """Constructor for latency_histogram"""
+        self.counts = [0] * (latency_histogram.OCTAVES * latency_histogram.SUB_BUCKETS)
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    @staticmethod
+    def bucket_index(latency_ns: int) -> int:
+        """Returns the bucket holding the supplied latency
+
+        Args:
+            latency_ns (int): the latency in nanoseconds
+
+        Returns:
+            int: the index into counts for the latency
+        """
+        usec = latency_ns // 1000
+        if usec < 1:
+            return 0
+        octave = usec.bit_length() - 1
+        if octave >= latency_histogram.OCTAVES:
+            return latency_histogram.OCTAVES * latency_histogram.SUB_BUCKETS - 1
+        # linear position within the octave [2**octave, 2**(octave+1))
+        sub = ((usec - (1 << octave)) * latency_histogram.SUB_BUCKETS) >> octave
+        return octave * latency_histogram.SUB_BUCKETS + sub
+
+    @staticmethod
+    def bucket_upper_ns(index: int) -> int:
+        """Returns the upper bound in nanoseconds of the supplied bucket
+
+        Args:
+            index (int): the index into counts
+
+        Returns:
+            int: the largest latency (in nanoseconds) that falls into the bucket
+        """
+        octave, sub = divmod(index, latency_histogram.SUB_BUCKETS)
+        base = 1 << octave
+        return (base + ((sub + 1) * base) // latency_histogram.SUB_BUCKETS) * 1000
+
+    def record(self, latency_ns: int):
+        """Adds a latency sample to the histogram
+
+        Args:
+            latency_ns (int): the latency in nanoseconds (negative values are clamped to 0)
+        """
+        latency_ns = max(latency_ns, 0)
+        self.counts[latency_histogram.bucket_index(latency_ns)] += 1
+        self.count += 1
+        self.total_ns += latency_ns
+        self.max_ns = max(self.max_ns, latency_ns)
+
+    def percentile(self, pct: float) -> float:
+        """Returns the approximate latency in milliseconds at the supplied percentile
+
+        Args:
+            pct (float): the percentile (e.g., 50, 95, 99)
+
+        Returns:
+            float: the latency in milliseconds, or 0.0 if nothing has been recorded
+        """
+        if self.count == 0:
+            return 0.0
+        target = max(1, int(self.count * pct / 100.0 + 0.5))
+        running = 0
+        for index, bucket_count in enumerate(self.counts):
+            running += bucket_count
+            if running >= target:
+                return min(latency_histogram.bucket_upper_ns(index), self.max_ns) / 1e6
+        return self.max_ns / 1e6
+
+    def summary(self) -> dict:
+        """Returns the count, mean, p50/p95/p99 and max of the histogram in milliseconds
+
+        Returns:
+            dict: summary statistics of the recorded latencies
+        """
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ns / self.count / 1e6, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50), 3),
+            "p95_ms": round(self.percentile(95), 3),
+            "p99_ms": round(self.percentile(99), 3),
+            "max_ms": round(self.max_ns / 1e6, 3),
+        }
+
+
+class frame_timing:
+    """Per-session latency tracing of audio as it moves from a queue_msg through the playback buffer, the AudioFifo, recv()
+    and finally the RTP sender.
+
+    Each stage is stamped by the thread that performs it (playback thread: extend, producer thread: extract and fifo
+    write, event loop: recv and rtp send) and the latency between consecutive stages is recorded in a latency_histogram
+    owned by that thread. Pending stamps are kept in bounded deques so memory does not grow with session length.
+    """
+
+    STAGE_EXTEND = "enqueue_to_extend"
+    STAGE_EXTRACT = "extend_to_extract"
+    STAGE_FIFO_WRITE = "extract_to_fifo_write"
+    STAGE_RECV = "fifo_write_to_recv"
+    STAGE_RTP_SEND = "recv_to_rtp_send"
+    STAGE_TOTAL = "enqueue_to_rtp_send"
+    STAGES = (
+        STAGE_EXTEND,
+        STAGE_EXTRACT,
+        STAGE_FIFO_WRITE,
+        STAGE_RECV,
+        STAGE_RTP_SEND,
+        STAGE_TOTAL,
+    )
+    MAX_PENDING = 4096
+
+    def __init__(self):
+        """Constructor for frame_timing"""
+        self.histograms = {stage: latency_histogram() for stage in frame_timing.STAGES}
+        # (end byte offset, created_ns, extend_ns) for chunks added to the playback buffer
+        self.chunks = deque(maxlen=frame_timing.MAX_PENDING)
+        self.chunk_lock = Lock()
+        self.bytes_extended = 0
+        self.bytes_extracted = 0
+        # (end pts, created_ns, fifo_write_ns) for frames written to the AudioFifo
+        self.frames = deque(maxlen=frame_timing.MAX_PENDING)
+        # (created_ns, recv_ns) of the last frame returned by recv() awaiting its rtp send
+        self.last_recv = None
+        self.first_enqueue_ns = 0
+        self.first_rtp_send_ns = 0
+
+    def on_extend(self, nbytes: int, created_ns: int):
+        """Records a chunk of audio being added to the playback buffer
+
+        Args:
+            nbytes (int): the number of bytes added
+            created_ns (int): the perf_counter_ns when the chunk's queue_msg was created
+        """
+        now = time.perf_counter_ns()
+        if not created_ns:
+            created_ns = now
+        if not self.first_enqueue_ns:
+            self.first_enqueue_ns = created_ns
+        self.histograms[frame_timing.STAGE_EXTEND].record(now - created_ns)
+        with self.chunk_lock:
+            self.bytes_extended += nbytes
+            self.chunks.append((self.bytes_extended, created_ns, now))
+
+    def on_extract(self, nbytes: int) -> int:
+        """Records bytes removed from the playback buffer and returns the creation stamp of the chunk they started in
+
+        Args:
+            nbytes (int): the number of bytes removed from the playback buffer
+
+        Returns:
+            int: the perf_counter_ns when the originating queue_msg was created (0 if unknown)
+        """
+        now = time.perf_counter_ns()
+        with self.chunk_lock:
+            start = self.bytes_extracted
+            self.bytes_extracted += nbytes
+            # drop chunks that were fully consumed before this extract
+            while self.chunks and self.chunks[0][0] <= start:
+                self.chunks.popleft()
+            chunk = self.chunks[0] if self.chunks else None
+        if chunk is None:
+            return 0
+        self.histograms[frame_timing.STAGE_EXTRACT].record(now - chunk[2])
+        return chunk[1]
+
+    def on_fifo_write(self, pts: int, samples: int, created_ns: int, extract_ns: int):
+        """Records a frame being written to the AudioFifo
+
+        Args:
+            pts (int): the pts of the frame written
+            samples (int): the number of samples in the frame
+            created_ns (int): the creation stamp returned by on_extract
+            extract_ns (int): the perf_counter_ns when the bytes were extracted
+        """
+        now = time.perf_counter_ns()
+        self.histograms[frame_timing.STAGE_FIFO_WRITE].record(now - extract_ns)
+        self.frames.append((pts + samples, created_ns, now))
+
+    def on_recv(self, pts: int):
+        """Records a frame being returned by recv() to the sender
+
+        Args:
+            pts (int): the pts of the frame returned
+        """
+        now = time.perf_counter_ns()
+        frames = self.frames
+        # drop frames that were fully read before this pts
+        while frames and frames[0][0] <= pts:
+            frames.popleft()
+        if not frames:
+            self.last_recv = None
+            return
+        _end_pts, created_ns, fifo_write_ns = frames[0]
+        self.histograms[frame_timing.STAGE_RECV].record(now - fifo_write_ns)
+        self.last_recv = (created_ns, now)
+
+    def on_rtp_sent(self):
+        """Records the RTP packets of the last frame returned by recv() having been handed to the transport"""
+        last_recv = self.last_recv
+        if last_recv is None:
+            return
+        self.last_recv = None
+        now = time.perf_counter_ns()
+        created_ns, recv_ns = last_recv
+        if not self.first_rtp_send_ns:
+            self.first_rtp_send_ns = now
+        self.histograms[frame_timing.STAGE_RTP_SEND].record(now - recv_ns)
+        if created_ns:
+            self.histograms[frame_timing.STAGE_TOTAL].record(now - created_ns)
+
+    def summary(self) -> dict:
+        """Returns the per stage latency summaries and the time to first audio
+
+        Returns:
+            dict: stage name to latency_histogram summary, plus time_to_first_audio_ms
+        """
+        ret_obj = {stage: hist.summary() for stage, hist in self.histograms.items()}
+        ttfa = 0.0
+        if self.first_enqueue_ns and self.first_rtp_send_ns:
+            ttfa = (self.first_rtp_send_ns - self.first_enqueue_ns) / 1e6
+        ret_obj["time_to_first_audio_ms"] = round(ttfa, 3)
+        return ret_obj
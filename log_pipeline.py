@@ -0,0 +1,75 @@
+import logging
+import logging.handlers
+import queue
+
+
+class nonblocking_queue_handler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks or formats on the calling thread.
+
+    Records are handed to the QueueListener as-is so the message is only merged with its arguments when the listener
+    thread writes it. If the queue is full the record is dropped and counted rather than stalling the audio path.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        """Constructor for nonblocking_queue_handler
+
+        Args:
+            log_queue (queue.Queue): the bounded queue read by the QueueListener
+        """
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Defers formatting to the listener thread unless the record carries an exception
+
+        Args:
+            record (logging.LogRecord): the record being logged
+
+        Returns:
+            logging.LogRecord: the record to be enqueued
+        """
+        if record.exc_info:
+            # tracebacks are rare and must be rendered while the frames still exist
+            return super().prepare(record)
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        """Adds the record to the queue, dropping it if the queue is full
+
+        Args:
+            record (logging.LogRecord): the record to be written by the listener
+        """
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class sampling_filter(logging.Filter):
+    """Filter passing one of every sample_every records, used for the per-frame debug channel"""
+
+    def __init__(self, sample_every: int):
+        """Constructor for sampling_filter
+
+        Args:
+            sample_every (int): pass one record of this many (1 passes every record, 0 passes none)
+        """
+        super().__init__()
+        self.sample_every = sample_every
+        self.counter = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Returns True for the first record of every sample_every records
+
+        Args:
+            record (logging.LogRecord): the record being logged
+
+        Returns:
+            bool: True if the record should be logged
+        """
+        if self.sample_every <= 0:
+            return False
+        # an unsynchronized counter is fine here, a lost increment only shifts the sample
+        passed = self.counter % self.sample_every == 0
+        self.counter += 1
+        return passed
@@ -0,0 +1,172 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from logging import Logger
+
+from frame_timing import latency_histogram
+
+try:
+    import uvloop
+except ImportError:  # uvloop is optional, the asyncio loop is always available
+    uvloop = None
+
+
+class loop_monitor:
+    """Measures how late the event loop runs its callbacks, and which code was holding it when it ran late.
+
+    Every session's recv(), the aiohttp handlers and the aiortc transports share one loop, so anything that blocks it
+    delays the audio of every session. A task on the loop sleeps INTERVAL_SECONDS at a time and records how much later
+    than that it wakes in a latency_histogram. A watchdog thread checks the task's heartbeat: once the loop has not come
+    back for SLOW_SECONDS past the interval it samples the loop thread's stack, and when the loop does come back the
+    stall is charged to that stack. This works the same on uvloop, which has no debug-mode slow callback warnings, and
+    costs a stack sample only when the loop is actually stalled.
+    """
+
+    LOOP_ASYNCIO = "asyncio"
+    LOOP_UVLOOP = "uvloop"
+    LOOPS = (LOOP_ASYNCIO, LOOP_UVLOOP)
+    INTERVAL_SECONDS = 0.05
+    SLOW_SECONDS = 0.04  # two 20 ms frames
+    WATCH_SECONDS = 0.01
+    STACK_DEPTH = 6
+    MAX_STACKS = 100  # further stacks are counted as "other"
+    TOP_STACKS = 10
+    # frames of the loop itself, left out of the stacks
+    ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+    def __init__(self, logger: Logger):
+        """Constructor for loop_monitor
+
+        Args:
+            logger (Logger): logger to record status
+        """
+        self.logger = logger
+        self.lag = latency_histogram()
+        self.loop_name = ""
+        self.loop_thread_id = 0
+        # perf_counter_ns when the sampling task last woke
+        self.beat_ns = 0
+        # (beat_ns, stack) sampled by the watchdog while the loop was stalled after that beat
+        self.stall = None
+        # collapsed stack -> [stalls, total ns, max ns], written only by the sampling task
+        self.stacks = {}
+        self.stalls = 0
+        self.stalled_ns = 0
+        self.task = None
+        self.closed = False
+
+    @staticmethod
+    def run(main, loop_name: str):
+        """Runs the main coroutine on a new event loop of the chosen kind
+
+        Args:
+            main (Coroutine): the coroutine to be run
+            loop_name (str): one of LOOPS
+        """
+        if loop_name == loop_monitor.LOOP_UVLOOP:
+            return uvloop.run(main)
+        return asyncio.run(main)
+
+    def start(self):
+        """Starts sampling the running loop"""
+        loop = asyncio.get_running_loop()
+        self.loop_name = type(loop).__module__.split(".")[0]
+        self.loop_thread_id = threading.get_ident()
+        self.beat_ns = time.perf_counter_ns()
+        self.task = asyncio.ensure_future(self.sample())
+        threading.Thread(target=self.watch, name="loop_monitor", daemon=True).start()
+        self.logger.info(f"Monitoring the {self.loop_name} event loop's lag")
+
+    async def sample(self):
+        """Records the loop's lag every INTERVAL_SECONDS, charging stalls to the stack the watchdog sampled"""
+        interval_ns = int(loop_monitor.INTERVAL_SECONDS * 1e9)
+        while not self.closed:
+            start_ns = self.beat_ns
+            await asyncio.sleep(loop_monitor.INTERVAL_SECONDS)
+            now = time.perf_counter_ns()
+            lag_ns = now - start_ns - interval_ns
+            self.lag.record(lag_ns)
+            stall = self.stall
+            if stall is not None and stall[0] == start_ns:
+                self.charge(stall[1], lag_ns)
+            self.stall = None
+            self.beat_ns = now
+
+    def charge(self, stack: str, lag_ns: int):
+        """Adds a stall to the totals of the stack that was running during it
+
+        Args:
+            stack (str): the collapsed stack
+            lag_ns (int): how late the loop came back
+        """
+        self.stalls += 1
+        self.stalled_ns += lag_ns
+        if stack not in self.stacks and len(self.stacks) >= loop_monitor.MAX_STACKS:
+            stack = "other"
+        totals = self.stacks.setdefault(stack, [0, 0, 0])
+        totals[0] += 1
+        totals[1] += lag_ns
+        totals[2] = max(totals[2], lag_ns)
+
+    def watch(self):
+        """Watchdog thread: samples the loop thread's stack once per stall"""
+        slow_ns = int((loop_monitor.INTERVAL_SECONDS + loop_monitor.SLOW_SECONDS) * 1e9)
+        while not self.closed:
+            time.sleep(loop_monitor.WATCH_SECONDS)
+            beat_ns = self.beat_ns
+            if self.stall is not None or time.perf_counter_ns() - beat_ns < slow_ns:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id, None)
+            if frame is not None:
+                self.stall = (beat_ns, loop_monitor.collapse(frame))
+
+    @staticmethod
+    def collapse(frame) -> str:
+        """Returns the innermost STACK_DEPTH frames of a stack that are not the event loop's own, outermost first and
+        separated by semicolons (the collapsed stack format)
+
+        Args:
+            frame (FrameType): the innermost frame
+
+        Returns:
+            str: e.g., "audio_output_track.py:recv:402;time_stretch.py:process:88"
+        """
+        entries = []
+        while frame is not None and len(entries) < loop_monitor.STACK_DEPTH:
+            code = frame.f_code
+            if not code.co_filename.startswith(loop_monitor.ASYNCIO_DIR):
+                entries.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        return ";".join(reversed(entries))
+
+    def status(self) -> dict:
+        """Returns the lag percentiles and the stacks that stalled the loop the longest
+
+        Returns:
+            dict: the loop's kind, its lag summary in milliseconds, the stalls and the top stacks by time stalled
+        """
+        stacks = sorted(self.stacks.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            "loop": self.loop_name,
+            "lag": self.lag.summary(),
+            "stalls": self.stalls,
+            "stalled_ms": round(self.stalled_ns / 1e6, 3),
+            "top_stacks": [
+                {
+                    "stack": stack,
+                    "stalls": totals[0],
+                    "total_ms": round(totals[1] / 1e6, 3),
+                    "max_ms": round(totals[2] / 1e6, 3),
+                }
+                for stack, totals in stacks[: loop_monitor.TOP_STACKS]
+            ],
+        }
+
+    def close(self):
+        """Stops the sampling task and the watchdog"""
+        self.closed = True
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
@@ -0,0 +1,117 @@
+import threading
+
+
+class thread_counter:
+    """Counter made of one accumulator cell per thread so the hot path never takes a lock.
+
+    Each thread only ever writes its own cell. Readers sum the cells, which may be a frame behind the writers but is
+    always consistent for monotonically increasing counters. The lock is only taken the first time a thread adds to
+    the counter, to register its cell.
+    """
+
+    def __init__(self):
+        """Constructor for thread_counter"""
+        self.local = threading.local()
+        self.cells = []
+        self.lock = threading.Lock()
+
+    def add(self, amount: int = 1):
+        """Adds the amount to the calling thread's accumulator
+
+        Args:
+            amount (int, optional): the value to be added. Defaults to 1.
+        """
+        try:
+            self.local.cell[0] += amount
+        except AttributeError:
+            cell = [amount]
+            self.local.cell = cell
+            with self.lock:
+                self.cells.append(cell)
+
+    def value(self) -> int:
+        """Returns the sum of all threads' accumulators
+
+        Returns:
+            int: the current value of the counter
+        """
+        return sum(cell[0] for cell in list(self.cells))
+
+
+class session_metrics:
+    """Counters describing the audio sent to one conversation's client"""
+
+    FRAMES_SENT = "frames_sent"
+    SILENCE_FRAMES_SENT = "silence_frames_sent"
+    LATE_FRAMES = "late_frames"
+    UNDERRUNS = "underruns"
+    RESAMPLE_NS = "resample_ns"
+    DTX_SUPPRESSED_FRAMES = "dtx_suppressed_frames"
+    CATCHUP_BLOCKS = "catchup_blocks"
+    STRETCH_SAVED_NS = "stretch_saved_ns"
+    COUNTERS = (
+        FRAMES_SENT,
+        SILENCE_FRAMES_SENT,
+        LATE_FRAMES,
+        UNDERRUNS,
+        RESAMPLE_NS,
+        DTX_SUPPRESSED_FRAMES,
+        CATCHUP_BLOCKS,
+        STRETCH_SAVED_NS,
+    )
+
+    def __init__(self):
+        """Constructor for session_metrics"""
+        self.frames_sent = thread_counter()
+        self.silence_frames_sent = thread_counter()
+        self.late_frames = thread_counter()
+        self.underruns = thread_counter()
+        self.resample_ns = thread_counter()
+        self.dtx_suppressed_frames = thread_counter()
+        self.catchup_blocks = thread_counter()
+        self.stretch_saved_ns = thread_counter()
+
+    def snapshot(self) -> dict:
+        """Returns the current value of each counter
+
+        Returns:
+            dict: counter name to value
+        """
+        return {name: getattr(self, name).value() for name in session_metrics.COUNTERS}
+
+
+def escape_label_value(value) -> str:
+    """Escapes a label value for the Prometheus text exposition format
+
+    Args:
+        value (Any): the label value
+
+    Returns:
+        str: the value with backslashes, double quotes and newlines escaped
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(families: list) -> str:
+    """Renders metric families in the Prometheus text exposition format
+
+    Args:
+        families (list): tuples of (name, type, help, samples) where samples is a list of (labels dict, value)
+
+    Returns:
+        str: the text to be returned from a /metrics request
+    """
+    lines = []
+    for name, metric_type, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            if labels:
+                label_text = ",".join(
+                    f'{key}="{escape_label_value(val)}"' for key, val in labels.items()
+                )
+                lines.append(f"{name}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{name} {value}")
+    lines.append("")
+    return "\n".join(lines)
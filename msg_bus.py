@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections.abc import Callable
+from logging import Logger
+from multiprocessing.connection import Client, Connection, Listener
+from threading import Thread
+
+import numpy as np
+
+from constants import constants as CONST
+from metrics import thread_counter
+from queue_msg import queue_msg
+from shared_ring import shared_ring
+
+
+class msg_bus:
+    """Carries queue_msg events from producer processes on this host (e.g., TTS or LLM) to conversations' playback
+    threads over a Unix socket.
+
+    A producer connects, sends a conversation's conv_id and is answered with the name of that conversation's playback
+    buffer, a shared_ring. Audio is then written straight into the ring by the producer, and only a queue_msg header
+    (queue_msg.pack) announcing the bytes is sent over the socket, so the samples are never serialized or copied on
+    the way. Each header is unpacked into a queue_msg and put on the conversation's audio_playback_queue, in order.
+    """
+
+    def __init__(self, address: str, attach: Callable[[str], tuple | None], logger: Logger):
+        """Constructor for msg_bus
+
+        Args:
+            address (str): the path of the Unix socket to listen on
+            attach (Callable[[str], tuple | None]): returns the (audio_playback_queue, shared_ring) of a conv_id, or
+                None if it is unknown or has no shared_ring
+            logger (Logger): logger to record status
+        """
+        self.address = address
+        self.attach = attach
+        self.logger = logger
+        self.listener = None
+        self.messages = thread_counter()
+        self.producers = thread_counter()
+        self.closed = False
+
+    def start(self):
+        """Listens for producers on a thread of its own"""
+        if os.path.exists(self.address):
+            # left behind by a process that did not shut down
+            os.unlink(self.address)
+        self.listener = Listener(self.address, family="AF_UNIX")
+        Thread(target=self.accept_producers, daemon=True).start()
+        self.logger.info(f"Message bus listening on {self.address}")
+
+    def accept_producers(self):
+        """Starts a thread for each producer that connects"""
+        while not self.closed:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                # the listener was closed
+                break
+            Thread(target=self.receive, args=[conn], daemon=True).start()
+
+    def receive(self, conn: Connection):
+        """Attaches a producer to its conversation, then queues its messages until it disconnects
+
+        Args:
+            conn (Connection): the producer's connection
+        """
+        conv_id = ""
+        try:
+            conv_id = conn.recv_bytes().decode()
+            target = self.attach(conv_id)
+            if target is None:
+                conn.send_bytes(json.dumps({"error": f"unknown conv_id {conv_id}"}).encode())
+                return
+            audio_playback_queue, ring = target
+            conn.send_bytes(json.dumps({"ring": ring.name, "capacity": ring.capacity}).encode())
+            self.producers.add()
+            self.logger.info(f"Producer attached to {conv_id} through {ring.name}")
+            while not self.closed:
+                audio_playback_queue.put(queue_msg.unpack(conn.recv_bytes()))
+                self.messages.add()
+        except EOFError:
+            self.logger.info(f"Producer of {conv_id} disconnected")
+        except Exception as e:
+            self.logger.warning(f"Message bus error for {conv_id}: {e}", exc_info=True)
+        finally:
+            conn.close()
+
+    def status(self) -> dict:
+        """Returns the producers attached and the messages they have queued
+
+        Returns:
+            dict: the address, producers attached and messages received
+        """
+        return {
+            "address": self.address,
+            "producers": self.producers.value(),
+            "messages": self.messages.value(),
+        }
+
+    def close(self):
+        """Stops listening and removes the socket (producers' connections end with their next message)"""
+        self.closed = True
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+
+
+class msg_bus_client:
+    """Producer side of the msg_bus: sends one conversation's audio and events to the server from another process"""
+
+    def __init__(self, address: str, conv_id: str):
+        """Constructor for msg_bus_client, which attaches to the conversation's shared_ring
+
+        Args:
+            address (str): the server's --msg-bus socket path
+            conv_id (str): the conversation to send to
+
+        Raises:
+            ValueError: if the server does not know the conversation
+        """
+        self.conn = Client(address, family="AF_UNIX")
+        self.conn.send_bytes(conv_id.encode())
+        reply = json.loads(self.conn.recv_bytes())
+        if "error" in reply:
+            self.conn.close()
+            raise ValueError(reply["error"])
+        self.ring = shared_ring(name=reply["ring"])
+
+    def send(self, msg: queue_msg):
+        """Sends an event (one that is not raw audio) to the conversation's playback thread
+
+        Args:
+            msg (queue_msg): the message
+        """
+        self.conn.send_bytes(msg.pack())
+
+    def send_audio(self, samples, timeout: float = 5.0) -> bool:
+        """Writes 24 kHz mono s16 audio into the conversation's playback buffer and announces it, waiting while the
+        ring is too full for it
+
+        Args:
+            samples: the audio (bytes, or an int16 numpy array), no larger than the ring
+            timeout (float, optional): seconds to wait for space. Defaults to 5.0.
+
+        Returns:
+            bool: False if the ring had no room for it within the timeout
+        """
+        nbytes = memoryview(samples).nbytes
+        deadline = time.monotonic() + timeout
+        while not self.ring.write(samples):
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.005)
+        self.send(
+            queue_msg.make_user_msg({CONST.TYPE: CONST.TYPE_AUDIO_CHUNK, CONST.AUDIO_RING_BYTES: nbytes})
+        )
+        return True
+
+    def finish(self):
+        """Tells the playback thread the response is complete, so it waits for the audio to play out"""
+        self.send(queue_msg.make_user_msg(CONST.MSG_ACTION_DATA_FINISHED))
+
+    def close(self):
+        """Detaches from the ring and disconnects"""
+        self.ring.close()
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    # streams playback.wav to a conversation at real time, as a TTS engine would
+    parser = argparse.ArgumentParser(prog="msg_bus", description="Send audio to a conversation over the message bus")
+    parser.add_argument("address", help="the server's --msg-bus socket path")
+    parser.add_argument("conv_id", help="the conversation to send to (see /sessions)")
+    parser.add_argument("--wav", default="./playback.wav", help="24 kHz float32 wav file to send")
+    params = parser.parse_args(sys.argv[1:])
+    from scipy.io import wavfile
+
+    sample_rate, data = wavfile.read(params.wav)
+    assert sample_rate == CONST.TTS_AUDIO_SAMPLE_RATE
+    audio = (np.asarray(data, dtype=np.float32) * 32768.0).clip(-32768, 32767).astype(np.int16)
+    client = msg_bus_client(params.address, params.conv_id)
+    start = time.monotonic()
+    for offset in range(0, audio.size, CONST.FRAMES_PER_BUFFER):
+        if not client.send_audio(audio[offset : offset + CONST.FRAMES_PER_BUFFER]):
+            print("The playback buffer stayed full, stopping.")
+            break
+        delay = start + (offset + CONST.FRAMES_PER_BUFFER) / sample_rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    client.finish()
+    client.close()
+    print(f"Sent {audio.size / sample_rate:.1f} s of audio to {params.conv_id}.")
@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+from frame_timing import latency_histogram
+
+
+class negotiation_limiter:
+    """Admission control for /offer: caps the negotiations in progress and the sessions held, and times each phase.
+
+    A request waits up to queue_timeout for one of max_concurrent negotiation slots; if none frees up, or the server
+    already holds max_sessions peer connections, it is turned away so the caller can retry after retry_after seconds
+    rather than every caller timing out behind ICE gathering.
+    """
+
+    QUEUE_WAIT = "queue_wait"
+    CREATE_PC = "create_pc"
+    SET_REMOTE = "set_remote_description"
+    CREATE_ANSWER = "create_answer"
+    SET_LOCAL = "set_local_description"  # includes ICE gathering
+    TOTAL = "total"
+    PHASES = (QUEUE_WAIT, CREATE_PC, SET_REMOTE, CREATE_ANSWER, SET_LOCAL, TOTAL)
+
+    ADMITTED = "admitted"
+    REJECTED_BUSY = "rejected_busy"
+    REJECTED_FULL = "rejected_full"
+    REJECTED_DRAINING = "rejected_draining"
+    OUTCOMES = (ADMITTED, REJECTED_BUSY, REJECTED_FULL, REJECTED_DRAINING)
+
+    def __init__(self, max_concurrent: int, queue_timeout: float, max_sessions: int, retry_after: float):
+        """Constructor for negotiation_limiter
+
+        Args:
+            max_concurrent (int): negotiations allowed at once
+            queue_timeout (float): seconds a request may wait for a negotiation slot
+            max_sessions (int): peer connections allowed at once (0 for no limit)
+            retry_after (float): seconds returned in the Retry-After header of a rejection
+        """
+        self.max_concurrent = max(1, max_concurrent)
+        self.queue_timeout = queue_timeout
+        self.max_sessions = max_sessions
+        self.retry_after = retry_after
+        self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        self.in_progress = 0
+        self.waiting = 0
+        self.phases = {phase: latency_histogram() for phase in negotiation_limiter.PHASES}
+        self.outcomes = {outcome: 0 for outcome in negotiation_limiter.OUTCOMES}
+
+    def session_limit_reached(self, active_sessions: int) -> bool:
+        """Returns True (and counts the rejection) if another session would exceed max_sessions
+
+        Args:
+            active_sessions (int): the peer connections currently open
+
+        Returns:
+            bool: True if the request should be turned away
+        """
+        if self.max_sessions > 0 and active_sessions >= self.max_sessions:
+            self.outcomes[negotiation_limiter.REJECTED_FULL] += 1
+            return True
+        return False
+
+    async def acquire(self) -> bool:
+        """Waits up to queue_timeout for a negotiation slot
+
+        Returns:
+            bool: True if a slot was acquired (release() must follow), False if the request should be turned away
+        """
+        start_ns = time.perf_counter_ns()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except TimeoutError:
+            self.outcomes[negotiation_limiter.REJECTED_BUSY] += 1
+            return False
+        finally:
+            self.waiting -= 1
+        self.phases[negotiation_limiter.QUEUE_WAIT].record(time.perf_counter_ns() - start_ns)
+        self.in_progress += 1
+        self.outcomes[negotiation_limiter.ADMITTED] += 1
+        return True
+
+    def release(self):
+        """Frees the slot taken by acquire()"""
+        self.in_progress -= 1
+        self.semaphore.release()
+
+    def reject_draining(self):
+        """Counts a request turned away because the server is draining"""
+        self.outcomes[negotiation_limiter.REJECTED_DRAINING] += 1
+
+    def record(self, phase: str, start_ns: int) -> int:
+        """Records the time since start_ns for a phase and returns now, to start the next phase
+
+        Args:
+            phase (str): one of PHASES
+            start_ns (int): time.perf_counter_ns() at the start of the phase
+
+        Returns:
+            int: time.perf_counter_ns() at the end of the phase
+        """
+        now_ns = time.perf_counter_ns()
+        self.phases[phase].record(now_ns - start_ns)
+        return now_ns
+
+    def summary(self) -> dict:
+        """Returns the limiter's state, outcome counts and per phase latency summaries
+
+        Returns:
+            dict: in progress, waiting, limits, outcomes and phases
+        """
+        return {
+            "in_progress": self.in_progress,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_sessions": self.max_sessions,
+            "outcomes": dict(self.outcomes),
+            "phases": {phase: histogram.summary() for phase, histogram in self.phases.items()},
+        }
@@ -1,6 +1,8 @@
 # generic imports
 import copy
 import json
+import struct
+import time
 from threading import RLock
 
 # prx imports
@@ -18,6 +20,17 @@ class queue_msg(object):
     MSG_TYPE_SHUTDOWN = "shutdown"
     MSG_SEQ = 1000000  # large enough not to overlap with wav data sequence numbers
     LOCK = RLock()
+    # binary header sent by msg_bus: kind, priority class, seq, created_ns, and the audio bytes already written to the
+    # session's shared_ring or the index of the action. Any other event follows the header as JSON.
+    HEADER = struct.Struct("<BBqqI")
+    KIND_EVENT = 0
+    KIND_AUDIO = 1
+    KIND_ACTION = 2
+    ACTIONS = (
+        CONST.ACTION_DATA_FINISHED,
+        CONST.ACTION_SIGNAL_EXIT,
+        CONST.ACTION_SIGNAL_SHUTDOWN_THREAD,
+    )
 
     def __init__(self, priority_class: int, event: dict | str, seq: int = -1):
         """Constructor for a prioritized event message
@@ -39,9 +52,17 @@ class queue_msg(object):
         # This protects against an event that is
         # published to the queue being modified before consumption
         self.event = copy.deepcopy(event)
+        # used by frame_timing to measure latency from creation to rtp send
+        self.created_ns = time.perf_counter_ns()
 
     def __json__(self):
-        return f'{{ "{CONST.EVENT}": {json.dumps(self.get_event())}, "{CONST.PRIORITY_CLASS}": "{self.get_priority_class()}", "{CONST.SEQ}": {self.get_seq()} }}'
+        return json.dumps(
+            {
+                CONST.EVENT: self.get_event(),
+                CONST.PRIORITY_CLASS: str(self.get_priority_class()),
+                CONST.SEQ: self.get_seq(),
+            }
+        )
 
     def __lt__(self, other: "queue_msg"):
         """Compares this event with the other event and returns True if this is less than the other
@@ -57,6 +78,58 @@ class queue_msg(object):
             return self.seq < other.seq
         return pri_diff < 0
 
+    def pack(self) -> bytes:
+        """Returns this message as a msg_bus header. Audio chunks are sent as the count of bytes already written to
+        the session's shared_ring (the AUDIO_RING_BYTES field) and actions as an index, with no JSON. Other events
+        follow the header as JSON, so they cannot carry raw audio bytes.
+
+        Returns:
+            bytes: the header, followed by the event as JSON for KIND_EVENT
+        """
+        event = self.event
+        kind, value, tail = queue_msg.KIND_EVENT, 0, b""
+        if event.keys() == {CONST.TYPE, CONST.AUDIO_RING_BYTES} and event[CONST.TYPE] == CONST.TYPE_AUDIO_CHUNK:
+            kind, value = queue_msg.KIND_AUDIO, event[CONST.AUDIO_RING_BYTES]
+        elif (
+            event.keys() == {CONST.TYPE, CONST.ACTION}
+            and event[CONST.TYPE] == CONST.ACTION
+            and event[CONST.ACTION] in queue_msg.ACTIONS
+        ):
+            kind, value = queue_msg.KIND_ACTION, queue_msg.ACTIONS.index(event[CONST.ACTION])
+        else:
+            tail = json.dumps(event).encode()
+        return queue_msg.HEADER.pack(kind, self.priority_class, self.seq, self.created_ns, value) + tail
+
+    @staticmethod
+    def unpack(data: bytes) -> "queue_msg":
+        """Rebuilds a message from a msg_bus header made by pack(). created_ns is kept, as time.perf_counter_ns() is
+        the same monotonic clock in every process on the host.
+
+        Args:
+            data (bytes): the header and any JSON that follows it
+
+        Returns:
+            queue_msg: prioritized event message
+        """
+        kind, priority_class, seq, created_ns, value = queue_msg.HEADER.unpack_from(data)
+        if kind == queue_msg.KIND_AUDIO:
+            event = {CONST.TYPE: CONST.TYPE_AUDIO_CHUNK, CONST.AUDIO_RING_BYTES: value}
+        elif kind == queue_msg.KIND_ACTION:
+            event = {CONST.TYPE: CONST.ACTION, CONST.ACTION: queue_msg.ACTIONS[value]}
+        else:
+            event = json.loads(bytes(data[queue_msg.HEADER.size :]))
+        msg = queue_msg(priority_class, event, seq)
+        msg.created_ns = created_ns
+        return msg
+
+    def get_created_ns(self) -> int:
+        """Returns the time.perf_counter_ns() when this message was created
+
+        Returns:
+            int: the time.perf_counter_ns() when this message was created
+        """
+        return self.created_ns
+
     def get_event(self) -> dict:
         """Returns the event in this message
 
@@ -0,0 +1,167 @@
+import time
+from logging import Logger
+
+from aiortc import RTCPeerConnection
+
+
+class session_activity:
+    """Liveness of one peer connection's session and the resources released with it"""
+
+    def __init__(self, session_id: str, pc: RTCPeerConnection, client_conv_data: dict):
+        """Constructor for session_activity
+
+        Args:
+            session_id (str): identifies the session in logs and /sessions
+            pc (RTCPeerConnection): the session's peer connection
+            client_conv_data (dict): the conversation the session belongs to
+        """
+        self.session_id = session_id
+        self.pc = pc
+        self.client_conv_data = client_conv_data
+        # set by on_track once the browser's audio arrives
+        self.output_track = None
+        self.input_track = None
+        self.recorder = None
+        # set when the client asks for its audio over the data channel
+        self.datachannel_audio = None
+        self.created = time.monotonic()
+        self.last_activity = self.created
+        self.last_source = session_reaper.SOURCE_CREATED
+        self.samples_sent = 0
+
+    def touch(self, source: str):
+        """Records activity on the session
+
+        Args:
+            source (str): one of the session_reaper SOURCE_ values
+        """
+        self.last_activity = time.monotonic()
+        self.last_source = source
+
+    def status(self) -> dict:
+        """Returns the session's liveness for /sessions
+
+        Returns:
+            dict: connection and ICE state, seconds since the last activity and its source
+        """
+        return {
+            "session_id": self.session_id,
+            "connection_state": self.pc.connectionState,
+            "ice_state": self.pc.iceConnectionState,
+            "idle_seconds": round(time.monotonic() - self.last_activity, 3),
+            "last_activity": self.last_source,
+            "datachannel_audio": (
+                self.datachannel_audio.status() if self.datachannel_audio is not None else {}
+            ),
+        }
+
+
+class session_reaper:
+    """Finds the sessions to close: failed or closed peer connections after failed_timeout, and sessions with no
+    activity for idle_timeout.
+
+    Activity is RTP being sent (the output track's sample count advancing), a data channel message and any change of
+    connection or ICE state. A session counts as active while ICE reports it connected, since ICE consent checks fail
+    within about 30 seconds of the browser vanishing, so a connected session waiting for audio is not reaped. The
+    server closes what find() returns and hands the reclaimed resources back to reclaimed() for the metrics.
+    """
+
+    CHECK_SECONDS = 1.0
+
+    SOURCE_CREATED = "created"
+    SOURCE_RTP = "rtp"
+    SOURCE_DATA_CHANNEL = "data_channel"
+    SOURCE_STATE = "state"
+    SOURCE_ICE = "ice"
+
+    REASON_FAILED = "failed"
+    REASON_CLOSED = "closed"
+    REASON_IDLE = "idle"
+    REASONS = (REASON_FAILED, REASON_CLOSED, REASON_IDLE)
+
+    def __init__(self, idle_timeout: float, failed_timeout: float, logger: Logger):
+        """Constructor for session_reaper
+
+        Args:
+            idle_timeout (float): seconds without activity before a session that is not connected is closed (0 to
+                keep idle sessions)
+            failed_timeout (float): seconds a failed or closed session is kept before its resources are released
+            logger (Logger): logger to record status
+        """
+        self.idle_timeout = idle_timeout
+        self.failed_timeout = failed_timeout
+        self.logger = logger
+        self.sessions = {}
+        self.reaped = {reason: 0 for reason in session_reaper.REASONS}
+        self.threads_reclaimed = 0
+        self.fifo_samples_reclaimed = 0
+        self.buffer_bytes_reclaimed = 0
+
+    def register(self, activity: session_activity):
+        """Starts tracking a session
+
+        Args:
+            activity (session_activity): the new session
+        """
+        self.sessions[activity.session_id] = activity
+
+    def unregister(self, session_id: str):
+        """Stops tracking a session
+
+        Args:
+            session_id (str): the session's identifier
+        """
+        self.sessions.pop(session_id, None)
+
+    def find(self) -> list:
+        """Refreshes each session's activity and returns the sessions to close
+
+        Returns:
+            list: (session_activity, reason) of each session to close
+        """
+        now = time.monotonic()
+        expired = []
+        for activity in list(self.sessions.values()):
+            track = activity.output_track
+            if track is not None and track.samples_sent != activity.samples_sent:
+                activity.samples_sent = track.samples_sent
+                activity.touch(session_reaper.SOURCE_RTP)
+            pc = activity.pc
+            if pc.connectionState in (session_reaper.REASON_FAILED, session_reaper.REASON_CLOSED):
+                if now - activity.last_activity > self.failed_timeout:
+                    expired.append((activity, pc.connectionState))
+            elif pc.iceConnectionState in ("connected", "completed"):
+                activity.touch(session_reaper.SOURCE_ICE)
+            elif self.idle_timeout > 0 and now - activity.last_activity > self.idle_timeout:
+                expired.append((activity, session_reaper.REASON_IDLE))
+        return expired
+
+    def reclaimed(self, reason: str, threads: int, fifo_samples: int, buffer_bytes: int):
+        """Counts a closed session and what closing it released
+
+        Args:
+            reason (str): one of REASONS
+            threads (int): threads that exited
+            fifo_samples (int): samples dropped from the AudioFifo and packet queue
+            buffer_bytes (int): bytes dropped from the playback buffer
+        """
+        self.reaped[reason] += 1
+        self.threads_reclaimed += threads
+        self.fifo_samples_reclaimed += fifo_samples
+        self.buffer_bytes_reclaimed += buffer_bytes
+
+    def status(self) -> dict:
+        """Returns the tracked sessions and the reclaimed totals
+
+        Returns:
+            dict: timeouts, tracked sessions and reclaimed counts
+        """
+        return {
+            "idle_timeout": self.idle_timeout,
+            "failed_timeout": self.failed_timeout,
+            "tracked": [activity.status() for activity in self.sessions.values()],
+            "reaped": dict(self.reaped),
+            "threads_reclaimed": self.threads_reclaimed,
+            "fifo_samples_reclaimed": self.fifo_samples_reclaimed,
+            "buffer_bytes_reclaimed": self.buffer_bytes_reclaimed,
+        }
@@ -0,0 +1,208 @@
+import struct
+import threading
+import uuid
+from multiprocessing import resource_tracker, shared_memory
+
+
+class shared_ring:
+    """Single producer, single consumer byte ring in a multiprocessing.shared_memory segment, with the interface of
+    shared_bytearray so it can serve as a session's playback buffer.
+
+    The segment starts with the total bytes written, the total bytes read and the capacity, followed by the data. Each
+    count is only ever stored by one side: the producer (usually another process, attached by name) copies its samples
+    straight into the segment (or writes them in place through reserve()) and then stores the written count, so the
+    consumer never sees a count ahead of its data. The consumer side (extract, clear, __len__) is also locked, as the
+    server's threads share it the way they share a shared_bytearray.
+    """
+
+    HEADER = struct.Struct("<QQQ")  # bytes written, bytes read, capacity
+    WRITTEN_OFFSET = 0
+    READ_OFFSET = 8
+    DATA_OFFSET = 64  # the counters keep a cache line to themselves
+
+    def __init__(self, capacity: int = 0, name: str | None = None):
+        """Constructor for shared_ring
+
+        Args:
+            capacity (int, optional): bytes the ring holds when creating one. Defaults to 0.
+            name (str | None, optional): the segment of an existing ring to attach to, or None to create one. Defaults
+                to None.
+        """
+        self.tlock = threading.Lock()
+        self.owner = name is None
+        if self.owner:
+            # short enough for platforms limiting shared memory names to 31 characters
+            self.segment = shared_memory.SharedMemory(
+                name="wrr_" + uuid.uuid4().hex[:16],
+                create=True,
+                size=shared_ring.DATA_OFFSET + capacity,
+            )
+            shared_ring.HEADER.pack_into(self.segment.buf, 0, 0, 0, capacity)
+        else:
+            self.segment = shared_memory.SharedMemory(name=name)
+            # only the creator unlinks it, so keep this process's resource tracker from doing so when it exits
+            resource_tracker.unregister(self.segment._name, "shared_memory")
+        self.capacity = shared_ring.HEADER.unpack_from(self.segment.buf, 0)[2]
+        self.closed = False
+
+    @property
+    def name(self) -> str:
+        """The name producers attach to"""
+        return self.segment.name
+
+    def counter(self, offset: int) -> int:
+        """Returns the bytes written (WRITTEN_OFFSET) or read (READ_OFFSET) since the ring was created
+
+        Args:
+            offset (int): the counter's offset in the segment
+
+        Returns:
+            int: the count
+        """
+        return struct.unpack_from("<Q", self.segment.buf, offset)[0]
+
+    def set_counter(self, offset: int, value: int):
+        """Stores a count, which only the side that owns it may do
+
+        Args:
+            offset (int): the counter's offset in the segment
+            value (int): the new count
+        """
+        struct.pack_into("<Q", self.segment.buf, offset, value)
+
+    def space(self) -> int:
+        """Returns the bytes the producer can write without overwriting unread data
+
+        Returns:
+            int: the free bytes
+        """
+        return self.capacity - (self.counter(shared_ring.WRITTEN_OFFSET) - self.counter(shared_ring.READ_OFFSET))
+
+    def reserve(self, nbytes: int) -> list[memoryview] | None:
+        """Producer side: returns views of the next nbytes of the ring to write samples into, two if they wrap around
+        the end. The bytes are not seen by the consumer until commit(nbytes). Release the views before close().
+
+        Args:
+            nbytes (int): the bytes to be written
+
+        Returns:
+            list[memoryview] | None: the views to fill in order, None if there is not enough space
+        """
+        if nbytes > self.space():
+            return None
+        start = self.counter(shared_ring.WRITTEN_OFFSET) % self.capacity
+        first = min(nbytes, self.capacity - start)
+        data = self.segment.buf[shared_ring.DATA_OFFSET :]
+        views = [data[start : start + first]]
+        if first < nbytes:
+            views.append(data[: nbytes - first])
+        data.release()
+        return views
+
+    def commit(self, nbytes: int):
+        """Producer side: makes the next nbytes written through reserve() available to the consumer
+
+        Args:
+            nbytes (int): the bytes written
+        """
+        self.set_counter(shared_ring.WRITTEN_OFFSET, self.counter(shared_ring.WRITTEN_OFFSET) + nbytes)
+
+    def write(self, chunk) -> bool:
+        """Producer side: copies a chunk into the ring and commits it
+
+        Args:
+            chunk: bytes, bytearray, an int16 numpy array or any other contiguous buffer
+
+        Returns:
+            bool: False (and nothing written) if there is not enough space
+        """
+        source = memoryview(chunk).cast("B")
+        nbytes = source.nbytes
+        views = self.reserve(nbytes)
+        if views is None:
+            return False
+        offset = 0
+        for view in views:
+            view[:] = source[offset : offset + view.nbytes]
+            offset += view.nbytes
+            view.release()
+        self.commit(nbytes)
+        return True
+
+    def extend(self, chunk: bytearray | bytes):
+        """Adds the supplied bytes to the end of the ring, like shared_bytearray.extend
+
+        Args:
+            chunk (bytearray | bytes): the data to be added
+
+        Raises:
+            BufferError: if the ring does not have room for it
+        """
+        if not self.write(chunk):
+            raise BufferError(f"shared_ring {self.name} is full")
+
+    def extract(self, chunk_size: int) -> bytearray:
+        """Removes a chunk_size bytearray of data from the start of the ring, or returns an empty bytearray if not
+        enough data is available.
+
+        Args:
+            chunk_size (int): the number of bytes to be returned in a bytearray, and removed from the ring
+
+        Returns:
+            bytearray: the bytes removed from the ring, or an empty bytearray if not enough data is available
+        """
+        chunk = bytearray()
+        with self.tlock:
+            if self.closed:
+                return chunk
+            read = self.counter(shared_ring.READ_OFFSET)
+            if self.counter(shared_ring.WRITTEN_OFFSET) - read < chunk_size:
+                return chunk
+            start = read % self.capacity
+            first = min(chunk_size, self.capacity - start)
+            base = shared_ring.DATA_OFFSET
+            chunk = bytearray(self.segment.buf[base + start : base + start + first])
+            if first < chunk_size:
+                chunk.extend(self.segment.buf[base : base + chunk_size - first])
+            self.set_counter(shared_ring.READ_OFFSET, read + chunk_size)
+        return chunk
+
+    def clear(self):
+        """Drops the content of the ring"""
+        with self.tlock:
+            if not self.closed:
+                self.set_counter(shared_ring.READ_OFFSET, self.counter(shared_ring.WRITTEN_OFFSET))
+
+    def get_bytes(self) -> list:
+        with self.tlock:
+            if self.closed:
+                return []
+            read = self.counter(shared_ring.READ_OFFSET)
+            count = self.counter(shared_ring.WRITTEN_OFFSET) - read
+            start = read % self.capacity
+            base = shared_ring.DATA_OFFSET
+            first = min(count, self.capacity - start)
+            return list(self.segment.buf[base + start : base + start + first]) + list(
+                self.segment.buf[base : base + count - first]
+            )
+
+    def __len__(self) -> int:
+        """Dunder method for length calculations
+
+        Returns:
+            int: the number of bytes currently stored in the ring
+        """
+        with self.tlock:
+            if self.closed:
+                return 0
+            return self.counter(shared_ring.WRITTEN_OFFSET) - self.counter(shared_ring.READ_OFFSET)
+
+    def close(self):
+        """Detaches from the segment, unlinking it if this ring created it"""
+        with self.tlock:
+            if self.closed:
+                return
+            self.closed = True
+            self.segment.close()
+            if self.owner:
+                self.segment.unlink()
@@ -0,0 +1,220 @@
+import math
+import os
+import re
+import sys
+import threading
+import time
+
+
+class stack_sampler:
+    """Samples the Python stacks of every thread in the process for a while and folds them into collapsed stacks
+    (one "root;caller;callee count" line per distinct stack, as flamegraph.pl, speedscope and inferno read them).
+
+    Every interval sys._current_frames() gives the stack each thread is on. Each stack is weighted by the cpu time its
+    thread used since the previous sample (from the thread's cpu clock), so threads waiting on a lock, queue or
+    selector add nothing to the cpu profile, or by one per sample for the wall clock profile. The stack's root frame is
+    the thread's role: its name with the "Thread-N" numbering dropped, so e.g. every session's
+    process_output_data_frames thread adds to one tree. Sampling holds the GIL for a few microseconds per thread per
+    interval and nothing is installed in the sampled threads, so it can run against a loaded server.
+    """
+
+    WEIGHT_CPU = "cpu"
+    WEIGHT_WALL = "wall"
+    WEIGHTS = (WEIGHT_CPU, WEIGHT_WALL)
+    MAX_SECONDS = 60.0
+    MIN_INTERVAL_MS = 1.0
+    DEFAULT_INTERVAL_MS = 10.0
+    TOP_STACKS = 5
+    NUMBERED_THREAD = re.compile(r"^Thread-\d+ ?")
+
+    def __init__(self, interval_ms: float = DEFAULT_INTERVAL_MS):
+        """Constructor for stack_sampler
+
+        Args:
+            interval_ms (float, optional): milliseconds between samples. Defaults to DEFAULT_INTERVAL_MS.
+
+        Raises:
+            ValueError: if interval_ms is not finite
+        """
+        if not math.isfinite(interval_ms):
+            raise ValueError(f"interval_ms must be finite, not {interval_ms}")
+        self.interval = max(stack_sampler.MIN_INTERVAL_MS, interval_ms) / 1000.0
+        # (thread role, stack) -> [samples, cpu ns]
+        self.stacks = {}
+        # thread ident -> name, samples, cpu ns, cpu clock reading at the last sample
+        self.threads = {}
+        # (filename, function, line) -> frame text
+        self.frame_names = {}
+        self.samples = 0
+        self.seconds = 0.0
+
+    @staticmethod
+    def thread_cpu_ns(ident: int) -> int | None:
+        """Returns the cpu time a thread has used
+
+        Args:
+            ident (int): the thread's threading ident
+
+        Returns:
+            int | None: nanoseconds of cpu, None if the platform has no per-thread cpu clocks or the thread has exited
+        """
+        try:
+            return time.clock_gettime_ns(time.pthread_getcpuclockid(ident))
+        except (AttributeError, OSError):
+            return None
+
+    @staticmethod
+    def thread_role(name: str) -> str:
+        """Returns a thread's name without the numbering Python gives unnamed threads
+
+        Args:
+            name (str): e.g., "Thread-7 (process_output_data_frames)"
+
+        Returns:
+            str: e.g., "(process_output_data_frames)"
+        """
+        return stack_sampler.NUMBERED_THREAD.sub("", name) or name
+
+    def collapse(self, frame) -> str:
+        """Returns a stack outermost first, separated by semicolons
+
+        Args:
+            frame (FrameType): the innermost frame
+
+        Returns:
+            str: e.g., "webrtcsvr.py:<module>:1312;...;audio_output_track.py:recv:402"
+        """
+        entries = []
+        frame_names = self.frame_names
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_filename, code.co_name, frame.f_lineno)
+            text = frame_names.get(key, None)
+            if text is None:
+                text = f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+                frame_names[key] = text
+            entries.append(text)
+            frame = frame.f_back
+        return ";".join(reversed(entries))
+
+    def sample(self, own_ident: int):
+        """Adds one sample of every thread but the sampler's
+
+        Args:
+            own_ident (int): the sampler's thread ident
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            thread = self.threads.get(ident, None)
+            cpu_ns = stack_sampler.thread_cpu_ns(ident)
+            if thread is None:
+                # the first sample of a thread only reads its cpu clock, which its stack used none of yet
+                self.threads[ident] = {
+                    "name": names.get(ident, str(ident)),
+                    "samples": 0,
+                    "cpu_ns": 0,
+                    "clock_ns": cpu_ns,
+                }
+                continue
+            used_ns = 0
+            if cpu_ns is not None and thread["clock_ns"] is not None:
+                used_ns = cpu_ns - thread["clock_ns"]
+            thread["clock_ns"] = cpu_ns
+            thread["samples"] += 1
+            thread["cpu_ns"] += used_ns
+            totals = self.stacks.setdefault(
+                (stack_sampler.thread_role(thread["name"]), self.collapse(frame)), [0, 0]
+            )
+            totals[0] += 1
+            totals[1] += used_ns
+
+    def run(self, seconds: float) -> "stack_sampler":
+        """Samples every thread for a while, blocking the calling thread (which is not sampled)
+
+        Args:
+            seconds (float): how long to sample, up to MAX_SECONDS
+
+        Returns:
+            stack_sampler: self, for collapsed() and summary()
+
+        Raises:
+            ValueError: if seconds is not finite (a nan deadline is never reached)
+        """
+        if not math.isfinite(seconds):
+            raise ValueError(f"seconds must be finite, not {seconds}")
+        seconds = min(max(seconds, self.interval), stack_sampler.MAX_SECONDS)
+        own_ident = threading.get_ident()
+        start = time.perf_counter()
+        deadline = start + seconds
+        next_sample = start
+        while True:
+            self.sample(own_ident)
+            self.samples += 1
+            next_sample += self.interval
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if next_sample > now:
+                time.sleep(next_sample - now)
+            else:
+                # fell behind (the GIL was held), so keep to the grid rather than sampling in a burst
+                next_sample = now
+        self.seconds = time.perf_counter() - start
+        return self
+
+    def collapsed(self, weight: str = WEIGHT_CPU) -> str:
+        """Returns the profile in the collapsed stack format
+
+        Args:
+            weight (str, optional): WEIGHT_CPU for microseconds of cpu, WEIGHT_WALL for samples. Defaults to
+                WEIGHT_CPU.
+
+        Returns:
+            str: one "thread role;frame;...;frame value" line per stack, heaviest first
+        """
+        lines = []
+        for (role, stack), (samples, cpu_ns) in self.stacks.items():
+            value = samples if weight == stack_sampler.WEIGHT_WALL else cpu_ns // 1000
+            if value > 0:
+                lines.append((value, f"{role};{stack} {value}"))
+        lines.sort(reverse=True)
+        return "".join(line + "\n" for _, line in lines)
+
+    def summary(self) -> dict:
+        """Returns each thread's cpu over the profile and the stacks it used it in
+
+        Returns:
+            dict: the seconds sampled, samples taken and per thread cpu seconds, cpu percent of one core and top stacks
+        """
+        elapsed = max(self.seconds, 1e-9)
+        threads = []
+        for thread in self.threads.values():
+            threads.append(
+                {
+                    "name": thread["name"],
+                    "samples": thread["samples"],
+                    "cpu_seconds": round(thread["cpu_ns"] / 1e9, 4),
+                    "cpu_percent": round(thread["cpu_ns"] / 1e9 / elapsed * 100.0, 2),
+                }
+            )
+        roles = {}
+        for (role, stack), (samples, cpu_ns) in self.stacks.items():
+            entry = roles.setdefault(role, {"role": role, "samples": 0, "cpu_seconds": 0.0, "top_stacks": []})
+            entry["samples"] += samples
+            entry["cpu_seconds"] += cpu_ns / 1e9
+            entry["top_stacks"].append({"stack": stack, "cpu_ms": round(cpu_ns / 1e6, 3), "samples": samples})
+        for entry in roles.values():
+            entry["cpu_seconds"] = round(entry["cpu_seconds"], 4)
+            entry["cpu_percent"] = round(entry["cpu_seconds"] / elapsed * 100.0, 2)
+            entry["top_stacks"] = sorted(
+                entry["top_stacks"], key=lambda item: (item["cpu_ms"], item["samples"]), reverse=True
+            )[: stack_sampler.TOP_STACKS]
+        return {
+            "seconds": round(self.seconds, 3),
+            "samples": self.samples,
+            "interval_ms": round(self.interval * 1000.0, 3),
+            "threads": sorted(threads, key=lambda item: item["cpu_seconds"], reverse=True),
+            "roles": sorted(roles.values(), key=lambda item: item["cpu_seconds"], reverse=True),
+        }
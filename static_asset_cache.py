@@ -0,0 +1,185 @@
+import gzip
+import hashlib
+import os
+import time
+from logging import Logger
+
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always offered
+    brotli = None
+
+
+class static_asset:
+    """One file held in memory with its precompressed variants"""
+
+    def __init__(self, path: str, content_type: str, cache_control: str):
+        """Constructor for static_asset (call load before serving it)
+
+        Args:
+            path (str): the file's path
+            content_type (str): the Content-Type to serve it with
+            cache_control (str): the Cache-Control header to serve it with
+        """
+        self.path = path
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.mtime_ns = 0
+        self.size = 0
+        # encoding ("identity", "gzip", "br") to (body, etag)
+        self.variants = {}
+
+    def load(self):
+        """Reads the file and builds its identity, gzip and (if available) brotli variants"""
+        stat = os.stat(self.path)
+        with open(self.path, "rb") as handle:
+            body = handle.read()
+        digest = hashlib.sha1(body).hexdigest()[:16]
+        variants = {"identity": (body, f'"{digest}"')}
+        variants["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gz"')
+        if brotli is not None:
+            variants["br"] = (brotli.compress(body), f'"{digest}-br"')
+        # replaced in one assignment so a concurrent request sees either the old or the new set
+        self.variants = variants
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+
+    def is_stale(self) -> bool:
+        """Returns True if the file has changed since it was loaded
+
+        Returns:
+            bool: True if the mtime or size differs from the loaded copy
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            # keep serving the loaded copy if the file disappears
+            return False
+        return stat.st_mtime_ns != self.mtime_ns or stat.st_size != self.size
+
+
+class static_asset_cache:
+    """In-memory cache of the files served by the web server.
+
+    Files are loaded at startup and re-read when their mtime or size changes (checked at most once per CHECK_SECONDS).
+    Responses carry an ETag and Cache-Control, use the best encoding the client accepts and answer If-None-Match
+    revalidation with 304 Not Modified.
+    """
+
+    CHECK_SECONDS = 1.0
+    ENCODING_PREFERENCE = ("br", "gzip")
+
+    def __init__(self, root: str, logger: Logger):
+        """Constructor for static_asset_cache
+
+        Args:
+            root (str): the directory holding the files
+            logger (Logger): logger to record status
+        """
+        self.root = root
+        self.logger = logger
+        self.assets = {}
+        self.last_check = 0.0
+        self.served = 0
+        self.not_modified = 0
+        self.reloads = 0
+
+    def add(self, filename: str, content_type: str, cache_control: str = "no-cache"):
+        """Loads a file into the cache
+
+        Args:
+            filename (str): the file's name relative to root
+            content_type (str): the Content-Type to serve it with
+            cache_control (str, optional): the Cache-Control header. Defaults to "no-cache" (always revalidate).
+        """
+        asset = static_asset(os.path.join(self.root, filename), content_type, cache_control)
+        asset.load()
+        self.assets[filename] = asset
+        self.logger.info(
+            f"Cached {filename}: {', '.join(f'{name} {len(body)} bytes' for name, (body, _) in asset.variants.items())}"
+        )
+
+    def refresh(self):
+        """Reloads any file that changed, at most once per CHECK_SECONDS"""
+        now = time.monotonic()
+        if now - self.last_check < static_asset_cache.CHECK_SECONDS:
+            return
+        self.last_check = now
+        for filename, asset in self.assets.items():
+            if asset.is_stale():
+                try:
+                    asset.load()
+                    self.reloads += 1
+                    self.logger.info(f"Reloaded {filename} after it changed on disk.")
+                except OSError as e:
+                    self.logger.warning(f"Could not reload {filename}: {e}")
+
+    @staticmethod
+    def choose_encoding(accept_encoding: str, variants: dict) -> str:
+        """Returns the preferred encoding the client accepts
+
+        Args:
+            accept_encoding (str): the request's Accept-Encoding header
+            variants (dict): the asset's variants
+
+        Returns:
+            str: "br", "gzip" or "identity"
+        """
+        accepted = {}
+        for item in accept_encoding.split(","):
+            name, _, params = item.strip().partition(";")
+            quality = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name.strip().lower()] = quality
+        for encoding in static_asset_cache.ENCODING_PREFERENCE:
+            if encoding in variants and accepted.get(encoding, accepted.get("*", 0.0)) > 0.0:
+                return encoding
+        return "identity"
+
+    def response(self, request: web.Request, filename: str) -> web.Response:
+        """Builds the response for a cached file, 304 if the client's copy is current
+
+        Args:
+            request (web.Request): the request
+            filename (str): the file's name as passed to add
+
+        Returns:
+            web.Response: the file, or 304 Not Modified
+        """
+        self.refresh()
+        asset = self.assets[filename]
+        variants = asset.variants
+        encoding = static_asset_cache.choose_encoding(
+            request.headers.get("Accept-Encoding", ""), variants
+        )
+        body, etag = variants[encoding]
+        headers = {
+            "ETag": etag,
+            "Cache-Control": asset.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = request.headers.get("If-None-Match", "")
+        if if_none_match:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            if "*" in tags or etag in tags:
+                self.not_modified += 1
+                return web.Response(status=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        self.served += 1
+        return web.Response(body=body, content_type=asset.content_type, charset="utf-8", headers=headers)
+
+    def status(self) -> dict:
+        """Returns the cache's counters
+
+        Returns:
+            dict: responses served with a body, 304 responses and reloads
+        """
+        return {"served": self.served, "not_modified": self.not_modified, "reloads": self.reloads}
@@ -0,0 +1,127 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class time_stretch:
+    """Pitch preserving speed-up of mono s16 audio by WSOLA (waveform similarity overlap-add), applied block by block.
+
+    The output is built from Hann windowed frames of FRAME_MS overlapped by half. Each frame is taken from the input
+    speed times further along than the one before, moved by up to SEARCH_MS to where it best continues that frame (the
+    normalized cross-correlation of every candidate position is one matrix product), so the waveform stays continuous
+    and the pitch is unchanged. At speed 1.0 nothing is held back: audio passes straight through, and a stretch in
+    progress is finished with the raw input its last frame continues into, so starting and stopping are seamless.
+    """
+
+    FRAME_MS = 20
+    SEARCH_MS = 5
+
+    def __init__(self, sample_rate: int):
+        """Constructor for time_stretch
+
+        Args:
+            sample_rate (int): the sample rate of the audio
+        """
+        self.hop = sample_rate * time_stretch.FRAME_MS // 2000
+        self.frame = self.hop * 2
+        self.search = sample_rate * time_stretch.SEARCH_MS // 1000
+        # a periodic Hann window, whose halves sum to 1 when overlapped by half
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(self.frame) / self.frame)).astype(np.float32)
+        # input samples skipped in total, which is the playing time saved
+        self.removed_samples = 0
+        self.reset()
+
+    def reset(self):
+        """Drops any audio held for the stretch in progress"""
+        # input not yet passed to the output, and where in it the last frame was taken (None before the first)
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.previous = None
+        # where the next frame starts at the nominal speed
+        self.position = 0.0
+        # the windowed second half of the last frame, added to the first half of the next
+        self.tail = np.zeros(self.hop, dtype=np.float32)
+
+    def is_active(self) -> bool:
+        """Returns True while a stretch holds audio back
+
+        Returns:
+            bool: True if flush() would return audio
+        """
+        return self.buffer.size > 0
+
+    def process(self, samples: np.ndarray, speed: float) -> np.ndarray:
+        """Plays samples at a speed, returning the audio ready so far. While stretching, up to one frame plus the
+        search range is held back until the input that follows it arrives.
+
+        Args:
+            samples (np.ndarray): mono int16 samples
+            speed (float): 1.0 to pass the audio through, above 1.0 to shorten it by that factor
+
+        Returns:
+            np.ndarray: mono int16 samples
+        """
+        if speed <= 1.0:
+            if not self.is_active():
+                return samples
+            return np.concatenate([self.flush(), samples])
+        self.buffer = np.concatenate([self.buffer, samples.astype(np.float32)])
+        hop, frame, search = self.hop, self.frame, self.search
+        output = []
+        if self.previous is None:
+            if self.buffer.size < frame:
+                return np.zeros(0, dtype=np.int16)
+            # the first frame continues the audio passed through before it, so its first half goes out unwindowed
+            output.append(self.buffer[:hop])
+            self.tail = self.buffer[hop:frame] * self.window[hop:]
+            self.previous = 0
+            self.position = hop * speed
+        while True:
+            nominal = round(self.position)
+            # never behind the natural continuation, so audio is only ever skipped, not repeated
+            low = max(nominal - search, self.previous + hop)
+            high = max(nominal + search, low)
+            if self.buffer.size < high + frame:
+                break
+            template = self.buffer[self.previous + hop : self.previous + frame]
+            candidates = sliding_window_view(self.buffer[low : high + hop], hop)
+            energy = np.einsum("ij,ij->i", candidates, candidates)
+            best = low + int(np.argmax((candidates @ template) / np.sqrt(energy + 1.0)))
+            segment = self.buffer[best : best + frame] * self.window
+            output.append(self.tail + segment[:hop])
+            self.tail = segment[hop:]
+            self.removed_samples += best - self.previous - hop
+            self.previous = best
+            self.position += hop * speed
+        # drop the input no later frame can start in
+        cut = min(self.previous, max(0, int(self.position) - search))
+        self.buffer = self.buffer[cut:]
+        self.previous -= cut
+        self.position -= cut
+        return time_stretch.to_int16(output)
+
+    def flush(self) -> np.ndarray:
+        """Ends the stretch in progress, returning the audio it held back
+
+        Returns:
+            np.ndarray: mono int16 samples
+        """
+        if self.previous is None:
+            held = [self.buffer]
+        else:
+            # the tail plus the rest of its frame unwindowed is the raw input from the end of the last output
+            held = [self.buffer[self.previous + self.hop :]]
+        self.reset()
+        return time_stretch.to_int16(held)
+
+    @staticmethod
+    def to_int16(parts: list) -> np.ndarray:
+        """Joins float sample arrays into int16 samples
+
+        Args:
+            parts (list): float32 arrays
+
+        Returns:
+            np.ndarray: mono int16 samples
+        """
+        if not parts:
+            return np.zeros(0, dtype=np.int16)
+        return np.clip(np.rint(np.concatenate(parts)), -32768, 32767).astype(np.int16)
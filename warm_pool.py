@@ -0,0 +1,151 @@
+import asyncio
+import time
+from logging import Logger
+
+from aiortc import RTCPeerConnection
+
+from audio_output_track import audio_output_track
+from codec_profiles import codec_profiles
+from constants import constants as CONST
+from frame_build_pool import frame_build_pool, frame_build_session
+
+
+class warm_session:
+    """A peer connection (with its DTLS certificate already generated) and, when frames are offloaded, the
+    frame_build_pool session its output track will use"""
+
+    def __init__(self, pc: RTCPeerConnection, frame_builder: frame_build_session | None):
+        """Constructor for warm_session
+
+        Args:
+            pc (RTCPeerConnection): the unused peer connection
+            frame_builder (frame_build_session | None): the prepared frame building session, or None
+        """
+        self.pc = pc
+        self.frame_builder = frame_builder
+        self.created = time.monotonic()
+
+    def discard(self):
+        """Releases the prepared resources of a session that will not be used"""
+        if self.frame_builder is not None:
+            self.frame_builder.close()
+            self.frame_builder = None
+        # the peer connection has no transports until an offer is applied, so there is nothing to close
+
+
+class warm_pool:
+    """Keeps target_size sessions prepared off the event loop so /offer only has to take one.
+
+    Preparing a session generates the peer connection's certificate and creates the shared memory segments of its
+    frame_build_pool session in a worker thread. take() pops a prepared session (or returns None, and the caller builds
+    one inline as before) and wakes the refill task, which prepares replacements one at a time. Sessions older than
+    MAX_AGE_SECONDS are replaced, well before their certificate expires.
+    """
+
+    MAX_AGE_SECONDS = 3600.0
+
+    def __init__(self, config: dict, target_size: int, logger: Logger):
+        """Constructor for warm_pool (call start from the event loop)
+
+        Args:
+            config (dict): the server configuration (CONST.OFFLOAD, CONST.OFFLOAD_WORKERS)
+            target_size (int): the number of sessions to keep prepared
+            logger (Logger): logger to record status
+        """
+        self.config = config
+        self.target_size = target_size
+        self.logger = logger
+        self.sessions = []
+        self.refill_event = asyncio.Event()
+        self.refill_task = None
+        self.hits = 0
+        self.misses = 0
+        self.prepared = 0
+        self.expired = 0
+        self.prepare_ms = 0.0
+
+    def start(self):
+        """Starts the refill task"""
+        if self.refill_task is None:
+            self.refill_task = asyncio.ensure_future(self.refill())
+
+    def prepare(self) -> warm_session:
+        """Prepares one session (runs in a worker thread)
+
+        Returns:
+            warm_session: the prepared session
+        """
+        frame_builder = None
+        if self.config.get(CONST.OFFLOAD, frame_build_pool.MODE_NONE) != frame_build_pool.MODE_NONE:
+            # the codec is not negotiated yet, so size the segments for the largest block any output format takes
+            block_bytes = max(
+                audio_output_track.block_bytes_for(frames_per_buffer, rate)
+                for rate, _, frames_per_buffer in codec_profiles.OUTPUT_FORMATS.values()
+            )
+            frame_builder = frame_build_session(
+                frame_build_pool.get_pool(self.config.get(CONST.OFFLOAD_WORKERS, 0)),
+                block_bytes * CONST.MAX_CATCHUP_BLOCKS,
+            )
+        return warm_session(RTCPeerConnection(), frame_builder)
+
+    async def refill(self):
+        """Refill task: tops the pool up to target_size whenever a session is taken or expires"""
+        loop = asyncio.get_running_loop()
+        while True:
+            now = time.monotonic()
+            for session in [s for s in self.sessions if now - s.created > warm_pool.MAX_AGE_SECONDS]:
+                self.sessions.remove(session)
+                session.discard()
+                self.expired += 1
+            while len(self.sessions) < self.target_size:
+                start_ns = time.perf_counter_ns()
+                try:
+                    session = await loop.run_in_executor(None, self.prepare)
+                except Exception as e:
+                    self.logger.warning(f"Could not prepare a warm session: {e}", exc_info=True)
+                    break
+                self.prepare_ms = (time.perf_counter_ns() - start_ns) / 1e6
+                self.prepared += 1
+                self.sessions.append(session)
+            self.refill_event.clear()
+            try:
+                await asyncio.wait_for(self.refill_event.wait(), warm_pool.MAX_AGE_SECONDS / 4)
+            except TimeoutError:
+                pass
+
+    def take(self) -> warm_session | None:
+        """Takes a prepared session
+
+        Returns:
+            warm_session | None: the oldest prepared session, or None if the pool is empty
+        """
+        self.refill_event.set()
+        if not self.sessions:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.sessions.pop(0)
+
+    def close(self):
+        """Stops the refill task and releases the prepared sessions"""
+        if self.refill_task is not None:
+            self.refill_task.cancel()
+            self.refill_task = None
+        while self.sessions:
+            self.sessions.pop().discard()
+
+    def status(self) -> dict:
+        """Returns the pool's size and counters
+
+        Returns:
+            dict: target and current size, hits, misses, sessions prepared and expired, last prepare time
+        """
+        return {
+            "target": self.target_size,
+            "ready": len(self.sessions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "prepared": self.prepared,
+            "expired": self.expired,
+            "last_prepare_ms": round(self.prepare_ms, 3),
+        }
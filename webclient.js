@@ -69,6 +69,31 @@ function enumerateInputDevices() {
     });
 }
 
+// the server answers 503 with Retry-After when it is busy or full
+const OFFER_ATTEMPTS = 5;
+
+function postOffer(offer, attempts) {
+    return fetch('/offer', {
+        body: JSON.stringify({
+            sdp: offer.sdp,
+            type: offer.type
+        }),
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        method: 'POST'
+    }).then((response) => {
+        if (response.status !== 503 || attempts <= 1) {
+            return response;
+        }
+        let delay = parseFloat(response.headers.get('Retry-After')) || 1;
+        console.log(`Server busy, retrying the offer in ${delay} seconds`);
+        return new Promise((resolve) => setTimeout(resolve, delay * 1000)).then(() => {
+            return postOffer(offer, attempts - 1);
+        });
+    });
+}
+
 function negotiate() {
     return pc.createOffer().then((offer) => {
         // debug
@@ -100,16 +125,7 @@ function negotiate() {
         }
 
         document.getElementById('offer-sdp').textContent = offer.sdp;
-        return fetch('/offer', {
-            body: JSON.stringify({
-                sdp: offer.sdp,
-                type: offer.type
-            }),
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            method: 'POST'
-        });
+        return postOffer(offer, OFFER_ATTEMPTS);
     }).then((response) => {
         let rspjson = null
         try {
@@ -147,12 +163,19 @@ function start() { // NOSONAR
         let parameters = JSON.parse(document.getElementById('datachannel-parameters').value);
 
         dc = pc.createDataChannel('chat', parameters);
+        dc.binaryType = 'arraybuffer';
+        let audioFormat = document.getElementById('datachannel-audio').value;
+        let audioStats = {messages: 0, lost: 0, reordered: 0, nextSeq: 0, bytes: 0};
         dc.addEventListener('close', () => {
             clearInterval(dcInterval);
             dataChannelLog.textContent += '- close\n';
         });
         dc.addEventListener('open', () => {
             dataChannelLog.textContent += '- open\n';
+            if (audioFormat !== 'off') {
+                // the server answers with "audio <format>", or "audio unavailable" without --datachannel-audio
+                dc.send('audio ' + audioFormat);
+            }
             dcInterval = setInterval(() => {
                 let message = 'ping ' + current_stamp();
                 dataChannelLog.textContent += '> ' + message + '\n';
@@ -160,6 +183,23 @@ function start() { // NOSONAR
             }, 1000);
         });
         dc.addEventListener('message', (evt) => {
+            if (evt.data instanceof ArrayBuffer) {
+                // binary audio: format (uint8), sequence number (uint32), pts (uint32), send time (uint64), payload
+                let seq = new DataView(evt.data).getUint32(1);
+                audioStats.messages += 1;
+                audioStats.bytes += evt.data.byteLength;
+                if (seq >= audioStats.nextSeq) {
+                    audioStats.lost += seq - audioStats.nextSeq;
+                    audioStats.nextSeq = seq + 1;
+                } else {
+                    audioStats.lost -= 1;
+                    audioStats.reordered += 1;
+                }
+                document.getElementById('datachannel-audio-stats').textContent =
+                    `${audioFormat}: ${audioStats.messages} messages, ${audioStats.bytes} bytes, ` +
+                    `${audioStats.lost} lost, ${audioStats.reordered} reordered`;
+                return;
+            }
             try {
                 let msg = JSON.parse(evt.data)
                 if (msg.type == "chat") {
@@ -1,21 +1,47 @@
 import sys
-import aiofiles
+import argparse
 import asyncio
+import atexit
+import hmac
 import json
 import logging
+import logging.handlers
+import math
 import os
 from pathlib import Path
 import queue
+import signal
 import ssl
 import threading
+import time
 import traceback
 import uuid
 from aiohttp import web
-from aiortc import RTCPeerConnection, RTCRtpReceiver, RTCSessionDescription
+from aiortc import RTCPeerConnection, RTCRtpTransceiver, RTCSessionDescription
 
+from aiortc.mediastreams import MediaStreamError
+
+from audio_input_track import audio_input_track
 from audio_output_track import audio_output_track
-from client_web_audio_playback import client_web_audio_playback
+from call_recorder import call_recorder
+from codec_profiles import codec_profiles
+from capture_writer import capture_session, capture_writer
+from conversation import conversation
+from datachannel_audio import datachannel_audio
+from frame_build_pool import frame_build_pool
+from frame_timing import frame_timing
+from loop_monitor import loop_monitor, uvloop
+from log_pipeline import nonblocking_queue_handler, sampling_filter
+from metrics import prometheus_text, session_metrics
+from msg_bus import msg_bus
+from negotiation_limiter import negotiation_limiter
+from session_reaper import session_activity, session_reaper
 from shared_bytearray import shared_bytearray
+from shared_ring import shared_ring
+from stack_sampler import stack_sampler
+from static_asset_cache import static_asset_cache
+from warm_pool import warm_pool
+from webrtcsvr_supervisor import webrtcsvr_supervisor
 from constants import constants as CONST
 
 
@@ -25,25 +51,254 @@ _INFO = False  # True to print tracebacks
 class webrtcsvr:
     """Program to interact with a webrtc client"""
 
-    def __init__(self):
-        """Constructor for the webrtcsvr. Initialization occurs during the get_params call in main."""
+    # writes queued log records to the log file from its own thread
+    log_listener = None
+
+    def __init__(self, worker_index: int = -1):
+        """Constructor for the webrtcsvr. Initialization occurs during the get_params call in main.
+
+        Args:
+            worker_index (int, optional): the index of this worker process when run by the webrtcsvr_supervisor. Defaults to -1 (not a worker).
+        """
         self.exit = False
         self.conv_data = {}
-        self.logger = webrtcsvr.set_logger(__name__)
+        self.worker_index = worker_index
+        self.logger = webrtcsvr.set_logger(__name__, worker_index)
         self.config = {}
         self.response_done_event = asyncio.Event()
         self.response_start_event = asyncio.Event()
         self.listen_end_event = asyncio.Event()
         self.output_index = 1
-        self.pc = None
+        self.pcs = set()
+        # conv_id -> conversation, one per offer while the web server runs for the life of the process
+        self.conversations = {}
+        # set to end the web server (Ctrl+C, or the end of a drain)
+        self.stopped = asyncio.Event()
+        self.draining = False
+        # created with the server so its semaphore belongs to the running loop
+        self.negotiations = None
+        self.warm_pool = None
+        self.reaper = None
+        self.reaper_task = None
+        self.msg_bus = None
+        self.loop_monitor = None
+        # True while /profile is sampling, which is done one request at a time
+        self.profiling = False
         self.ROOT = os.path.dirname(__file__)
+        # page and script served from memory, reloaded when they change on disk
+        self.static_assets = static_asset_cache(self.ROOT, self.logger)
+        self.static_assets.add("index.html", "text/html")
+        self.static_assets.add("webclient.js", "application/javascript")
+
+    def get_params(self, args: list):
+        """Parses the command line arguments into self.config
+
+        Args:
+            args (list): the command line arguments (e.g., sys.argv)
+        """
+        parser = argparse.ArgumentParser(
+            prog="webrtcsvr", description="WebRTC audio playback server"
+        )
+        parser.add_argument(
+            "--host", default=CONST.DEFAULT_HOST, help="host name or address to listen on"
+        )
+        parser.add_argument(
+            "--port", type=int, default=CONST.DEFAULT_PORT, help="port to listen on"
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="number of worker processes sharing the port with SO_REUSEPORT (1 runs in this process)",
+        )
+        parser.add_argument(
+            "--drain-timeout",
+            type=float,
+            default=CONST.DEFAULT_DRAIN_TIMEOUT_SECONDS,
+            help="seconds a worker waits for its sessions to end after SIGTERM",
+        )
+        parser.add_argument(
+            "--offload",
+            choices=frame_build_pool.MODES,
+            default=frame_build_pool.MODE_NONE,
+            help="run output resampling (frames) or resampling and Opus encoding (encode) in a process pool",
+        )
+        parser.add_argument(
+            "--offload-workers",
+            type=int,
+            default=0,
+            help="processes in the offload pool (0 uses half the cores)",
+        )
+        parser.add_argument(
+            "--capture",
+            action="store_true",
+            help="capture every session's pipeline stages to wav files (also switched at runtime via POST /capture, "
+            "which needs --admin-token)",
+        )
+        parser.add_argument(
+            "--capture-dir", default=CONST.DEFAULT_CAPTURE_DIR, help="directory for the capture wav files"
+        )
+        parser.add_argument(
+            "--capture-max-mb",
+            type=float,
+            default=CONST.DEFAULT_CAPTURE_MAX_MB,
+            help="megabytes of capture audio this process may write before further captures are dropped",
+        )
+        parser.add_argument(
+            "--record",
+            choices=call_recorder.FORMATS,
+            default=call_recorder.FORMAT_NONE,
+            help="record both legs of every call as FLAC or Opus in Ogg",
+        )
+        parser.add_argument(
+            "--record-dir", default=CONST.DEFAULT_RECORD_DIR, help="directory for the call recordings"
+        )
+        parser.add_argument(
+            "--record-layout",
+            choices=call_recorder.LAYOUTS,
+            default=call_recorder.LAYOUT_SPLIT,
+            help="split puts the caller on the left channel and the server on the right, mixed sums them to mono",
+        )
+        parser.add_argument(
+            "--max-negotiations",
+            type=int,
+            default=CONST.DEFAULT_MAX_NEGOTIATIONS,
+            help="offers negotiated at once, others wait up to --negotiation-queue-timeout",
+        )
+        parser.add_argument(
+            "--negotiation-queue-timeout",
+            type=float,
+            default=CONST.DEFAULT_NEGOTIATION_QUEUE_TIMEOUT_SECONDS,
+            help="seconds an offer waits for a negotiation slot before a 503 is returned",
+        )
+        parser.add_argument(
+            "--max-sessions",
+            type=int,
+            default=0,
+            help="peer connections held at once before offers get a 503 (0 for no limit)",
+        )
+        parser.add_argument(
+            "--retry-after",
+            type=int,
+            default=CONST.DEFAULT_RETRY_AFTER_SECONDS,
+            help="seconds sent in the Retry-After header of a 503",
+        )
+        parser.add_argument(
+            "--warm-pool",
+            type=int,
+            default=0,
+            help="peer connections (and offload sessions) kept prepared for /offer (0 to prepare each on demand)",
+        )
+        parser.add_argument(
+            "--datachannel-audio",
+            action="store_true",
+            help='let clients ask for their audio as binary data channel messages ("audio pcm" or "audio opus")',
+        )
+        parser.add_argument(
+            "--dtx",
+            action="store_true",
+            help="stop sending silence between responses, but for a keepalive frame every 400 ms",
+        )
+        parser.add_argument(
+            "--codec-profile",
+            choices=codec_profiles.PROFILES,
+            default=codec_profiles.PROFILE_BROWSER,
+            help="codecs preferred for the audio sent: the browser's first choice, opus, or low-cpu (PCMU/PCMA at 8 kHz)",
+        )
+        parser.add_argument(
+            "--latency-target-ms",
+            type=float,
+            default=0.0,
+            help="play faster (pitch preserved) while more than this is buffered for a session (0 to never stretch)",
+        )
+        parser.add_argument(
+            "--max-speed",
+            type=float,
+            default=CONST.DEFAULT_MAX_SPEED,
+            help="the fastest playback used to drain a backlog beyond --latency-target-ms",
+        )
+        parser.add_argument(
+            "--drift-correction",
+            action="store_true",
+            help="estimate the drift between the audio source and the send clock and resample to hold the buffered "
+            "depth at --latency-target-ms (or steady, if 0)",
+        )
+        parser.add_argument(
+            "--msg-bus",
+            default="",
+            help="Unix socket path where TTS/LLM processes send conversations their audio and events (with _w<index> "
+            "appended for each worker), instead of playing back playback.wav",
+        )
+        parser.add_argument(
+            "--msg-bus-ring-kb",
+            type=int,
+            default=CONST.DEFAULT_MSG_BUS_RING_KB,
+            help="size of each conversation's shared memory playback buffer when --msg-bus is used",
+        )
+        parser.add_argument(
+            "--event-loop",
+            choices=loop_monitor.LOOPS,
+            default=loop_monitor.LOOP_ASYNCIO,
+            help="the event loop to run on (uvloop needs the uvloop package)",
+        )
+        parser.add_argument(
+            "--admin-token",
+            default=os.environ.get(CONST.ADMIN_TOKEN_ENV, ""),
+            help="bearer token for the admin routes (POST /capture, /profile), which are off without one "
+            f"(default ${CONST.ADMIN_TOKEN_ENV})",
+        )
+        parser.add_argument(
+            "--idle-timeout",
+            type=float,
+            default=CONST.DEFAULT_IDLE_TIMEOUT_SECONDS,
+            help="seconds without activity before a session that is not connected is closed (0 to never close idle sessions)",
+        )
+        parser.add_argument(
+            "--failed-timeout",
+            type=float,
+            default=CONST.DEFAULT_FAILED_TIMEOUT_SECONDS,
+            help="seconds a failed or closed session is kept before its threads and buffers are released",
+        )
+        params = parser.parse_args(args[1:])
+        if params.event_loop == loop_monitor.LOOP_UVLOOP and uvloop is None:
+            parser.error("--event-loop uvloop needs the uvloop package (pip install uvloop)")
+        self.config[CONST.HOST] = params.host
+        self.config[CONST.PORT] = params.port
+        self.config[CONST.WORKERS] = max(1, params.workers)
+        self.config[CONST.DRAIN_TIMEOUT] = params.drain_timeout
+        self.config[CONST.OFFLOAD] = params.offload
+        self.config[CONST.OFFLOAD_WORKERS] = params.offload_workers
+        self.config[CONST.CAPTURE] = params.capture
+        self.config[CONST.CAPTURE_DIR] = params.capture_dir
+        self.config[CONST.CAPTURE_MAX_MB] = params.capture_max_mb
+        self.config[CONST.MAX_NEGOTIATIONS] = params.max_negotiations
+        self.config[CONST.NEGOTIATION_QUEUE_TIMEOUT] = params.negotiation_queue_timeout
+        self.config[CONST.MAX_SESSIONS] = params.max_sessions
+        self.config[CONST.RETRY_AFTER] = params.retry_after
+        self.config[CONST.WARM_POOL] = max(0, params.warm_pool)
+        self.config[CONST.DATACHANNEL_AUDIO] = params.datachannel_audio
+        self.config[CONST.DTX] = params.dtx
+        self.config[CONST.CODEC_PROFILE] = params.codec_profile
+        self.config[CONST.LATENCY_TARGET_MS] = max(0.0, params.latency_target_ms)
+        self.config[CONST.MAX_SPEED] = params.max_speed
+        self.config[CONST.DRIFT_CORRECTION] = params.drift_correction
+        self.config[CONST.MSG_BUS] = params.msg_bus
+        self.config[CONST.MSG_BUS_RING_KB] = max(1, params.msg_bus_ring_kb)
+        self.config[CONST.EVENT_LOOP] = params.event_loop
+        self.config[CONST.ADMIN_TOKEN] = params.admin_token
+        self.config[CONST.IDLE_TIMEOUT] = params.idle_timeout
+        self.config[CONST.FAILED_TIMEOUT] = params.failed_timeout
+        self.config[CONST.RECORD] = params.record
+        self.config[CONST.RECORD_DIR] = params.record_dir
+        self.config[CONST.RECORD_LAYOUT] = params.record_layout
 
     @staticmethod
-    def set_logger(name: str) -> logging.Logger:
+    def set_logger(name: str, worker_index: int = -1) -> logging.Logger:
         """Configure a logger to report output to log file using the supplied name and a sequence suffix if one already exists
 
         Args:
             name (str): the base name of the log file
+            worker_index (int, optional): suffixes the log file with _w<worker_index> for worker processes. Defaults to -1.
 
         Returns:
             logging.Logger: the logger for logging status
@@ -55,94 +310,56 @@ class webrtcsvr:
         loglevel = "info"
         loglevel = logging.getLevelNamesMapping().get(loglevel.upper(), logging.INFO)
         logname = "webrtcsvr"
+        if worker_index >= 0:
+            logname += f"_w{worker_index}"
         logdir = f"{configdir}{os.sep}logs"
         logfilename = logdir + os.sep + logname + ".log"
+        # flush and close a previous listener's file before its log is replaced
+        webrtcsvr.stop_logging()
         # delete the old log if it exists
         if os.path.exists(logfilename):
             os.remove(logfilename)
 
         _logger = logging.getLogger(logfilename)
+        # callers only enqueue records, the listener thread formats and writes them
+        file_handler = logging.FileHandler(logfilename, encoding="utf-8")
+        file_handler.setFormatter(
+            logging.Formatter(
+                "%(levelname)s %(asctime)s %(filename)s:%(funcName)s:%(lineno)d: %(message)s"
+            )
+        )
+        log_queue = queue.Queue(maxsize=CONST.LOG_QUEUE_SIZE)
+        webrtcsvr.log_listener = logging.handlers.QueueListener(
+            log_queue, file_handler, respect_handler_level=True
+        )
         logging.basicConfig(
-            filename=logfilename,
-            encoding="utf-8",
-            format="%(levelname)s %(asctime)s %(filename)s:%(funcName)s:%(lineno)d: %(message)s",
+            handlers=[nonblocking_queue_handler(log_queue)],
             level=loglevel,
             force=True,
         )  # level=logging.INFO)
+        webrtcsvr.log_listener.start()
+        # registered once however often the logger is configured
+        atexit.unregister(webrtcsvr.stop_logging)
+        atexit.register(webrtcsvr.stop_logging)
+
+        # per-frame messages are debug records, sampled so their volume stays bounded
+        frame_logger = logging.getLogger(CONST.FRAME_LOGGER_NAME)
+        frame_logger.setLevel(logging.DEBUG)
+        for log_filter in list(frame_logger.filters):
+            frame_logger.removeFilter(log_filter)
+        frame_logger.addFilter(sampling_filter(CONST.FRAME_LOG_SAMPLE_EVERY))
         print(f"\nLogging to {logfilename} with {_logger}\n")
 
         return _logger
 
-    async def client_input_handler(self):
-        """Solicit input from the client via webrtc"""
-        try:
-            self.conv_id = "conv_" + uuid.uuid4().hex
-            self.initialize_conv_data(self.conv_id)
-
-            # for comms with webrtcsvr_tts_audio_playback_thread
-            self.config[CONST.AUDIO_MESSAGE_QUEUE] = queue.Queue()
-
-            # Event to signal that playback of the current response has started
-            self.audio_playback_started_event = threading.Event()
-            # Event to signal that playback of the current response is complete
-            self.audio_playback_complete_event = threading.Event()
-
-            # start up client_web_audio_playback
-            self.client_web_audio_playback = client_web_audio_playback(
-                self.conv_id,
-                self.conv_data[self.conv_id],
-                self.audio_playback_started_event,
-                self.audio_playback_complete_event,
-                self.config,
-                asyncio.get_event_loop(),
-                self.logger,
-            )
-            self.web_audio_playback_thread = self.client_web_audio_playback.start_web_playback_thread(
-                self.output_index, self.conv_data[self.conv_id].get(CONST.WEB_RTC_PLAYBACK_AUDIO_TRACK)  # type: ignore self.output_index is set in get_params
-            )
-            self.logger.info(
-                f"Client web audio playback thread started: {self.web_audio_playback_thread.is_alive()}"
-            )
-
-            # semaphore to know we are connected
-            self.conv_data[self.conv_id][
-                CONST.CLIENT_WEB_RTC_CONNECTED
-            ] = asyncio.Event()
-            self.conv_data[self.conv_id][CONST.CLIENT_WEB_RTC_CONNECTED].clear()
-
-            tasks = []
-            async with asyncio.TaskGroup() as tg:  # NOSONAR
-                web_svr_task = tg.create_task(
-                    self.start_webrtc_server("localhost", 8910, tasks)
-                )
-                tasks.append(web_svr_task)
-
-                # wait until the client connects
-                self.logger.info("Waiting for the client connection.")
-                await self.conv_data[self.conv_id][
-                    CONST.CLIENT_WEB_RTC_CONNECTED
-                ].wait()
-
-        except KeyboardInterrupt:
-            self.logger.info("KeyboardInterrupt")
-            print(CONST.TEXT_SHUTTING_DOWN)
-            if _INFO:
-                traceback.print_exc()
-            self.exit = True
-        except ExceptionGroup as egrp:
-            self.logger.error(f"ExceptionGroup error occurred: {egrp}", exc_info=True)
-        except asyncio.CancelledError:  # NOSONAR
-            self.logger.info("CancelledError")
-        except Exception as e:
-            # Handle any unexpected errors
-            self.exit = True
-            self.logger.error(f"An error occurred: {e}", exc_info=True)
-        finally:
-            # shutdown the audio playback
-            if hasattr(self, "client_web_audio_playback") and hasattr(
-                self, "playback_thread"
-            ):
-                self.client_web_audio_playback.stop_web_playback_thread()
+    @staticmethod
+    def stop_logging():
+        """Flushes queued log records to the log file, stops the listener thread and closes its file"""
+        if webrtcsvr.log_listener is not None:
+            webrtcsvr.log_listener.stop()
+            for handler in webrtcsvr.log_listener.handlers:
+                handler.close()
+            webrtcsvr.log_listener = None
 
     def initialize_conv_data(self, conv_id: str) -> dict:
         """Creates/resets conversation data depending on whether a conv_id is supplied. If no conv_id is specified, an empty conv_data
@@ -161,81 +378,565 @@ class webrtcsvr:
             ret_obj = self.conv_data.get(conv_id, {})
             self.conv_data[conv_id] = {}
             # ensure we have accumulators for output audio data used for aec
-            self.conv_data[conv_id][CONST.PLAYBACK_AUDIO_BUFFER] = shared_bytearray()
+            if self.config.get(CONST.MSG_BUS, ""):
+                # filled directly by producer processes attached through the msg_bus
+                self.conv_data[conv_id][CONST.PLAYBACK_AUDIO_BUFFER] = shared_ring(
+                    self.config[CONST.MSG_BUS_RING_KB] * 1024
+                )
+            else:
+                self.conv_data[conv_id][CONST.PLAYBACK_AUDIO_BUFFER] = shared_bytearray()
+            # per stage latency histograms for this conversation's audio
+            self.conv_data[conv_id][CONST.FRAME_TIMING] = frame_timing()
+            # counters reported by /metrics and /sessions
+            self.conv_data[conv_id][CONST.SESSION_METRICS] = session_metrics()
+            # stage captures, off unless --capture or switched on through /capture
+            capture = capture_session(capture_writer.get_writer(self.config, self.logger), conv_id)
+            if self.config.get(CONST.CAPTURE, False):
+                capture.start()
+            self.conv_data[conv_id][CONST.CAPTURE_SESSION] = capture
+            # set once the peer connection is connected
+            self.conv_data[conv_id][CONST.CLIENT_WEB_RTC_CONNECTED] = asyncio.Event()
         return ret_obj
 
     async def on_shutdown(self, app_svr):
         # close peer connections
-        if self.pc is not None:
-            await self.pc.close()
-
-    async def index(self, _request):
-        async with aiofiles.open(
-            os.path.join(self.ROOT, "index.html"), mode="r"
-        ) as handle:
-            content = await handle.read()
-            return web.Response(content_type="text/html", text=content)
-
-    async def javascript(self, _request):
-        async with aiofiles.open(
-            os.path.join(self.ROOT, "webclient.js"), mode="r"
-        ) as handle:
-            content = await handle.read()
-            return web.Response(content_type="application/javascript", text=content)
+        for pc in list(self.pcs):
+            await pc.close()
+        self.pcs.clear()
+
+    def get_session_status(self, conv_id: str) -> dict:
+        """Returns the status of a conversation's audio for the /sessions and /metrics routes
+
+        Args:
+            conv_id (str): the conversation identifier
+
+        Returns:
+            dict: buffered and played milliseconds, fifo depth, connection state, counters and frame timing of the
+                conversation
+        """
+        client_conv_data = self.conv_data.get(conv_id, {})
+        pc = client_conv_data.get(CONST.PEER_CONNECTION, None)
+        track = client_conv_data.get(CONST.WEB_RTC_PLAYBACK_AUDIO_TRACK, None)
+        metrics = client_conv_data.get(CONST.SESSION_METRICS, None)
+        timing = client_conv_data.get(CONST.FRAME_TIMING, None)
+        capture = client_conv_data.get(CONST.CAPTURE_SESSION, None)
+        recorder = client_conv_data.get(CONST.CALL_RECORDER, None)
+        buffer = client_conv_data.get(CONST.PLAYBACK_AUDIO_BUFFER, None)
+        played_ms = 0.0
+        if track is not None:
+            buffered_ms = track.buffered_ms()
+            fifo_depth = track.fifo_depth()
+            played_ms = track.played_samples / track.rate * 1000.0
+        else:
+            buffered_ms = (
+                len(buffer) / 2 / CONST.TTS_AUDIO_SAMPLE_RATE * 1000.0 if buffer else 0.0
+            )
+            fifo_depth = 0
+        return {
+            "conv_id": conv_id,
+            "connection_state": pc.connectionState if pc is not None else "new",
+            "codec": client_conv_data.get(CONST.CODEC, None),
+            "buffered_ms": round(buffered_ms, 3),
+            "fifo_depth": fifo_depth,
+            "played_ms": round(played_ms, 3),
+            "clock_drift": track.drift.status() if track is not None and track.drift is not None else {},
+            "counters": metrics.snapshot() if metrics is not None else {},
+            "frame_timing": timing.summary() if timing is not None else {},
+            "capture": capture.status() if capture is not None else {},
+            "recording": recorder.status() if recorder is not None else {},
+        }
+
+    def collect_metrics(self) -> list:
+        """Gathers the metric families reported by the /metrics route
+
+        Returns:
+            list: tuples of (name, type, help, samples) as expected by prometheus_text
+        """
+        states = {}
+        for pc in self.pcs:
+            states[pc.connectionState] = states.get(pc.connectionState, 0) + 1
+        statuses = [self.get_session_status(conv_id) for conv_id in list(self.conv_data)]
+        families = [
+            (
+                "webrtcsvr_peer_connections",
+                "gauge",
+                "Peer connections by connection state",
+                [({"state": state}, count) for state, count in states.items()],
+            ),
+            (
+                "webrtcsvr_sessions",
+                "gauge",
+                "Conversations currently held by the server",
+                [({}, len(statuses))],
+            ),
+            (
+                "webrtcsvr_session_buffered_ms",
+                "gauge",
+                "Milliseconds of audio waiting in the playback buffer and AudioFifo",
+                [({"session": st["conv_id"]}, st["buffered_ms"]) for st in statuses],
+            ),
+            (
+                "webrtcsvr_session_fifo_depth_samples",
+                "gauge",
+                "Samples waiting in the AudioFifo",
+                [({"session": st["conv_id"]}, st["fifo_depth"]) for st in statuses],
+            ),
+            (
+                "webrtcsvr_session_drift_correction_ppm",
+                "gauge",
+                "Resampling applied to hold the buffered depth against clock drift, in parts per million",
+                [
+                    ({"session": st["conv_id"]}, st["clock_drift"]["correction_ppm"])
+                    for st in statuses
+                    if st["clock_drift"]
+                ],
+            ),
+        ]
+        for name, help_text in [
+            (session_metrics.FRAMES_SENT, "Audio frames returned by recv()"),
+            (session_metrics.SILENCE_FRAMES_SENT, "Silence frames returned by recv()"),
+            (session_metrics.LATE_FRAMES, "Frames returned later than their pacing deadline"),
+            (session_metrics.UNDERRUNS, "Times recv() found the AudioFifo empty during playback"),
+            (session_metrics.RESAMPLE_NS, "Nanoseconds spent resampling to 48 kHz stereo"),
+            (session_metrics.DTX_SUPPRESSED_FRAMES, "Silence frames not sent because dtx suppressed them"),
+            (session_metrics.CATCHUP_BLOCKS, "Blocks the producer built in multi-block catch-up passes"),
+            (session_metrics.STRETCH_SAVED_NS, "Nanoseconds of playing time removed by time stretching"),
+        ]:
+            families.append(
+                (
+                    f"webrtcsvr_{name}_total",
+                    "counter",
+                    help_text,
+                    [
+                        ({"session": st["conv_id"]}, st["counters"].get(name, 0))
+                        for st in statuses
+                    ],
+                )
+            )
+        if self.negotiations is not None:
+            negotiation = self.negotiations.summary()
+            families.append(
+                (
+                    "webrtcsvr_offers_total",
+                    "counter",
+                    "Offers by admission outcome",
+                    [({"outcome": name}, count) for name, count in negotiation["outcomes"].items()],
+                )
+            )
+            families.append(
+                (
+                    "webrtcsvr_negotiations",
+                    "gauge",
+                    "Offers being negotiated or waiting for a negotiation slot",
+                    [
+                        ({"state": "in_progress"}, negotiation["in_progress"]),
+                        ({"state": "waiting"}, negotiation["waiting"]),
+                    ],
+                )
+            )
+            families.append(
+                (
+                    "webrtcsvr_negotiation_phase_ms",
+                    "gauge",
+                    "Negotiation phase latency percentiles in milliseconds",
+                    [
+                        ({"phase": phase, "quantile": quantile}, summary[key])
+                        for phase, summary in negotiation["phases"].items()
+                        for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms"))
+                    ],
+                )
+            )
+        if self.warm_pool is not None:
+            pool_status = self.warm_pool.status()
+            families.append(
+                (
+                    "webrtcsvr_warm_pool_ready",
+                    "gauge",
+                    "Prepared peer connections waiting for an offer",
+                    [({}, pool_status["ready"])],
+                )
+            )
+            families.append(
+                (
+                    "webrtcsvr_warm_pool_takes_total",
+                    "counter",
+                    "Offers served from the warm pool (hit) or prepared on demand (miss)",
+                    [
+                        ({"result": "hit"}, pool_status["hits"]),
+                        ({"result": "miss"}, pool_status["misses"]),
+                    ],
+                )
+            )
+        if self.reaper is not None:
+            reaper_status = self.reaper.status()
+            families.append(
+                (
+                    "webrtcsvr_sessions_reaped_total",
+                    "counter",
+                    "Sessions closed by the reaper by reason",
+                    [({"reason": reason}, count) for reason, count in reaper_status["reaped"].items()],
+                )
+            )
+            families.append(
+                (
+                    "webrtcsvr_reaped_threads_total",
+                    "counter",
+                    "Producer and recorder threads stopped by the reaper",
+                    [({}, reaper_status["threads_reclaimed"])],
+                )
+            )
+            families.append(
+                (
+                    "webrtcsvr_reaped_fifo_samples_total",
+                    "counter",
+                    "Samples dropped from the AudioFifo of reaped sessions",
+                    [({}, reaper_status["fifo_samples_reclaimed"])],
+                )
+            )
+            families.append(
+                (
+                    "webrtcsvr_reaped_buffer_bytes_total",
+                    "counter",
+                    "Bytes dropped from the playback buffer of reaped sessions",
+                    [({}, reaper_status["buffer_bytes_reclaimed"])],
+                )
+            )
+        if self.loop_monitor is not None:
+            loop_status = self.loop_monitor.status()
+            families.append(
+                (
+                    "webrtcsvr_event_loop_lag_ms",
+                    "gauge",
+                    "Event loop lag percentiles in milliseconds",
+                    [
+                        ({"loop": loop_status["loop"], "quantile": quantile}, loop_status["lag"][key])
+                        for quantile, key in (
+                            ("0.5", "p50_ms"),
+                            ("0.95", "p95_ms"),
+                            ("0.99", "p99_ms"),
+                            ("1", "max_ms"),
+                        )
+                    ],
+                )
+            )
+            families.append(
+                (
+                    "webrtcsvr_event_loop_stalls_total",
+                    "counter",
+                    "Times the event loop was held for more than 40 ms past its sampling interval",
+                    [({"loop": loop_status["loop"]}, loop_status["stalls"])],
+                )
+            )
+            families.append(
+                (
+                    "webrtcsvr_event_loop_stalled_ms_total",
+                    "counter",
+                    "Milliseconds of event loop lag during stalls",
+                    [({"loop": loop_status["loop"]}, loop_status["stalled_ms"])],
+                )
+            )
+        static_status = self.static_assets.status()
+        families.append(
+            (
+                "webrtcsvr_static_responses_total",
+                "counter",
+                "Static asset responses by result (served with a body or 304 not modified)",
+                [
+                    ({"result": "served"}, static_status["served"]),
+                    ({"result": "not_modified"}, static_status["not_modified"]),
+                ],
+            )
+        )
+        families.append(
+            (
+                "webrtcsvr_static_reloads_total",
+                "counter",
+                "Static assets reloaded after changing on disk",
+                [({}, static_status["reloads"])],
+            )
+        )
+        families.append(
+            (
+                "webrtcsvr_threads",
+                "gauge",
+                "Threads alive in this process",
+                [({}, threading.active_count())],
+            )
+        )
+        families.append(
+            (
+                "webrtcsvr_workers",
+                "gauge",
+                "Server worker processes sharing the port",
+                [({"worker": self.worker_index}, self.config.get(CONST.WORKERS, 1))],
+            )
+        )
+        return families
+
+    async def metrics(self, _request) -> web.Response:
+        return web.Response(
+            content_type="text/plain",
+            charset="utf-8",
+            text=prometheus_text(self.collect_metrics()),
+        )
+
+    async def sessions(self, _request) -> web.Response:
+        return web.json_response(
+            {
+                "sessions": [
+                    self.get_session_status(conv_id) for conv_id in list(self.conv_data)
+                ],
+                "threads": threading.active_count(),
+                "negotiation": (
+                    self.negotiations.summary() if self.negotiations is not None else {}
+                ),
+                "warm_pool": (
+                    self.warm_pool.status() if self.warm_pool is not None else {}
+                ),
+                "reaper": self.reaper.status() if self.reaper is not None else {},
+                "msg_bus": self.msg_bus.status() if self.msg_bus is not None else {},
+                "event_loop": (
+                    self.loop_monitor.status() if self.loop_monitor is not None else {}
+                ),
+            }
+        )
+
+    async def capture(self, request) -> web.Response:
+        """Reports (GET) or switches (POST {"enabled": bool, "conv_id": optional}, admin only) the stage captures of
+        the sessions
+
+        Args:
+            request (web.Request): the request, whose JSON body for a POST selects the state and optionally a session
+
+        Returns:
+            web.Response: JSON with each session's capture status and the writer's totals
+        """
+        if request.method == "POST":
+            if not self.is_admin(request):
+                return web.json_response({"error": "unauthorized"}, status=401)
+            try:
+                params = await request.json()
+            except json.JSONDecodeError:
+                return web.json_response({"error": "expected a JSON body"}, status=400)
+            conv_id = params.get("conv_id", None)
+            if conv_id is not None and conv_id not in self.conv_data:
+                return web.json_response({"error": f"unknown conv_id {conv_id}"}, status=404)
+            for session_id, client_conv_data in list(self.conv_data.items()):
+                capture = client_conv_data.get(CONST.CAPTURE_SESSION, None)
+                if capture is None or (conv_id is not None and session_id != conv_id):
+                    continue
+                if params.get("enabled", False):
+                    capture.start()
+                else:
+                    capture.stop()
+        sessions = {}
+        for session_id, client_conv_data in list(self.conv_data.items()):
+            capture = client_conv_data.get(CONST.CAPTURE_SESSION, None)
+            if capture is not None:
+                sessions[session_id] = capture.status()
+        return web.json_response(
+            {
+                "sessions": sessions,
+                "writer": capture_writer.get_writer(self.config, self.logger).status(),
+            }
+        )
+
+    def is_admin(self, request) -> bool:
+        """Returns True if a request carries the --admin-token as a bearer token
+
+        Args:
+            request (web.Request): the request
+
+        Returns:
+            bool: True if it may use the admin routes, never when no admin token is configured
+        """
+        token = self.config.get(CONST.ADMIN_TOKEN, "")
+        if not token:
+            return False
+        return hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode())
+
+    async def profile(self, request) -> web.Response:
+        """Admin route sampling every thread's stack for a while (GET /profile?seconds=10&interval_ms=10&weight=cpu
+        &format=collapsed), with the --admin-token as a bearer token
+
+        Args:
+            request (web.Request): the request, whose query selects the seconds (up to 60), the sampling interval, the
+                weight (cpu or wall) and the format (collapsed for a flamegraph, or json)
+
+        Returns:
+            web.Response: the collapsed stacks as text, or JSON with each thread's cpu, its top stacks and the
+                collapsed stacks
+        """
+        if not self.is_admin(request):
+            return web.json_response({"error": "unauthorized"}, status=401)
+        try:
+            seconds = float(request.query.get("seconds", "10"))
+            interval_ms = float(request.query.get("interval_ms", str(stack_sampler.DEFAULT_INTERVAL_MS)))
+        except ValueError:
+            return web.json_response({"error": "seconds and interval_ms must be numbers"}, status=400)
+        if not (math.isfinite(seconds) and math.isfinite(interval_ms)):
+            # float() takes "nan" and "inf", which would keep the sampler running and the route busy
+            return web.json_response({"error": "seconds and interval_ms must be finite"}, status=400)
+        weight = request.query.get("weight", stack_sampler.WEIGHT_CPU)
+        output_format = request.query.get("format", "collapsed")
+        if weight not in stack_sampler.WEIGHTS or output_format not in ("collapsed", "json"):
+            return web.json_response({"error": "weight must be cpu or wall, format collapsed or json"}, status=400)
+        if self.profiling:
+            return web.json_response({"error": "a profile is already being taken"}, status=409)
+        self.profiling = True
+        try:
+            self.logger.info(f"Profiling every thread for {seconds} s")
+            sampler = await asyncio.get_running_loop().run_in_executor(
+                None, stack_sampler(interval_ms).run, seconds
+            )
+        finally:
+            self.profiling = False
+        if output_format == "json":
+            summary = sampler.summary()
+            summary["collapsed"] = sampler.collapsed(weight)
+            return web.json_response(summary)
+        return web.Response(
+            content_type="text/plain",
+            charset="utf-8",
+            text=sampler.collapsed(weight),
+            headers={"Content-Disposition": f'attachment; filename="webrtcsvr_{weight}.collapsed"'},
+        )
+
+    async def index(self, request):
+        return self.static_assets.response(request, "index.html")
+
+    async def javascript(self, request):
+        return self.static_assets.response(request, "webclient.js")
+
+    def busy_response(self, reason: str) -> web.Response:
+        """Returns the 503 sent to an offer the server cannot take now
+
+        Args:
+            reason (str): why the offer was turned away
+
+        Returns:
+            web.Response: 503 Service Unavailable with a Retry-After header
+        """
+        self.logger.warning(f"Offer rejected: {reason}")
+        return web.json_response(
+            {"error": reason},
+            status=503,
+            headers={"Retry-After": str(self.negotiations.retry_after)},
+        )
 
     async def offer(self, request) -> web.Response:
+        """Admits an offer through the negotiation_limiter, then negotiates it
+
+        Args:
+            request (web.Request): the POST with the browser's offer
+
+        Returns:
+            web.Response: the answer, or a 503 if the server is draining, full or too busy negotiating
+        """
+        start_ns = time.perf_counter_ns()
+        limiter = self.negotiations
+        if self.draining:
+            limiter.reject_draining()
+            return self.busy_response("server is draining")
+        if limiter.session_limit_reached(self.active_peer_connections()):
+            return self.busy_response("session limit reached")
+        if not await limiter.acquire():
+            return self.busy_response("timed out waiting to negotiate")
+        try:
+            return await self.negotiate(request)
+        finally:
+            limiter.release()
+            limiter.record(negotiation_limiter.TOTAL, start_ns)
+
+    async def negotiate(self, request) -> web.Response:
+        """Creates the peer connection for an offer and returns its answer, timing each phase
+
+        Args:
+            request (web.Request): the POST with the browser's offer
+
+        Returns:
+            web.Response: the answer
+        """
+        limiter = self.negotiations
+        pc = None
+        warm = None
+        conv_id = None
         try:
 
             params = await request.json()
             offer = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
 
-            pc = RTCPeerConnection()
-
-            # there is no audio/pcm16 code but if there was...
-            capabilities = RTCRtpReceiver.getCapabilities("audio")
-            if capabilities is not None:
-                pcm_codecs = []
-                audio_codecs = capabilities.codecs
-                for codec in audio_codecs:
-                    if codec.mimeType == "audio/pcm16":
-                        pcm_codecs.append(codec)
-
-                audio_transceivers = pc.getTransceivers()
-                if audio_transceivers:
-                    audio_transceiver = audio_transceivers[
-                        0
-                    ]  # Adjust index based on your setup
-                    if hasattr(audio_transceiver, "setCodecPreferences") and pcm_codecs:
-                        audio_transceiver.setCodecPreferences(pcm_codecs)
+            # checked again now the slot is held: offers admitted together all passed the check in offer(), and with
+            # no await from here to pcs.add each one counts the peer connections of those negotiated before it
+            if limiter.session_limit_reached(self.active_peer_connections()):
+                return self.busy_response("session limit reached")
+            phase_ns = time.perf_counter_ns()
+            if self.warm_pool is not None:
+                warm = self.warm_pool.take()
+            pc = warm.pc if warm is not None else RTCPeerConnection()
+            phase_ns = limiter.record(negotiation_limiter.CREATE_PC, phase_ns)
+            self.pcs.add(pc)
+            # each offer is a new conversation, the server keeps running when it ends
+            conv_id = conversation.new_conv_id()
+            self.initialize_conv_data(conv_id)
+            client_conv_data = self.conv_data[conv_id]
+            client_conv_data[CONST.PEER_CONNECTION] = pc
+            conv = conversation(
+                client_conv_data, conv_id, self.config, asyncio.get_running_loop(), self.logger
+            )
+            self.conversations[conv_id] = conv
 
             pc_id = "PeerConnection(%s)" % uuid.uuid4()
-            self.pc = pc
-            self.logger.info(f"{pc_id} created for remote {request.remote}")
+            self.logger.info(f"{pc_id} created for {conv_id} of remote {request.remote}")
+            activity = session_activity(conv_id, pc, client_conv_data)
+            self.reaper.register(activity)
 
             @pc.on("datachannel")
             def on_datachannel(channel):
 
-                self.conv_data[self.conv_id]["chat_data_channel"] = channel
+                client_conv_data["chat_data_channel"] = channel
                 self.logger.info("Connected the datachannel")
 
                 @channel.on("message")
                 def on_message(message):
+                    activity.touch(session_reaper.SOURCE_DATA_CHANNEL)
                     if isinstance(message, str) and message.startswith("ping"):
                         channel.send("pong" + message[4:])
+                    elif isinstance(message, str) and message.startswith(
+                        datachannel_audio.COMMAND_PREFIX
+                    ):
+                        self.set_datachannel_audio(
+                            activity,
+                            channel,
+                            message[len(datachannel_audio.COMMAND_PREFIX) :].strip(),
+                        )
 
                 @channel.on("error")
                 async def on_chat_error(error):
                     self.logger.error(f"Chat data channel error: {error}")
 
+            @pc.on("iceconnectionstatechange")
+            def on_iceconnectionstatechange():
+                activity.touch(session_reaper.SOURCE_STATE)
+
             @pc.on("connectionstatechange")
             async def on_connectionstatechange():
                 self.logger.info(f"{pc_id} Connection state is {pc.connectionState}")
+                activity.touch(session_reaper.SOURCE_STATE)
                 if pc.connectionState == "connected":
                     self.logger.info("Offer is complete. We are connected.")
-                    self.conv_data[self.conv_id][CONST.CLIENT_WEB_RTC_CONNECTED].set()
+                    client_conv_data[CONST.CLIENT_WEB_RTC_CONNECTED].set()
                 elif pc.connectionState == "failed":
                     await pc.close()
-                    self.pc = None
+                    self.pcs.discard(pc)
+                    webrtcsvr.stop_recording(client_conv_data)
+                    if warm is not None:
+                        warm.discard()
+                elif pc.connectionState == "closed":
+                    self.pcs.discard(pc)
+                    webrtcsvr.stop_recording(client_conv_data)
+                    if warm is not None:
+                        warm.discard()
 
             @pc.on("track")
             def on_track(track):
@@ -243,27 +944,78 @@ class webrtcsvr:
                     self.logger.info(f"{pc_id} Track {track.kind} received")
 
                     if track.kind == "audio":
+                        offload_mode = self.config.get(
+                            CONST.OFFLOAD, frame_build_pool.MODE_NONE
+                        )
+                        # the offer has been matched, so the profile reorders what the answer will offer
+                        codec = codec_profiles.apply(
+                            webrtcsvr.get_transceiver(pc, track),
+                            self.config.get(CONST.CODEC_PROFILE, codec_profiles.PROFILE_BROWSER),
+                        )
+                        client_conv_data[CONST.CODEC] = codec
+                        rate, channels, frames_per_buffer = codec_profiles.output_format(codec)
+                        if rate != CONST.WEB_RTC_AUDIO_SAMPLE_RATE:
+                            # the frame_build_pool builds 48 kHz stereo, this resamples straight to the codec's rate
+                            if offload_mode != frame_build_pool.MODE_NONE:
+                                self.logger.info(
+                                    f"{pc_id} negotiated {codec}, building {rate} Hz frames without offloading."
+                                )
+                            offload_mode = frame_build_pool.MODE_NONE
+                        elif (
+                            offload_mode == frame_build_pool.MODE_ENCODE
+                            and codec != "audio/opus"
+                        ):
+                            # pre-encoded packets are Opus, let the sender encode anything else
+                            self.logger.info(
+                                f"{pc_id} negotiated {codec}, offloading frames only."
+                            )
+                            offload_mode = frame_build_pool.MODE_FRAMES
+
+                        recorder = None
+                        if (
+                            self.config.get(CONST.RECORD, call_recorder.FORMAT_NONE)
+                            != call_recorder.FORMAT_NONE
+                        ):
+                            recorder = call_recorder(
+                                self.config[CONST.RECORD_DIR],
+                                conv_id,
+                                self.config[CONST.RECORD],
+                                self.config[CONST.RECORD_LAYOUT],
+                                self.logger,
+                            )
+                            activity.recorder = recorder
+                            client_conv_data[CONST.CALL_RECORDER] = recorder
+                        # read the browser's audio so it is recorded (and not left queued in the receiver)
+                        input_track = audio_input_track(track, recorder)
+                        activity.input_track = input_track
+                        client_conv_data[CONST.WEB_RTC_INPUT_AUDIO_TRACK] = input_track
+                        asyncio.ensure_future(self.consume_input_track(input_track))
+
+                        # the track owns the prepared frame_build_pool session from here on
+                        frame_builder = None
+                        if warm is not None:
+                            frame_builder, warm.frame_builder = warm.frame_builder, None
 
                         # open the track to playback output
                         output_track = audio_output_track(
                             self.config,
-                            self.conv_data[self.conv_id],
+                            client_conv_data,
                             asyncio.get_event_loop(),
                             self.logger,
-                            frames_per_buffer=CONST.OPUS_FRAMES_PER_BUFFER,
-                            channels=CONST.AUDIO_CHANNELS_STEREO,
-                            rate=CONST.WEB_RTC_AUDIO_SAMPLE_RATE,
+                            frames_per_buffer=frames_per_buffer,
+                            channels=channels,
+                            rate=rate,
                             output=True,
                             start=False,
+                            offload_mode=offload_mode,
+                            frame_builder=frame_builder,
+                            dtx=self.config.get(CONST.DTX, False),
                         )
-                        self.conv_data[self.conv_id][
-                            CONST.WEB_RTC_PLAYBACK_AUDIO_TRACK
-                        ] = output_track
-                        pc.addTrack(
-                            self.conv_data[self.conv_id][
-                                CONST.WEB_RTC_PLAYBACK_AUDIO_TRACK
-                            ]
-                        )
+                        client_conv_data[CONST.WEB_RTC_PLAYBACK_AUDIO_TRACK] = output_track
+                        sender = pc.addTrack(output_track)
+                        output_track.attach_sender(sender)
+                        output_track.datachannel_audio = activity.datachannel_audio
+                        activity.output_track = output_track
 
                         self.logger.info(
                             f"{pc_id} audio_output_track opened but not started."
@@ -277,18 +1029,27 @@ class webrtcsvr:
                     traceback.print_exc()
 
             # handle offer
+            phase_ns = time.perf_counter_ns()
             await pc.setRemoteDescription(offer)
+            phase_ns = limiter.record(negotiation_limiter.SET_REMOTE, phase_ns)
 
             # send answer
             answer = await pc.createAnswer()
-            await pc.setLocalDescription(answer)
+            phase_ns = limiter.record(negotiation_limiter.CREATE_ANSWER, phase_ns)
+            await pc.setLocalDescription(answer)  # gathers the ICE candidates
+            limiter.record(negotiation_limiter.SET_LOCAL, phase_ns)
+
+            # the output track was created by on_track while the offer was applied
+            conv.start(activity, self.output_index)
 
             self.logger.info(
                 f"{pc_id} Returning sdp with type: {pc.localDescription.type}"
             )
-            rsptext = json.dumps(
-                {"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}
-            )
+            reply = {"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}
+            if self.msg_bus is not None:
+                # tells a msg_bus producer which conversation to attach to
+                reply["conv_id"] = conv_id
+            rsptext = json.dumps(reply)
             # print(rsptext)
             response = web.Response(
                 content_type="application/json",
@@ -297,17 +1058,218 @@ class webrtcsvr:
             return response
         except Exception as e:
             traceback.print_exc()
+            if pc is not None:
+                # do not let a failed negotiation hold a session slot
+                await pc.close()
+                self.pcs.discard(pc)
+            if warm is not None:
+                warm.discard()
+            if conv_id is not None:
+                self.reaper.unregister(conv_id)
+                self.close_conversation(conv_id)
             raise e
 
-    async def start_webrtc_server(self, host: str, port: int, tasks):
+    async def consume_input_track(self, input_track: audio_input_track):
+        """Reads the browser's audio until its track ends
+
+        Args:
+            input_track (audio_input_track): the wrapped remote track
+        """
+        try:
+            while True:
+                await input_track.recv()
+        except MediaStreamError:
+            self.logger.info("Input track ended.")
+
+    def set_datachannel_audio(self, activity: session_activity, channel, audio_format: str):
+        """Starts or stops sending a session's audio over its data channel, replying with the format now in use
+
+        Args:
+            activity (session_activity): the session
+            channel (RTCDataChannel): the channel the command arrived on
+            audio_format (str): one of datachannel_audio.FORMATS
+        """
+        if (
+            not self.config.get(CONST.DATACHANNEL_AUDIO, False)
+            or audio_format not in datachannel_audio.FORMATS
+        ):
+            channel.send(datachannel_audio.COMMAND_PREFIX + "unavailable")
+            return
+        sender = None
+        if audio_format != datachannel_audio.FORMAT_OFF:
+            sender = datachannel_audio(channel, audio_format, self.logger)
+        activity.datachannel_audio = sender
+        if activity.output_track is not None:
+            activity.output_track.datachannel_audio = sender
+        self.logger.info(f"{activity.session_id} data channel audio is {audio_format}.")
+        channel.send(datachannel_audio.COMMAND_PREFIX + audio_format)
+
+    async def reap_sessions(self):
+        """Reaper task: closes the sessions the session_reaper finds idle, failed or closed"""
+        while True:
+            await asyncio.sleep(session_reaper.CHECK_SECONDS)
+            for activity, reason in self.reaper.find():
+                try:
+                    await self.close_session(activity, reason)
+                except Exception:
+                    self.logger.exception(f"Error reaping {activity.session_id}")
+
+    async def close_session(self, activity: session_activity, reason: str):
+        """Closes a session's peer connection and releases its producer thread, recorder and buffered audio
+
+        Args:
+            activity (session_activity): the session
+            reason (str): why it is being closed (one of session_reaper.REASONS)
+        """
+        self.reaper.unregister(activity.session_id)
+        loop = asyncio.get_running_loop()
+        pc = activity.pc
+        if pc.connectionState != "closed":
+            await pc.close()
+        self.pcs.discard(pc)
+        threads = 0
+        fifo_samples = 0
+        buffer_bytes = 0
+        client_conv_data = activity.client_conv_data
+        recorder = activity.recorder
+        if recorder is not None:
+            recorder.close()
+            await loop.run_in_executor(None, recorder.join)
+            threads += int(not recorder.thread.is_alive())
+        track = activity.output_track
+        if track is not None:
+            stopped, fifo_samples = await loop.run_in_executor(None, track.release)
+            threads += int(stopped)
+            if client_conv_data.get(CONST.WEB_RTC_PLAYBACK_AUDIO_TRACK, None) is track:
+                # the conversation's current session, so its queued audio has nowhere to go
+                client_conv_data.pop(CONST.WEB_RTC_PLAYBACK_AUDIO_TRACK, None)
+                client_conv_data.pop(CONST.WEB_RTC_INPUT_AUDIO_TRACK, None)
+                buffer = client_conv_data.get(CONST.PLAYBACK_AUDIO_BUFFER, None)
+                if buffer is not None:
+                    buffer_bytes = len(buffer)
+                    buffer.clear()
+        await loop.run_in_executor(None, self.close_conversation, activity.session_id)
+        self.reaper.reclaimed(reason, threads, fifo_samples, buffer_bytes)
+        self.logger.info(
+            f"Reaped {activity.session_id} ({reason}, idle {activity.status()['idle_seconds']} s): "
+            f"{threads} threads, {fifo_samples} fifo samples and {buffer_bytes} buffer bytes released."
+        )
+
+    def attach_producer(self, conv_id: str) -> tuple | None:
+        """Returns where a msg_bus producer sends a conversation's messages and audio. Called from the bus's threads.
+
+        Args:
+            conv_id (str): the conversation identifier
+
+        Returns:
+            tuple | None: the conversation's (audio_playback_queue, shared_ring), None if it is unknown
+        """
+        conv = self.conversations.get(conv_id, None)
+        if conv is None or conv.closed:
+            return None
+        ring = self.conv_data.get(conv_id, {}).get(CONST.PLAYBACK_AUDIO_BUFFER, None)
+        if not isinstance(ring, shared_ring):
+            return None
+        return conv.playback.audio_playback_queue, ring
+
+    def close_conversation(self, conv_id: str):
+        """Stops a conversation's playback thread and captures and forgets its data
+
+        Args:
+            conv_id (str): the conversation identifier
+        """
+        conv = self.conversations.pop(conv_id, None)
+        if conv is not None:
+            conv.close()
+        self.conv_data.pop(conv_id, None)
+
+    @staticmethod
+    def stop_recording(client_conv_data: dict):
+        """Finishes a conversation's call recording if it has one
+
+        Args:
+            client_conv_data (dict): the conversation's data
+        """
+        recorder = client_conv_data.get(CONST.CALL_RECORDER, None)
+        if recorder is not None:
+            recorder.close()
+
+    @staticmethod
+    def get_transceiver(pc: RTCPeerConnection, track) -> RTCRtpTransceiver | None:
+        """Returns the transceiver receiving the track, which also sends the audio played back
+
+        Args:
+            pc (RTCPeerConnection): the peer connection
+            track (MediaStreamTrack): the remote track reported by the track event
+
+        Returns:
+            RTCRtpTransceiver | None: the transceiver, or None if it is not one of the peer connection's
+        """
+        for transceiver in pc.getTransceivers():
+            if transceiver.receiver.track is track:
+                return transceiver
+        return None
+
+    async def start_webrtc_server(self, host: str, port: int):
         """Listens for webrtc connections from a browers that it starts and establishes a peer connection
-        to receive audio from the browser, and send audio for playback
+        to receive audio from the browser, and send audio for playback. The app and its listening socket are created
+        once and serve every conversation until stop() is called.
 
         Args:
-            tasks (list): the list of tasks being managed
+            host (str): host name or address to listen on
+            port (int): port to listen on
         """
         runner = None
         try:
+            if self.negotiations is None:
+                self.negotiations = negotiation_limiter(
+                    self.config.get(CONST.MAX_NEGOTIATIONS, CONST.DEFAULT_MAX_NEGOTIATIONS),
+                    self.config.get(
+                        CONST.NEGOTIATION_QUEUE_TIMEOUT,
+                        CONST.DEFAULT_NEGOTIATION_QUEUE_TIMEOUT_SECONDS,
+                    ),
+                    self.config.get(CONST.MAX_SESSIONS, 0),
+                    self.config.get(CONST.RETRY_AFTER, CONST.DEFAULT_RETRY_AFTER_SECONDS),
+                )
+            if self.warm_pool is None and self.config.get(CONST.WARM_POOL, 0) > 0:
+                self.warm_pool = warm_pool(self.config, self.config[CONST.WARM_POOL], self.logger)
+                self.warm_pool.start()
+            if (
+                self.config.get(CONST.OFFLOAD, frame_build_pool.MODE_NONE)
+                != frame_build_pool.MODE_NONE
+            ):
+                # start the pool's processes and wait for them before accepting offers, so the first sessions do not
+                # wait seconds for their first audio while the workers spawn and import av
+                warming = frame_build_pool.get_pool(
+                    self.config.get(CONST.OFFLOAD_WORKERS, 0)
+                ).warm_up()
+                try:
+                    await asyncio.wait_for(
+                        asyncio.gather(*[asyncio.wrap_future(future) for future in warming]),
+                        CONST.OFFLOAD_WARM_UP_TIMEOUT_SECONDS,
+                    )
+                    self.logger.info(f"frame_build_pool started {len(warming)} worker processes")
+                except (ImportError, RuntimeError, TimeoutError) as e:
+                    # sessions still start, their first blocks wait for (or fail on) the workers
+                    self.logger.warning(f"frame_build_pool workers were not ready: {e!r}")
+            if self.reaper is None:
+                # closes each conversation with its session (and idle sessions unless --idle-timeout is 0)
+                self.reaper = session_reaper(
+                    self.config.get(CONST.IDLE_TIMEOUT, CONST.DEFAULT_IDLE_TIMEOUT_SECONDS),
+                    self.config.get(CONST.FAILED_TIMEOUT, CONST.DEFAULT_FAILED_TIMEOUT_SECONDS),
+                    self.logger,
+                )
+                self.reaper_task = asyncio.ensure_future(self.reap_sessions())
+            if self.loop_monitor is None:
+                # lag of the loop every session's recv() shares, and the code that stalled it
+                self.loop_monitor = loop_monitor(self.logger)
+                self.loop_monitor.start()
+            if self.msg_bus is None and self.config.get(CONST.MSG_BUS, ""):
+                address = self.config[CONST.MSG_BUS]
+                if self.worker_index >= 0:
+                    address += f"_w{self.worker_index}"
+                self.msg_bus = msg_bus(address, self.attach_producer, self.logger)
+                self.msg_bus.start()
             self.app_svr = web.Application()
             self.app_svr.on_shutdown.append(
                 self.on_shutdown
@@ -315,21 +1277,46 @@ class webrtcsvr:
             self.app_svr.router.add_get("/", self.index)
             self.app_svr.router.add_get("/webclient.js", self.javascript)
             self.app_svr.router.add_post("/offer", self.offer)
+            self.app_svr.router.add_get("/metrics", self.metrics)
+            self.app_svr.router.add_get("/sessions", self.sessions)
+            self.app_svr.router.add_get("/capture", self.capture)
+            if self.config.get(CONST.ADMIN_TOKEN, ""):
+                # admin routes, which need the token
+                self.app_svr.router.add_post("/capture", self.capture)
+                self.app_svr.router.add_get("/profile", self.profile)
             runner = web.AppRunner(self.app_svr)
             await runner.setup()
-            site = web.TCPSite(runner, host=host, port=port)
+            # workers share the listening port and the kernel spreads connections across them
+            site = web.TCPSite(
+                runner,
+                host=host,
+                port=port,
+                reuse_port=self.config.get(CONST.WORKERS, 1) > 1,
+            )
 
             await site.start()
             self.logger.info(f"Web Server started on host {host} port {port}")
-            print(
-                "Please open a browser to http://localhost:8910 (or refresh the page if open) to begin the test."
-            )
+            try:
+                loop = asyncio.get_running_loop()
+                loop.add_signal_handler(
+                    signal.SIGTERM, lambda: asyncio.ensure_future(self.drain(site))
+                )
+                if self.worker_index < 0:
+                    # workers ignore Ctrl+C and are drained by the supervisor's SIGTERM
+                    loop.add_signal_handler(signal.SIGINT, self.stop)
+            except NotImplementedError:
+                # no loop signal handlers on this platform
+                pass
+            if self.worker_index < 0:
+                print(
+                    f"Please open a browser to http://{host}:{port} (or refresh the page if open) to begin the test."
+                )
             # # if desired, uncomment below to start a browser session
             # import webbrowser
-            # webbrowser.open_new_tab("http://localhost:8910")
+            # webbrowser.open_new_tab(f"http://{host}:{port}")
 
-            # Keep the server running until cancelled
-            await asyncio.Future()
+            # Keep the server running until stopped
+            await self.stopped.wait()
             self.logger.info("Web Server has ended")
         except KeyboardInterrupt:
             self.exit = True
@@ -346,23 +1333,90 @@ class webrtcsvr:
             if runner:
                 await runner.cleanup()
             print("aiohttp server shut down.")
-            for task in tasks:
-                if task == asyncio.current_task():
-                    # close others first
-                    continue
-                if task.done():
-                    # already closed
-                    continue
-                task.cancel()
-            self.logger.info(f"web server task for {self.conv_id} closed.")
+            self.logger.info("web server closed.")
             self.exit = True
 
+    def stop(self):
+        """Ends the web server, after which do_work shuts down"""
+        self.exit = True
+        self.stopped.set()
+
+    def active_peer_connections(self) -> int:
+        """Returns the number of peer connections that have not closed or failed
+
+        Returns:
+            int: the number of live peer connections
+        """
+        return len(
+            [pc for pc in self.pcs if pc.connectionState not in ("closed", "failed")]
+        )
+
+    async def drain(self, site: web.TCPSite):
+        """Stops accepting connections, waits up to the drain timeout for this process's sessions to end, then exits
+
+        Args:
+            site (web.TCPSite): the listening site to be stopped
+        """
+        if self.draining:
+            return
+        self.draining = True
+        self.exit = True
+        self.logger.info(
+            f"Draining {self.active_peer_connections()} peer connections before exiting."
+        )
+        await site.stop()
+        deadline = time.monotonic() + self.config.get(
+            CONST.DRAIN_TIMEOUT, CONST.DEFAULT_DRAIN_TIMEOUT_SECONDS
+        )
+        while self.active_peer_connections() > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+        self.logger.info(
+            f"Drain finished with {self.active_peer_connections()} peer connections open."
+        )
+        self.stop()
+
+    def stop_captures(self):
+        """Finishes the capture files of every conversation"""
+        for client_conv_data in list(self.conv_data.values()):
+            capture = client_conv_data.get(CONST.CAPTURE_SESSION, None)
+            if capture is not None:
+                capture.stop()
+
     def clean_shutdown(self):
         """Ensure a clean shutdown of playback thread and WebSocket connection."""
         self.logger.info("clean_shutdown requested")
         # tts done at server
-        if hasattr(self, "client_web_audio_playback"):
-            self.client_web_audio_playback.stop_web_playback_thread()
+        for conv in list(self.conversations.values()):
+            conv.playback.stop_web_playback_thread()
+        # release the output tracks' frame producer threads
+        for client_conv_data in list(self.conv_data.values()):
+            track = client_conv_data.get(CONST.WEB_RTC_PLAYBACK_AUDIO_TRACK, None)
+            if track is not None and not track.is_stopped():
+                track.close()
+        self.stop_captures()
+        for client_conv_data in list(self.conv_data.values()):
+            webrtcsvr.stop_recording(client_conv_data)
+            recorder = client_conv_data.get(CONST.CALL_RECORDER, None)
+            if recorder is not None:
+                recorder.join()
+        if self.warm_pool is not None:
+            self.warm_pool.close()
+            self.warm_pool = None
+        if self.reaper_task is not None:
+            self.reaper_task.cancel()
+            self.reaper_task = None
+        if self.msg_bus is not None:
+            self.msg_bus.close()
+            self.msg_bus = None
+        if self.loop_monitor is not None:
+            self.loop_monitor.close()
+            self.loop_monitor = None
+        for client_conv_data in list(self.conv_data.values()):
+            buffer = client_conv_data.get(CONST.PLAYBACK_AUDIO_BUFFER, None)
+            if isinstance(buffer, shared_ring):
+                buffer.close()
+        frame_build_pool.shutdown_pool()
+        capture_writer.shutdown_writer()
 
         self.logger.info("All audio playback has been processed.")
         self.logger.info("Audio playback finished.")
@@ -370,13 +1424,9 @@ class webrtcsvr:
     async def do_work(self):
         """The main processing loop"""
         try:
-            while not self.exit:
-                # process client requests
-                await self.client_input_handler()
-                self.logger.info(f"self.exit={self.exit}")
-                if not self.exit:
-                    # reinitialize client data and try again
-                    self.conv_data = {}
+            # serves every conversation until stopped
+            await self.start_webrtc_server(self.config[CONST.HOST], self.config[CONST.PORT])
+            self.logger.info(f"self.exit={self.exit}")
             self.clean_shutdown()
         except (
             KeyboardInterrupt
@@ -396,6 +1446,8 @@ class webrtcsvr:
             args (list): _description_
         """
         try:
+            if not pgm.config:
+                pgm.get_params(args)
             await pgm.do_work()
         except KeyboardInterrupt:
             print(CONST.TEXT_SHUTTING_DOWN)
@@ -415,7 +1467,11 @@ if __name__ == "__main__":
     """The main entry point for running the webrtcsvr"""
     pgm = webrtcsvr()
     try:
-        asyncio.run(pgm.main(pgm, sys.argv))
+        pgm.get_params(sys.argv)
+        if pgm.config[CONST.WORKERS] > 1:
+            webrtcsvr_supervisor(pgm.config, sys.argv, pgm.logger).run()
+        else:
+            loop_monitor.run(pgm.main(pgm, sys.argv), pgm.config[CONST.EVENT_LOOP])
     except KeyboardInterrupt:
         if _INFO:
             traceback.print_exc()
@@ -0,0 +1,111 @@
+import multiprocessing
+import signal
+import time
+from logging import Logger
+
+from constants import constants as CONST
+
+
+class webrtcsvr_supervisor:
+    """Starts and watches the worker processes that each run a webrtcsvr on the same listening port (SO_REUSEPORT).
+
+    Each worker owns the sessions whose connections the kernel hands to it. A worker that dies is restarted, and when
+    the supervisor is asked to stop it sends SIGTERM to every worker so each one drains its own sessions before exiting.
+    """
+
+    RESTART_DELAY_SECONDS = 1.0
+    POLL_SECONDS = 0.5
+
+    def __init__(self, config: dict, args: list, logger: Logger):
+        """Constructor for the webrtcsvr_supervisor
+
+        Args:
+            config (dict): the configuration parsed by webrtcsvr.get_params
+            args (list): the command line arguments to be passed to each worker
+            logger (Logger): logger to record status
+        """
+        self.config = config
+        self.args = args
+        self.logger = logger
+        self.workers = {}
+        self.stopping = False
+        # spawn rather than fork so workers do not inherit the supervisor's threads or locks
+        self.mp_context = multiprocessing.get_context("spawn")
+
+    @staticmethod
+    def run_worker(worker_index: int, args: list):
+        """Entry point of a worker process
+
+        Args:
+            worker_index (int): the index of this worker (used to name its log file)
+            args (list): the command line arguments
+        """
+        # the supervisor owns Ctrl+C and tells workers to drain with SIGTERM
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        from loop_monitor import loop_monitor
+        from webrtcsvr import webrtcsvr
+
+        pgm = webrtcsvr(worker_index)
+        pgm.get_params(args)
+        loop_monitor.run(pgm.main(pgm, args), pgm.config[CONST.EVENT_LOOP])
+
+    def start_worker(self, worker_index: int):
+        """Starts (or restarts) the worker with the supplied index
+
+        Args:
+            worker_index (int): the index of the worker to be started
+        """
+        process = self.mp_context.Process(
+            target=webrtcsvr_supervisor.run_worker,
+            args=(worker_index, self.args),
+            name=f"webrtcsvr_w{worker_index}",
+        )
+        process.start()
+        self.workers[worker_index] = process
+        self.logger.info(f"Worker {worker_index} started with pid {process.pid}")
+
+    def request_stop(self, signum, _frame):
+        """Signal handler asking the supervisor to drain the workers and exit
+
+        Args:
+            signum (int): the signal received
+            _frame (FrameType): unused
+        """
+        self.logger.info(f"Supervisor received signal {signum}, draining workers.")
+        self.stopping = True
+
+    def run(self):
+        """Starts the workers and restarts any that exit until asked to stop, then drains them"""
+        signal.signal(signal.SIGINT, self.request_stop)
+        signal.signal(signal.SIGTERM, self.request_stop)
+        for worker_index in range(self.config[CONST.WORKERS]):
+            self.start_worker(worker_index)
+        print(
+            f"Please open a browser to http://{self.config[CONST.HOST]}:{self.config[CONST.PORT]} (or refresh the page if open) to begin the test."
+        )
+        while not self.stopping:
+            time.sleep(webrtcsvr_supervisor.POLL_SECONDS)
+            for worker_index, process in list(self.workers.items()):
+                if not process.is_alive() and not self.stopping:
+                    self.logger.warning(
+                        f"Worker {worker_index} exited with code {process.exitcode}, restarting."
+                    )
+                    time.sleep(webrtcsvr_supervisor.RESTART_DELAY_SECONDS)
+                    self.start_worker(worker_index)
+        self.drain()
+
+    def drain(self):
+        """Asks every worker to drain its sessions and waits for them, killing any that outlive the drain timeout"""
+        for process in self.workers.values():
+            if process.is_alive():
+                process.terminate()  # SIGTERM starts the worker's graceful drain
+        deadline = time.monotonic() + self.config[CONST.DRAIN_TIMEOUT] + 5.0
+        for worker_index, process in self.workers.items():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                self.logger.warning(
+                    f"Worker {worker_index} did not drain in time, killing it."
+                )
+                process.kill()
+                process.join()
+            self.logger.info(f"Worker {worker_index} exited with code {process.exitcode}")